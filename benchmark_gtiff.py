@@ -26,6 +26,7 @@ import gdal
 from gdalconst import GA_ReadOnly
 import os
 import timeit
+from processing.reader import TimeSeriesReader
 
 
 def read_bands(file, x, y):
@@ -71,6 +72,10 @@ def read_bands(file, x, y):
         value = data[0, 0]
         result.append(int(value))
 
+def read_bands_cached(reader, x, y):
+
+    # The same query through the block cache of a reader kept between calls
+    return [int(value) for value in reader.read_point(x, y)]
 
 
 def main(argv=None):
@@ -84,6 +89,11 @@ def main(argv=None):
                       number=50000)
     sys.stdout.write("%s\n" % t)
 
+    t = timeit.timeit('read_bands_cached(reader, x, y)',
+                      setup="from __main__ import read_bands_cached, TimeSeriesReader; x = -1600000; y = 700000; reader = TimeSeriesReader('%s');" % os.path.abspath(argv[1]),
+                      number=50000)
+    sys.stdout.write("%s (cached)\n" % t)
+
 if __name__ == "__main__":
     sys.exit(main())
 
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+#
+# Script which distributes the BFast breakpoint detection over many nodes
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+# Usage on a cluster that shares VITS_DATA_PATH:
+#
+#   distribute_bfast.py init h27v06 h28v06     once, split the tiles into units
+#   distribute_bfast.py work --wait            on every node, as often as wanted
+#   distribute_bfast.py merge h27v06 h28v06    once all units are completed
+#
+# To test locally, point --queue-dir to a temporary directory and start
+# several workers in the background.
+
+import os
+import os.path
+import sys
+import time
+import argparse
+import logging
+import logging.config
+try:
+    import gdal
+except ImportError:
+    import osgeo.gdal as gdal
+try:
+    import gdalconst
+except ImportError:
+    import osgeo.gdalconst as gdalconst
+import read_bfast_breaks
+from processing import bfast_numpy
+from processing.breakmap import BreakMapAccumulator
+from processing.breakmap import CompactBreakAccumulator
+from processing.maskindex import get_mask_index
+from processing.memo import BreakpointCache
+from processing.prescreen import Prescreen
+from processing.prescreen import NDVI_NODATA
+from processing.timeaxis import get_time_axis
+from processing.utilities import get_block_size
+from processing.workqueue import WorkQueue
+from processing.workqueue import Heartbeat
+
+# Variable log needs to be global
+log = None
+
+# Default lease time in seconds per engine. The lease is renewed by a
+# heartbeat thread, but rpy2 holds the interpreter during an R call, so the
+# lease must outlast the longest R call: one pixel with the r engine and a
+# whole window with the rblock engine.
+LEASE_TIMES = {"numpy": 600, "r": 1800, "rblock": 6 * 3600}
+
+def stack_filename(tile):
+    return '%s/MODIS/processed/NDVI/%s/NDVI.tif' % (os.environ['VITS_DATA_PATH'], tile)
+
+def mask_filename(tile):
+    return '%s/MODIS/processed/MASK/%s/MASK_%s.tif' % (os.environ['VITS_DATA_PATH'], tile, tile)
+
+def open_raster(filename):
+    ds = gdal.Open(filename, gdalconst.GA_ReadOnly)
+    if ds is None:
+        log.error('Raster file "%s" could not be opened.' % filename)
+        sys.exit(1)
+    return ds
+
+def init_units(queue, tiles, rows, engine, lease=None, min_std=None):
+    """
+    Split the tiles into units of block rows with valid mask pixels. The
+    rows are rounded up to full internal blocks of the stack. With min_std,
+    the workers pre-screen the series of the units.
+    """
+
+    if lease is None:
+        lease = LEASE_TIMES[engine]
+    for tile in tiles:
+        ds = open_raster(stack_filename(tile))
+        blockYSize = get_block_size(ds)[1]
+        unitRows = max(1, -(-rows // blockYSize)) * blockYSize
+        # Building the mask index here also caches it for all workers
+        mask_index = get_mask_index(mask_filename(tile), ds)
+        units = {}
+        for window, valid_pixels in mask_index:
+            units.setdefault(window[1] // unitRows, []).append(list(window))
+        for number in sorted(units):
+            queue.add("%s_%06d" % (tile, number * unitRows),
+                      {"tile": tile, "engine": engine, "lease": lease, "min_std": min_std,
+                       "windows": units[number]})
+        log.info("Tile %s: %d units with %d valid pixels" % (tile, len(units), mask_index.count))
+
+def work(queue, wait, poll_interval):
+    """
+    Claim and process units until no unit is left. With wait, the worker
+    keeps polling until all units are completed to claim expired leases.
+    """
+
+    # The stack, the time axis, the mask index, the breakpoint cache and the
+    # pre-screening of each tile
+    tiles = {}
+    processed = 0
+    while True:
+        claimed = queue.claim()
+        if claimed is None:
+            if wait and len(queue.completed()) < len(queue.units()):
+                time.sleep(poll_interval)
+                continue
+            break
+        unit, description = claimed
+        tile = description["tile"]
+        engine = description["engine"]
+
+        if tile not in tiles:
+            ds = open_raster(stack_filename(tile))
+            time_axis = get_time_axis(stack_filename(tile))
+            valid = dict((window, valid_pixels) for window, valid_pixels in get_mask_index(mask_filename(tile), ds))
+            nodata = ds.GetRasterBand(1).GetNoDataValue()
+            screen = None
+            if description.get("min_std") is not None:
+                screen = Prescreen(nodata if nodata is not None else NDVI_NODATA, 2 * time_axis.frequency, description["min_std"])
+            tiles[tile] = (ds, time_axis, valid, BreakpointCache(), screen)
+        ds, time_axis, valid, cache, screen = tiles[tile]
+        if engine == "numpy":
+            bfast_numpy.get_engine(time_axis.frequency)
+        elif read_bfast_breaks.get_engine is None:
+            log.error('Unit %s requires the R engine and rpy2.' % unit)
+            queue.release(unit)
+            sys.exit(1)
+        else:
+            read_bfast_breaks.get_engine(time_axis.start, time_axis.frequency)
+
+        starttime = time.time()
+        results = []
+        # Keep the lease while the windows are processed
+        heartbeat = Heartbeat(queue, unit)
+        heartbeat.start()
+        try:
+            for window in description["windows"]:
+                window = tuple(window)
+                block, codes = read_bfast_breaks.calc_block_breakpoints(ds, window, valid[window], engine, cache=cache, screen=screen)
+                for col, row, bps in block:
+                    results.append([col, row, [int(b) for b in bps]])
+                if heartbeat.lost:
+                    break
+        finally:
+            heartbeat.stop()
+        if heartbeat.lost:
+            # The lease expired and another worker took over the unit
+            log.warning("Lost the lease of unit %s" % unit)
+            continue
+        queue.complete(unit, results)
+        processed += 1
+        log.info("Unit %s: %d pixels in %.1f s" % (unit, len(results), time.time() - starttime))
+    log.info("Worker %s processed %d units" % (queue.worker, processed))
+
+def merge(queue, tiles, output, max_breaks):
+    """
+    Write the break files of tiles whose units are all completed. The number
+    of tiles that are not complete is returned.
+    """
+
+    units = {}
+    for unit in queue.units():
+        units.setdefault(queue.description(unit)["tile"], []).append(unit)
+    completed = set(queue.completed())
+
+    incomplete = 0
+    for tile in tiles:
+        pending = [unit for unit in units.get(tile, []) if unit not in completed]
+        if tile not in units or len(pending) > 0:
+            log.error("Tile %s is not complete, %d units are pending" % (tile, len(pending)))
+            incomplete += 1
+            continue
+
+        ds = open_raster(stack_filename(tile))
+        time_axis = get_time_axis(stack_filename(tile))
+        size = (ds.RasterXSize, ds.RasterYSize)
+        if output == "compact":
+            accumulator = CompactBreakAccumulator(size, max_breaks)
+        else:
+            accumulator = BreakMapAccumulator(size, ds.RasterCount)
+        for unit in units[tile]:
+            read_bfast_breaks.add_breaks(accumulator, queue.load(unit))
+        written = read_bfast_breaks.write_breaks(accumulator, tile, output, ds.GetProjection(), ds.GetGeoTransform(), time_axis)
+        log.info("%d break files written for tile %s" % (len(written), tile))
+    return incomplete
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+
+    # Parse the command line options
+    parser = argparse.ArgumentParser(description="Detect BFast breakpoints with workers on many nodes sharing a work queue.")
+    parser.add_argument("--queue-dir",
+                        help="Directory of the work queue (default: QUEUE in the processed data)")
+    subparsers = parser.add_subparsers(dest="command")
+    init_parser = subparsers.add_parser("init", help="Split tiles into work units")
+    init_parser.add_argument("tiles", nargs="+", help="MODIS tiles, e.g. h27v06")
+    init_parser.add_argument("--rows", type=int, default=128,
+                             help="Raster rows per work unit, rounded to full blocks (default: 128)")
+    init_parser.add_argument("--engine", choices=["r", "rblock", "numpy"], default="r",
+                             help="BFast implementation (default: r)")
+    init_parser.add_argument("--lease", type=float,
+                             help="Seconds until the lease of a unit expires without renewal (default: %s)" %
+                             ", ".join("%d for %s" % (LEASE_TIMES[engine], engine) for engine in sorted(LEASE_TIMES)))
+    init_parser.add_argument("--prescreen", action="store_true",
+                             help="Skip series that cannot have breaks instead of passing all mask pixels to the engine, the skipped pixels have no breakpoints (default: off)")
+    init_parser.add_argument("--min-std", type=float, default=10.0,
+                             help="With --prescreen, skip series whose standard deviation is below this value in stack units (default: 10)")
+    work_parser = subparsers.add_parser("work", help="Process work units")
+    work_parser.add_argument("--lease", type=float, default=600.0,
+                             help="Seconds until the lease of a unit expires without renewal if the unit does not set its own (default: 600)")
+    work_parser.add_argument("--wait", action="store_true",
+                             help="Keep polling until all units are completed")
+    work_parser.add_argument("--poll-interval", type=float, default=30.0,
+                             help="Seconds between polls with --wait (default: 30)")
+    merge_parser = subparsers.add_parser("merge", help="Write the break files of completed tiles")
+    merge_parser.add_argument("tiles", nargs="+", help="MODIS tiles, e.g. h27v06")
+    merge_parser.add_argument("--output", choices=["dates", "compact"], default="dates",
+                              help="Write one break file per date or the compact break products (default: dates)")
+    merge_parser.add_argument("--max-breaks", type=int, default=5,
+                              help="Number of break index bands in the compact output (default: 5)")
+    args = parser.parse_args(argv[1:])
+
+    # Get the logging configuration file
+    logging.config.fileConfig(argv[0].replace("py", "ini"))
+    # Get the root logger from the config file
+    global log
+    log = logging.getLogger(__name__)
+    read_bfast_breaks.log = logging.getLogger(read_bfast_breaks.__name__)
+
+    # Check if VITS_DATA_PATH is set as environment variable
+    if "VITS_DATA_PATH" not in os.environ:
+        log.error('"VITS_DATA_PATH" is not set in the environment.')
+        sys.exit(1)
+
+    queue_dir = args.queue_dir
+    if queue_dir is None:
+        queue_dir = "%s/MODIS/processed/QUEUE" % os.environ['VITS_DATA_PATH']
+
+    if args.command == "init":
+        init_units(WorkQueue(queue_dir), args.tiles, args.rows, args.engine, args.lease,
+                   args.min_std if args.prescreen else None)
+    elif args.command == "work":
+        work(WorkQueue(queue_dir, args.lease), args.wait, args.poll_interval)
+    elif args.command == "merge":
+        if merge(WorkQueue(queue_dir), args.tiles, args.output, args.max_breaks) > 0:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
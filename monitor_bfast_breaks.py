@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+#
+# Script which monitors newly arrived MODIS NDVI images for breaks
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import os
+import os.path
+import sys
+import math
+import time
+import argparse
+import logging
+import logging.config
+import numpy
+try:
+    import gdal
+except ImportError:
+    import osgeo.gdal as gdal
+try:
+    import gdalconst
+except ImportError:
+    import osgeo.gdalconst as gdalconst
+from processing.maskindex import get_mask_index
+from processing.monitor import MonitorStore
+from processing.monitor import critical_value
+from processing.utilities import create_gtiff
+from processing.utilities import read_block
+from processing.timeaxis import get_time_axis
+from processing.prescreen import NDVI_NODATA
+
+# Variable log needs to be global
+log = None
+
+def scaled_block(ds, window, bands, nodata):
+    """
+    Read bands of a block as NDVI with NaN for NODATA observations.
+    """
+
+    cube = read_block(ds, *window, bands=bands)
+    return numpy.where(cube == nodata, numpy.nan, cube / 10000.0)
+
+def fit_models(store, ds, mask_index, history, frequency, nodata, args):
+    """
+    Fit the history models of all pixels within the mask.
+    """
+
+    window = int(math.floor(args.h * history))
+    log.info("Fitting the history models of %d bands, MOSUM window %d bands" % (history, window))
+    state = {"history": history, "window": window, "processed": history,
+             "frequency": frequency, "order": args.order, "h": args.h, "level": args.level,
+             "critical_value": critical_value(history, window, frequency, args.order, args.level, args.period)}
+    store.create((ds.RasterXSize, ds.RasterYSize), state)
+
+    for window, valid_pixels in mask_index:
+        cube = scaled_block(ds, window, range(1, history + 1), nodata)
+        valid = numpy.zeros(cube.shape[1:], dtype=bool)
+        valid[valid_pixels[:, 0], valid_pixels[:, 1]] = True
+        store.fit_block(window, cube, valid)
+    store.save()
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+
+    # Parse the command line options
+    parser = argparse.ArgumentParser(description="Test newly arrived NDVI bands against per-pixel history models.")
+    parser.add_argument("tiles", nargs="+", help="MODIS tiles, e.g. h27v06")
+    parser.add_argument("--init", action="store_true",
+                        help="Fit the history models again even if they exist")
+    parser.add_argument("--history", type=int,
+                        help="Number of bands of the stable history period (default: all bands at initialization)")
+    parser.add_argument("--order", type=int, default=3,
+                        help="Number of harmonic terms of the season model (default: 3)")
+    parser.add_argument("--h", type=float, default=0.25,
+                        help="MOSUM window size as fraction of the history (default: 0.25)")
+    parser.add_argument("--level", type=float, default=0.05,
+                        help="Significance level of the monitoring (default: 0.05)")
+    parser.add_argument("--period", type=float, default=2.0,
+                        help="Monitored period as multiple of the history to calibrate the boundary for (default: 2)")
+    args = parser.parse_args(argv[1:])
+
+    # Get the logging configuration file
+    logging.config.fileConfig(argv[0].replace("py", "ini"))
+    # Get the root logger from the config file
+    global log
+    log = logging.getLogger(__name__)
+
+    # Register the GeoTiff driver
+    driver = gdal.GetDriverByName("GTiff")
+    driver.Register()
+
+    # Process MODIS tiles
+    for tile in args.tiles:
+
+        # Check if VITS_DATA_PATH is set as environment variable
+        if "VITS_DATA_PATH" not in os.environ:
+            log.error('"VITS_DATA_PATH" is not set in the environment.')
+            sys.exit(1)
+        # The history models are only fitted for non-NODATA mask pixels
+        mask_filename = '%s/MODIS/processed/MASK/%s/MASK_%s.tif' % (os.environ['VITS_DATA_PATH'], tile, tile)
+        if not os.path.exists(mask_filename):
+            log.error('Raster file "%s" could not be opened.' % mask_filename)
+            sys.exit(1)
+
+        # Open the stacked NDVI image
+        filename = '%s/MODIS/processed/NDVI/%s/NDVI.tif' % (os.environ['VITS_DATA_PATH'], tile)
+        ds = gdal.Open(filename, gdalconst.GA_ReadOnly)
+        if ds is None:
+            log.error('Raster file "%s" could not be opened.' % filename)
+            sys.exit(1)
+        mask_index = get_mask_index(mask_filename, ds)
+
+        # The dates of the bands of the stack
+        time_axis = get_time_axis(filename)
+        if len(time_axis) != ds.RasterCount:
+            log.error('The time axis of "%s" has %d dates but the stack has %d bands.' % (filename, len(time_axis), ds.RasterCount))
+            sys.exit(1)
+        # The fill value of the NDVI stack
+        nodata = ds.GetRasterBand(1).GetNoDataValue()
+        if nodata is None:
+            nodata = NDVI_NODATA
+
+        monitor_path = '%s/MODIS/processed/MONITOR/%s' % (os.environ['VITS_DATA_PATH'], tile)
+        store = MonitorStore(os.path.join(monitor_path, "model"))
+        if args.init or not store.exists():
+            history = args.history if args.history is not None else ds.RasterCount
+            window = int(math.floor(args.h * history))
+            if history > ds.RasterCount:
+                log.error("The history of %d bands is longer than the stack of tile %s with %d bands" % (history, tile, ds.RasterCount))
+                sys.exit(1)
+            # The moving window needs at least one band and the history
+            # needs at least two windows and more bands than regressors
+            if window < 1 or 2 * window > history or history <= 2 + 2 * args.order:
+                log.error("A history of %d bands and a MOSUM window of %d bands can not be monitored, see --history and --h" % (history, window))
+                sys.exit(1)
+            fit_models(store, ds, mask_index, history, time_axis.frequency, nodata, args)
+        else:
+            store.open()
+
+        # Test only the bands that arrived since the last run
+        first = store.state["processed"] + 1
+        if first > ds.RasterCount:
+            log.info("No new bands for tile %s" % tile)
+            continue
+        for index in range(first, ds.RasterCount + 1):
+            starttime = time.time()
+            breaks = 0
+            for window, valid_pixels in mask_index:
+                # The new band and the band that leaves the moving window
+                cube = scaled_block(ds, window, [index, index - store.state["window"]], nodata)
+                breaks += store.update_block(window, index, cube[0], cube[1])
+            store.state["processed"] = index
+            store.save()
+            log.info("Band %d of tile %s: %d new breaks, it took %.1f s" % (index, tile, breaks, time.time() - starttime))
+
+        # Write the band index of the first break per pixel
+        output = os.path.join(monitor_path, "MONITOR_BREAK_MOD13Q1.%s.tif" % tile)
+        dataset = create_gtiff(output, (ds.RasterXSize, ds.RasterYSize), ds.GetProjection(), ds.GetGeoTransform(), gdalconst.GDT_Int16)
+        dataset.GetRasterBand(1).WriteArray(numpy.asarray(store.break_band), 0, 0)
+        # Close the dataset in order to write the data persistently to the file
+        dataset = None
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+#
+# Persistent R engine to calculate BFast breakpoints
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import time
+import numpy
+import rpy2.rinterface as rinterface
+import rpy2.robjects as robjects
+from rpy2.robjects.packages import importr
+try:
+    from rpy2.robjects import numpy2ri
+except ImportError:
+    numpy2ri = None
+
+# R function that runs bfast over the columns of a (time, pixels) matrix and
+# returns an integer matrix (max_breaks, pixels) of breakpoints padded with 0.
+# A pixel where bfast fails gets -1 as first element.
+BLOCK_FUNCTION = """
+function(m, start, frequency, h, season, max_iter, max_breaks, cores) {
+    fit <- function(i) {
+        result <- integer(max_breaks)
+        tryCatch({
+            b <- bfast(ts(m[, i], start=start, frequency=frequency), h=h,
+                       season=season, max.iter=max_iter)
+            bp <- b$output[[length(b$output)]]$bp.Vt$breakpoints
+            if (!all(is.na(bp))) {
+                n <- min(length(bp), max_breaks)
+                result[seq_len(n)] <- as.integer(bp[seq_len(n)])
+            }
+            result
+        }, error=function(e) c(-1L, integer(max_breaks - 1)))
+    }
+    columns <- seq_len(ncol(m))
+    if (cores > 1) {
+        results <- parallel::mclapply(columns, fit, mc.cores=cores)
+    } else {
+        results <- lapply(columns, fit)
+    }
+    matrix(as.integer(unlist(results)), nrow=max_breaks)
+}
+"""
+
+def _to_r_matrix(Y):
+    """
+    Convert a (time, pixels) array to a R matrix with one conversion.
+    """
+
+    Y = numpy.asarray(Y, dtype=float)
+    if numpy2ri is not None and hasattr(numpy2ri, "py2rpy"):
+        return numpy2ri.py2rpy(Y)
+    if numpy2ri is not None and hasattr(numpy2ri, "numpy2ri"):
+        return numpy2ri.numpy2ri(Y)
+    # R matrices are stored column by column
+    return robjects.r['matrix'](robjects.FloatVector(Y.ravel(order="F")), nrow=Y.shape[0])
+
+# The engine is created once per process, see get_engine()
+_engine = None
+
+class BfastEngine(object):
+    """
+    Long-lived BFast engine. R, the bfast and the strucchange packages are
+    initialized once when the engine is created. The R functions and the
+    time series start and frequency objects are prebuilt and reused for every
+    call.
+    """
+
+    def __init__(self, start=(2000, 4), frequency=23, season="harmonic", max_iter=2):
+
+        # Start timing the initialization
+        startTime = time.time()
+
+        # Initialize R
+        rinterface.initr()
+        self.r = robjects.r
+        # Import the bfast package and strucchange which is used by bfast to
+        # find the breakpoints
+        importr('strucchange')
+        importr('bfast')
+
+        # Prebuilt R functions and objects
+        self._ts = self.r['ts']
+        self._bfast = self.r['bfast']
+        self._start = robjects.IntVector(list(start))
+        self.frequency = frequency
+        self.season = season
+        self.max_iter = max_iter
+        # Processes of parallel::mclapply in breakpoints_block()
+        self.cores = 1
+        self._block = None
+        self.errors = 0
+
+        # Segment size h per series length, see segment_size()
+        self._h = {}
+
+        # Overhead counters
+        self.init_time = time.time() - startTime
+        self.calls = 0
+        self.setup_time = 0.0
+        self.fit_time = 0.0
+
+    def set_time_axis(self, start, frequency):
+        """
+        Set the start (year, period) and the frequency of the time series.
+        """
+
+        self._start = robjects.IntVector(list(start))
+        if frequency != self.frequency:
+            self.frequency = frequency
+            self._h = {}
+
+    def segment_size(self, length):
+        """
+        Minimal segment size between potentially detected breaks as fraction
+        of the series length: one full season.
+        """
+
+        if length not in self._h:
+            self._h[length] = float(self.frequency) / float(length)
+        return self._h[length]
+
+    def breakpoints(self, data_array):
+        """
+        Calculate the BFast breakpoints of a time series. The 1-based indices
+        of the breakpoints are returned as list, the list is empty if no break
+        is found.
+        """
+
+        startTime = time.time()
+
+        # Create a R timeseries from the Python array
+        b_ts = self._ts(robjects.FloatVector(data_array), start=self._start, frequency=self.frequency)
+        h = self.segment_size(len(data_array))
+
+        fitTime = time.time()
+
+        # Calculate BFast
+        b_bfast = self._bfast(b_ts, h=h, season=self.season, max_iter=self.max_iter)
+
+        endFitTime = time.time()
+
+        # Get the "output" attribute from the BFast result
+        output = b_bfast[b_bfast.names.index("output")]
+        # Number of iteration
+        nbrOfIter = len(output)
+        # Get the break points
+        breakpointsOutput = output.rx2(nbrOfIter).rx("bp.Vt")[0]
+        # Get the break points as a "breakpoints" R object, see also:
+        # http://cran.r-project.org/web/packages/strucchange/strucchange.pdf#Rfn.breakpoints
+        breakpoints = breakpointsOutput[breakpointsOutput.names.index("breakpoints")]
+
+        if breakpoints[0] == robjects.NA_Logical:
+            result = []
+        else:
+            result = [int(breakpoints[b]) for b in range(len(breakpoints))]
+
+        endTime = time.time()
+
+        # Update the overhead counters
+        self.calls += 1
+        self.fit_time += endFitTime - fitTime
+        self.setup_time += (fitTime - startTime) + (endTime - endFitTime)
+
+        # Return the list of breakpoints as Python array
+        return result
+
+    def breakpoints_block(self, Y):
+        """
+        Calculate the BFast breakpoints of all series of a (time, pixels)
+        array with one call into R. A list of lists of 1-based breakpoints is
+        returned like by the NumPy engine. Series where bfast fails have no
+        breakpoints, their number is kept in self.errors.
+        """
+
+        startTime = time.time()
+
+        if self._block is None:
+            self._block = self.r(BLOCK_FUNCTION)
+        length = Y.shape[0]
+        h = self.segment_size(length)
+        # bfast finds at most one break less than segments fit into the series
+        max_breaks = max(1, length // self.frequency - 1)
+        matrix = _to_r_matrix(Y)
+
+        fitTime = time.time()
+
+        result = self._block(matrix, self._start, self.frequency, h, self.season, self.max_iter, max_breaks, self.cores)
+
+        endFitTime = time.time()
+
+        # The values of R matrices are ordered column by column, i.e. pixel by
+        # pixel
+        breaks = numpy.array(list(result), dtype=int).reshape((Y.shape[1], max_breaks))
+        failed = breaks[:, 0] < 0
+        self.errors += int(numpy.sum(failed))
+        breaks[failed] = 0
+        results = [[int(b) for b in row if b > 0] for row in breaks]
+
+        endTime = time.time()
+
+        # Update the overhead counters per pixel
+        self.calls += Y.shape[1]
+        self.fit_time += endFitTime - fitTime
+        self.setup_time += (fitTime - startTime) + (endTime - endFitTime)
+
+        return results
+
+    def overhead(self):
+        """
+        Get the overhead statistics of the engine as dictionary. The setup
+        time includes the conversion from and to R objects, the fit time is
+        the time spent in bfast itself.
+        """
+
+        calls = max(self.calls, 1)
+        total = self.setup_time + self.fit_time
+        return {
+            "calls": self.calls,
+            "init_time": self.init_time,
+            "setup_time_per_call": self.setup_time / calls,
+            "fit_time_per_call": self.fit_time / calls,
+            "setup_ratio": self.setup_time / total if total > 0 else 0.0
+        }
+
+    def log_overhead(self, log):
+        """
+        Log a summary of the overhead statistics.
+        """
+
+        stats = self.overhead()
+        log.info("BFast engine: %d calls, initialization took %.3f s, %.6f s setup and %.6f s fitting per call (%.1f%% setup)" % (
+            stats["calls"], stats["init_time"], stats["setup_time_per_call"],
+            stats["fit_time_per_call"], stats["setup_ratio"] * 100.0))
+
+def get_engine(start=None, frequency=None):
+    """
+    Get the BFast engine of the current process. The engine is created on the
+    first call. The start (year, period) and the frequency of the time series,
+    see processing.timeaxis, are changed if given.
+    """
+
+    global _engine
+    if _engine is None:
+        _engine = BfastEngine()
+    if start is not None:
+        _engine.set_time_axis(start, frequency if frequency is not None else _engine.frequency)
+    return _engine
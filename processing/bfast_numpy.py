@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+#
+# Vectorised NumPy implementation of the BFast breakpoint detection
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+# The implementation follows the R packages bfast and strucchange, see also:
+# http://cran.r-project.org/web/packages/bfast/bfast.pdf
+# http://cran.r-project.org/web/packages/strucchange/strucchange.pdf
+#
+# All time series are handled as numpy.array with the shape (time, pixels),
+# the same layout as a block cube read by processing.utilities.read_block.
+
+import math
+import numpy
+from processing.regression import get_model
+
+# The engine is created once per process, see get_engine()
+_engine = None
+
+# Simulated null distributions of the OLS-MOSUM statistic per window size
+_mosum_distributions = {}
+
+def _simulate_mosum(h, simulations=5000, steps=1000):
+    """
+    Simulate the limiting process of the OLS-MOSUM statistic, the maximum
+    absolute increment of a Brownian bridge over a window of relative size h.
+    The sorted maxima are returned.
+    """
+
+    # A fixed seed makes the p-values reproducible between runs
+    random = numpy.random.RandomState(20140101)
+    window = max(1, int(round(h * steps)))
+    maxima = []
+    for i in range(0, simulations, 500):
+        size = min(500, simulations - i)
+        w = numpy.zeros((size, steps + 1))
+        w[:, 1:] = numpy.cumsum(random.standard_normal((size, steps)), axis=1) / math.sqrt(steps)
+        bridge = w - numpy.linspace(0.0, 1.0, steps + 1)[None, :] * w[:, -1:]
+        increments = bridge[:, window:] - bridge[:, :-window]
+        maxima.append(numpy.max(numpy.abs(increments), axis=1))
+    return numpy.sort(numpy.concatenate(maxima))
+
+def mosum_pvalue(design, Y, h):
+    """
+    OLS-MOSUM test for parameter constancy (efp and sctest in strucchange) of
+    each column of Y. The design is a processing.regression.DesignMatrix. The
+    p-values are taken from a simulation of the limiting process instead of
+    the tabulated critical values.
+    """
+
+    n, k = design.X.shape
+    residuals = design.residuals(Y)
+    nh = int(math.floor(n * h))
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        sigma = numpy.sqrt(numpy.sum(residuals ** 2, axis=0) / (n - k))
+        process = numpy.zeros((n + 1, Y.shape[1]))
+        process[1:] = numpy.cumsum(residuals, axis=0)
+        process = (process[nh:] - process[:n - nh + 1]) / (sigma * math.sqrt(n))
+        stat = numpy.max(numpy.abs(process), axis=0)
+
+    key = round(h, 6)
+    if key not in _mosum_distributions:
+        _mosum_distributions[key] = _simulate_mosum(h)
+    maxima = _mosum_distributions[key]
+
+    pvalues = 1.0 - numpy.searchsorted(maxima, stat, side='left') / float(len(maxima))
+    # Constant series have no variance and can not have a break
+    pvalues[~numpy.isfinite(stat) | (sigma < 1e-10)] = 1.0
+    return pvalues
+
+def segment_rss(X, Y, h):
+    """
+    Residual sum of squares of the OLS fit of all segments with at least h
+    observations. The result has the shape (start, end, pixels) with 0-based,
+    inclusive start and end indices and is infinite for shorter segments.
+    """
+
+    n, k = X.shape
+    pixels = Y.shape[1]
+
+    # Cumulative cross products to get the normal equations of any segment
+    XX = numpy.zeros((n + 1, k, k))
+    XX[1:] = numpy.cumsum(X[:, :, None] * X[:, None, :], axis=0)
+    XY = numpy.zeros((n + 1, k, pixels))
+    XY[1:] = numpy.cumsum(X[:, :, None] * Y[:, None, :], axis=0)
+    YY = numpy.zeros((n + 1, pixels))
+    YY[1:] = numpy.cumsum(Y ** 2, axis=0)
+
+    rss = numpy.empty((n, n, pixels))
+    rss.fill(numpy.inf)
+    for start in range(0, n - h + 1):
+        ends = numpy.arange(start + h - 1, n)
+        G = XX[ends + 1] - XX[start]
+        C = XY[ends + 1] - XY[start]
+        B = numpy.linalg.solve(G, C)
+        rss[start, ends] = numpy.maximum(YY[ends + 1] - YY[start] - numpy.sum(C * B, axis=1), 0.0)
+
+    return rss
+
+def breakpoints(X, Y, h, breaks=None):
+    """
+    Dating of structural changes (breakpoints in strucchange) with dynamic
+    programming. The optimal number of breaks is selected by the BIC. The
+    1-based indices of the last observation before each break are returned
+    with the shape (pixels, breaks), padded with 0.
+    """
+
+    n, k = X.shape
+    pixels = Y.shape[1]
+    if h <= k:
+        raise ValueError("minimum segment size must be greater than the number of regressors")
+    if h > n // 2:
+        raise ValueError("minimum segment size must be smaller than half the number of observations")
+    if breaks is None:
+        breaks = int(math.ceil(float(n) / h)) - 2
+
+    rss = segment_rss(X, Y, h)
+    columns = numpy.arange(pixels)
+
+    # RSS.table: the optimal RSS of the series up to observation i (1-based)
+    # with m breaks and the optimal previous partner of the m-th break
+    cost = numpy.empty((n + 1, pixels))
+    cost.fill(numpy.inf)
+    index = numpy.arange(h, n - h + 1)
+    cost[index] = rss[0, index - 1]
+    tables = [(cost, None)]
+    for m in range(2, breaks + 1):
+        previous = tables[-1][0]
+        cost = numpy.empty((n + 1, pixels))
+        cost.fill(numpy.inf)
+        partner = numpy.zeros((n + 1, pixels), dtype=int)
+        for i in range(m * h, n - h + 1):
+            candidates = numpy.arange((m - 1) * h, i - h + 1)
+            values = previous[candidates] + rss[candidates, i - 1]
+            opt = numpy.argmin(values, axis=0)
+            cost[i] = values[opt, columns]
+            partner[i] = candidates[opt]
+        tables.append((cost, partner))
+
+    # Extract the optimal breaks and the BIC for each number of breaks
+    logn = math.log(n)
+    with numpy.errstate(divide='ignore'):
+        best_bic = n * (numpy.log(rss[0, n - 1]) + 1.0 - logn + math.log(2.0 * math.pi)) + logn * (k + 1)
+    result = numpy.zeros((pixels, breaks), dtype=int)
+    for m in range(1, breaks + 1):
+        values = tables[m - 1][0][index] + rss[index, n - 1]
+        opt = numpy.argmin(values, axis=0)
+        total = values[opt, columns]
+        with numpy.errstate(divide='ignore'):
+            bic = n * (numpy.log(total) + 1.0 - logn + math.log(2.0 * math.pi)) + logn * (k + 1) * (m + 1)
+        better = bic < best_bic
+        if not numpy.any(better):
+            continue
+        best_bic = numpy.where(better, bic, best_bic)
+
+        # Backtrack the partners of the last break
+        selected = numpy.zeros((pixels, m), dtype=int)
+        selected[:, m - 1] = index[opt]
+        for j in range(m - 1, 0, -1):
+            selected[:, j - 1] = tables[j][1][selected[:, j], columns]
+        result[better] = 0
+        result[better, :m] = selected[better]
+
+    return result
+
+def piecewise_fit(X, Y, bps):
+    """
+    Fitted values of separate OLS fits of Y on X in each segment between the
+    breakpoints. Breakpoints are given with the shape (pixels, breaks) as
+    returned by breakpoints().
+    """
+
+    n, k = X.shape
+    pixels = Y.shape[1]
+    segments = bps.shape[1] + 1
+
+    # Segment of each observation (time, pixels)
+    t = numpy.arange(1, n + 1)
+    segment = numpy.sum((bps[None, :, :] > 0) & (t[:, None, None] > bps[None, :, :]), axis=2)
+    groups = (numpy.arange(pixels)[None, :] * segments + segment).ravel()
+    nbrOfGroups = pixels * segments
+
+    # Normal equations per pixel and segment
+    G = numpy.zeros((nbrOfGroups, k, k))
+    C = numpy.zeros((nbrOfGroups, k))
+    for a in range(k):
+        weights = numpy.repeat(X[:, a], pixels)
+        C[:, a] = numpy.bincount(groups, weights * Y.ravel(), nbrOfGroups)
+        for b in range(a, k):
+            G[:, a, b] = numpy.bincount(groups, weights * numpy.repeat(X[:, b], pixels), nbrOfGroups)
+            G[:, b, a] = G[:, a, b]
+    # Segments without observations are not used
+    empty = numpy.bincount(groups, minlength=nbrOfGroups) == 0
+    G[empty] = numpy.eye(k)
+
+    beta = numpy.linalg.solve(G, C[:, :, None])[:, :, 0]
+    return numpy.sum(X[:, None, :] * beta[groups].reshape(n, pixels, k), axis=2)
+
+def initial_season(Y, frequency):
+    """
+    Initial seasonal component from a classical decomposition: the mean of
+    each cycle position after removing a centered moving average. bfast uses
+    stl(Yt, "periodic") here, the result is similar for regular series.
+    """
+
+    n, pixels = Y.shape
+    if frequency % 2 == 1:
+        weights = numpy.ones(frequency)
+    else:
+        weights = numpy.ones(frequency + 1)
+        weights[0] = weights[-1] = 0.5
+    weights /= frequency
+    half = len(weights) // 2
+
+    trend = numpy.empty(Y.shape)
+    trend.fill(numpy.nan)
+    for i in range(half, n - half):
+        trend[i] = numpy.dot(weights, Y[i - half:i + half + 1])
+    detrended = Y - trend
+
+    position = numpy.arange(n) % frequency
+    season = numpy.zeros((frequency, pixels))
+    for p in range(frequency):
+        values = detrended[position == p]
+        values = values[~numpy.isnan(values[:, 0])]
+        if len(values) > 0:
+            season[p] = numpy.mean(values, axis=0)
+    season -= numpy.mean(season, axis=0)
+    return season[position]
+
+class NumpyBfastEngine(object):
+    """
+    BFast engine without R. The season and trend decomposition, the OLS-MOSUM
+    tests and the breakpoints search are calculated for a whole block of
+    pixels at once. The interface matches processing.bfast.BfastEngine.
+
+    Differences to the R implementation: the initial season is estimated by
+    a classical decomposition instead of STL, fits without breaks use OLS
+    instead of rlm and the MOSUM p-values are simulated.
+    """
+
+    def __init__(self, frequency=23, season="harmonic", max_iter=2, level=0.05, order=3, chunk_size=128):
+
+        if season != "harmonic":
+            raise ValueError("Only the harmonic season model is supported")
+        self.frequency = frequency
+        self.season = season
+        self.max_iter = max_iter
+        self.level = level
+        self.order = order
+        # Number of pixels processed together, the RSS table of a chunk needs
+        # time * time * chunk_size * 8 bytes
+        self.chunk_size = chunk_size
+
+        self.calls = 0
+
+    def segment_size(self, length):
+        """
+        Minimal segment size between potentially detected breaks as fraction
+        of the series length: one full season.
+        """
+
+        return float(self.frequency) / float(length)
+
+    def breakpoints(self, data_array):
+        """
+        Calculate the BFast breakpoints of a single time series. The 1-based
+        indices of the breakpoints are returned as list.
+        """
+
+        return self.breakpoints_block(numpy.asarray(data_array, dtype=float)[:, None])[0]
+
+    def breakpoints_block(self, Y):
+        """
+        Calculate the BFast breakpoints of all time series in Y with the shape
+        (time, pixels). A list with the breakpoints of each pixel is returned.
+        """
+
+        Y = numpy.asarray(Y, dtype=float)
+        result = []
+        for i in range(0, Y.shape[1], self.chunk_size):
+            bps = self._bfast(Y[:, i:i + self.chunk_size])
+            result.extend([[int(b) for b in row if b > 0] for row in bps])
+        self.calls += Y.shape[1]
+        return result
+
+    def _detect(self, design, Y, h, hInt, breaks):
+        """
+        Test for a structural change and date the breaks where the test is
+        significant.
+        """
+
+        bps = numpy.zeros((Y.shape[1], breaks), dtype=int)
+        significant = numpy.flatnonzero(mosum_pvalue(design, Y, h) <= self.level)
+        if len(significant) > 0:
+            bps[significant] = breakpoints(design.X, Y[:, significant], hInt, breaks)
+        return bps
+
+    def _bfast(self, Y):
+        """
+        Iterative season and trend decomposition of bfast. The trend
+        breakpoints of the last iteration are returned with the shape
+        (pixels, breaks).
+        """
+
+        n, pixels = Y.shape
+        h = self.segment_size(n)
+        hInt = int(math.floor(n * h))
+        breaks = int(math.ceil(float(n) / hInt)) - 2
+
+        # The design matrices are shared by all blocks of the same length
+        model = get_model(n, self.frequency, self.order)
+        St = initial_season(Y, self.frequency)
+
+        result = numpy.zeros((pixels, breaks), dtype=int)
+        # Like CheckTimeTt and CheckTimeSt of bfast the breakpoints of the
+        # previous iteration start with a value that is never a breakpoint,
+        # the second iteration runs even if the first finds no breaks
+        previousVt = numpy.empty((pixels, breaks), dtype=int)
+        previousVt[:] = -1
+        previousWt = numpy.empty((pixels, breaks), dtype=int)
+        previousWt[:] = -1
+        # Pixels whose breakpoints still change between iterations
+        active = numpy.arange(pixels)
+        for i in range(self.max_iter):
+            # Trend
+            Vt = Y[:, active] - St[:, active]
+            bpVt = self._detect(model.trend, Vt, h, hInt, breaks)
+            Tt = piecewise_fit(model.trend.X, Vt, bpVt)
+            # Season
+            Wt = Y[:, active] - Tt
+            bpWt = self._detect(model.season, Wt, h, hInt, breaks)
+            St[:, active] = piecewise_fit(model.season.X, Wt, bpWt)
+
+            result[active] = bpVt
+            changed = numpy.any(bpVt != previousVt[active], axis=1) | numpy.any(bpWt != previousWt[active], axis=1)
+            previousVt[active] = bpVt
+            previousWt[active] = bpWt
+            active = active[changed]
+            if len(active) == 0:
+                break
+
+        return result
+
+def get_engine(frequency=None):
+    """
+    Get the NumPy BFast engine of the current process. The engine is created
+    on the first call. The frequency of the time series is changed if given.
+    """
+
+    global _engine
+    if _engine is None:
+        _engine = NumpyBfastEngine()
+    if frequency is not None:
+        _engine.frequency = frequency
+    return _engine
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+#
+# In-memory accumulator for the BFast break maps of a tile
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import os
+import sqlite3
+import numpy
+try:
+    import gdalconst
+except ImportError:
+    import osgeo.gdalconst as gdalconst
+from processing.utilities import create_gtiff
+
+class BreakMapAccumulator(object):
+    """
+    Collect the breakpoints of a tile as one bit-packed break raster per band
+    of the NDVI stack. Each raster needs (rows * cols / 8) bytes and is only
+    allocated when the first break for its band is added. With a scratch file
+    all rasters are kept in a memory-mapped file instead.
+    The break files are written once, in full, by flush().
+    """
+
+    def __init__(self, size, bands, scratch=None):
+
+        self.size = size
+        self.bands = bands
+        # Bytes per packed row
+        self._rowBytes = (size[0] + 7) // 8
+
+        if scratch is not None:
+            self._rasters = numpy.memmap(scratch, dtype=numpy.uint8, mode='w+',
+                                         shape=(bands, size[1], self._rowBytes))
+            self._used = numpy.zeros(bands, dtype=bool)
+        else:
+            self._rasters = {}
+            self._used = None
+
+    def _raster(self, band):
+        """
+        Get the packed raster of a 1-based band index.
+        """
+
+        if self._used is not None:
+            self._used[band - 1] = True
+            return self._rasters[band - 1]
+        if band not in self._rasters:
+            self._rasters[band] = numpy.zeros((self.size[1], self._rowBytes), dtype=numpy.uint8)
+        return self._rasters[band]
+
+    def add(self, col, row, breakpoints):
+        """
+        Add the breakpoints of a pixel. The breakpoints are 1-based band
+        indices as returned by the BFast engines.
+        """
+
+        for breakpoint in breakpoints:
+            raster = self._raster(breakpoint)
+            # Same bit order as numpy.packbits
+            raster[row, col >> 3] |= 0x80 >> (col & 7)
+
+    def bands_with_breaks(self):
+        """
+        Get the sorted 1-based band indices with at least one break.
+        """
+
+        if self._used is not None:
+            return [int(b) + 1 for b in numpy.flatnonzero(self._used)]
+        return sorted(self._rasters)
+
+    def get_break_map(self, band):
+        """
+        Get the break raster of a band as uint8 array with 1 for breaks and 0
+        (NODATA) elsewhere.
+        """
+
+        raster = self._raster(band)
+        return numpy.unpackbits(raster, axis=1)[:, :self.size[0]]
+
+    def flush(self, filename, projection, geotransform):
+        """
+        Write a break file for each band with at least one break. The
+        filename function gets the 1-based band index and returns the output
+        file name. Existing files are replaced. The written file names are
+        returned.
+        """
+
+        written = []
+        for band in self.bands_with_breaks():
+            name = filename(band)
+            dataset = create_gtiff(name, self.size, projection, geotransform)
+            dataset.GetRasterBand(1).WriteArray(self.get_break_map(band), 0, 0)
+            # Close the dataset in order to write the data persistently to the file
+            dataset = None
+            written.append(name)
+        return written
+
+class CompactBreakAccumulator(object):
+    """
+    Collect the breakpoints of a tile as a few dense rasters instead of one
+    sparse raster per band: the number of breaks, the first and the last break
+    and up to max_breaks break indices per pixel. All indices are 1-based band
+    indices, 0 is NODATA. Each break is additionally kept as event for the
+    sparse break table.
+    """
+
+    def __init__(self, size, max_breaks=5):
+
+        self.size = size
+        self.max_breaks = max_breaks
+
+        shape = (size[1], size[0])
+        self.count = numpy.zeros(shape, dtype=numpy.uint8)
+        self.last = numpy.zeros(shape, dtype=numpy.int16)
+        self.indices = numpy.zeros((max_breaks,) + shape, dtype=numpy.int16)
+        # List of (col, row, band) tuples
+        self.events = []
+
+    def add(self, col, row, breakpoints):
+        """
+        Add the breakpoints of a pixel. The breakpoints are 1-based band
+        indices as returned by the BFast engines.
+        """
+
+        if len(breakpoints) == 0:
+            return
+        breakpoints = sorted(breakpoints)
+        self.count[row, col] = min(len(breakpoints), 255)
+        self.last[row, col] = breakpoints[-1]
+        for i, breakpoint in enumerate(breakpoints[:self.max_breaks]):
+            self.indices[i, row, col] = breakpoint
+        self.events.extend((col, row, breakpoint) for breakpoint in breakpoints)
+
+    def flush(self, prefix, suffix, projection, geotransform, dates):
+        """
+        Write the dense break rasters and the break event table. The file
+        names are built as <prefix>_<PRODUCT><suffix>, e.g. BREAK_COUNT, and
+        dates is a function that returns the date of a 1-based band index.
+        Existing files are replaced. The written file names are returned.
+        """
+
+        written = []
+        rasters = [("COUNT", gdalconst.GDT_Byte, [self.count]),
+                   ("FIRST", gdalconst.GDT_Int16, [self.indices[0]]),
+                   ("LAST", gdalconst.GDT_Int16, [self.last]),
+                   ("INDEX", gdalconst.GDT_Int16, self.indices)]
+        for product, bandtype, bands in rasters:
+            name = "%s_%s%s.tif" % (prefix, product, suffix)
+            dataset = create_gtiff(name, self.size, projection, geotransform, bandtype, len(bands))
+            for j, data in enumerate(bands):
+                dataset.GetRasterBand(j + 1).WriteArray(data, 0, 0)
+            # Close the dataset in order to write the data persistently to the file
+            dataset = None
+            written.append(name)
+
+        name = "%s_EVENTS%s.sqlite" % (prefix, suffix)
+        write_break_events(name, self.events, dates)
+        written.append(name)
+        return written
+
+def write_break_events(filename, events, dates):
+    """
+    Write break events (col, row, band) to a SQLite table with an index on the
+    pixel position, so all breaks of a pixel are found with one lookup.
+    """
+
+    if os.path.exists(filename):
+        os.remove(filename)
+    connection = sqlite3.connect(filename)
+    try:
+        connection.execute("CREATE TABLE breaks (row INTEGER NOT NULL, col INTEGER NOT NULL, band INTEGER NOT NULL, date TEXT NOT NULL)")
+        connection.executemany("INSERT INTO breaks (row, col, band, date) VALUES (?, ?, ?, ?)",
+                               ((row, col, band, dates(band)) for col, row, band in events))
+        connection.execute("CREATE INDEX breaks_pixel ON breaks (row, col)")
+        connection.commit()
+    finally:
+        connection.close()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+#
+# Day-of-year climatology of a stack
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+# The climatology of a statistic has one band per composite period, e.g. 23
+# bands for 16-day composites. Band p summarises the bands of all years that
+# belong to period p. The bands of the periods partition the stack, each
+# band is read once. A new composite changes only the band of its period.
+
+import os
+import json
+from processing.journal import write_atomically
+from processing.utilities import read_block
+from processing.summary import block_statistics
+
+# Default statistics of the climatology
+CLIMATOLOGY_STATISTICS = ["mean", "median", "std"]
+
+def period_bands(time_axis):
+    """
+    Get the 1-based bands of the stack per 1-based composite period.
+    """
+
+    periods = dict((period, []) for period in range(1, time_axis.frequency + 1))
+    for band in range(1, len(time_axis) + 1):
+        periods[time_axis.period(band)[1]].append(band)
+    return periods
+
+class ClimatologyState(object):
+    """
+    The bands of the stack that are part of the climatology, kept in a JSON
+    file next to the climatology. The last absorbed date detects a rebuilt
+    stack, the settings a changed configuration.
+    """
+
+    def __init__(self, filename, settings=None):
+
+        self.filename = filename
+        self.settings = dict(settings or {})
+
+    def updated_periods(self, time_axis):
+        """
+        Get the sorted periods whose bands changed since the last update, all
+        periods if there is no valid state.
+        """
+
+        bands = 0
+        if os.path.exists(self.filename):
+            f = open(self.filename)
+            try:
+                state = json.load(f)
+            finally:
+                f.close()
+            if state["settings"] == self.settings and 0 < state["bands"] <= len(time_axis) \
+                    and time_axis.date(state["bands"]) == state["date"]:
+                bands = state["bands"]
+        periods = set(time_axis.period(band)[1] for band in range(bands + 1, len(time_axis) + 1))
+        if bands == 0:
+            periods = set(range(1, time_axis.frequency + 1))
+        return sorted(periods)
+
+    def save(self, time_axis):
+        """
+        Record all bands of the time axis as absorbed.
+        """
+
+        state = {
+            "bands": len(time_axis),
+            "date": time_axis.date(len(time_axis)),
+            "settings": self.settings
+        }
+        write_atomically(self.filename, json.dumps(state, indent=2, sort_keys=True))
+
+def block_climatology(dataset, window, bands, statistics=CLIMATOLOGY_STATISTICS, nodata=-3000, quality=None):
+    """
+    Read the given bands of one period in the window and calculate the
+    statistics over the years, see block_statistics().
+    """
+
+    cube = read_block(dataset, *window, bands=bands)
+    if quality is not None:
+        cube = quality.mask(cube, window, bands=bands)
+    return block_statistics(cube, nodata, statistics)
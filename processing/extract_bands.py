@@ -33,6 +33,8 @@ try:
 except ImportError:
     import osgeo.gdalconst as gdalconst
 import gdal_merge
+from processing.timeaxis import time_axis_filename
+from processing.timeaxis import time_axis_from_files
 
 def merge_files(outputPath, index, tile):
     """
@@ -57,6 +59,8 @@ def merge_files(outputPath, index, tile):
     options.extend(tifs)
     # Call gdal_merge to stack the raster files
     gdal_merge.main(options)
+    # Save the dates of the stacked bands next to the stack
+    time_axis_from_files(tifs).save(time_axis_filename(stackedRaster))
 
 def extract_band(inputFile, outputFile, index):
 
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+#
+# Incremental per-pixel value histograms of a stack
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+# The store keeps a quantised histogram of the valid observations of each
+# pixel in a memory mapped .npy file with the shape (rows, cols, bins) and
+# the dates of the absorbed bands and the settings in a .json file. When a
+# composite is appended to the stack only the new bands are read and added,
+# the median and the percentiles are recomputed from the histograms.
+
+import os
+import json
+import numpy
+from processing.journal import write_atomically
+from processing.summary import HISTOGRAM_RANGE
+from processing.summary import histogram_percentiles
+
+class HistogramStore(object):
+    """
+    Quantised value histograms of all pixels of a (cols, rows) raster. With
+    the default bin width of 100, i.e. 0.01 NDVI, a histogram has 121 bins of
+    2 bytes. Values outside value_range are counted in the first or last bin.
+    The percentiles are interpolated within a bin and differ from the exact
+    percentiles by less than bin_width.
+    """
+
+    def __init__(self, filename, size, bin_width=100, value_range=HISTOGRAM_RANGE, settings=None):
+
+        self.filename = filename
+        self.size = tuple(size)
+        self.bin_width = bin_width
+        self.value_range = tuple(value_range)
+        self.settings = dict(settings or {})
+        self.bins = (self.value_range[1] - self.value_range[0]) // bin_width + 1
+        # Dates of the absorbed bands of the stack
+        self.dates = []
+        self._histograms = None
+
+    @property
+    def bands(self):
+        """
+        Number of absorbed bands of the stack.
+        """
+
+        return len(self.dates)
+
+    @property
+    def metadata_filename(self):
+        return "%s.json" % os.path.splitext(self.filename)[0]
+
+    def _metadata(self):
+        return {
+            "size": list(self.size),
+            "bin_width": self.bin_width,
+            "value_range": list(self.value_range),
+            "settings": self.settings
+        }
+
+    def open(self, time_axis):
+        """
+        Open an existing store of the stack with the time axis. False is
+        returned if there is no store, if it was created with other settings,
+        if its last update was interrupted or if the absorbed bands are not
+        the first bands of the time axis, e.g. because the stack was rebuilt
+        with an inserted or replaced date, see create().
+        """
+
+        if not os.path.exists(self.filename) or not os.path.exists(self.metadata_filename):
+            return False
+        f = open(self.metadata_filename)
+        try:
+            metadata = json.load(f)
+        finally:
+            f.close()
+        dates = metadata.pop("dates", None)
+        # An interrupted update leaves the histograms incomplete
+        if dates is None or metadata != self._metadata():
+            return False
+        if len(dates) > len(time_axis) or dates != list(time_axis.dates[:len(dates)]):
+            return False
+        self._histograms = numpy.load(self.filename, mmap_mode="r+")
+        self.dates = dates
+        return True
+
+    def create(self):
+        """
+        Create an empty store, an existing store is overwritten.
+        """
+
+        self._histograms = numpy.lib.format.open_memmap(self.filename, mode="w+", dtype=numpy.uint16,
+                                                        shape=(self.size[1], self.size[0], self.bins))
+        self.dates = []
+        self.flush()
+
+    def add(self, window, cube, nodata):
+        """
+        Count the valid observations of the (bands, rows, cols) cube in the
+        histograms of the window (xoff, yoff, xsize, ysize).
+        """
+
+        xoff, yoff, xsize, ysize = window
+        histograms = numpy.array(self._histograms[yoff:yoff + ysize, xoff:xoff + xsize]).reshape(-1, self.bins)
+        pixels = numpy.arange(xsize * ysize)
+        for band in numpy.asarray(cube):
+            band = band.ravel()
+            valid = band != nodata
+            bins = numpy.clip(band.astype(numpy.int64), self.value_range[0], self.value_range[1])
+            bins = (bins - self.value_range[0]) // self.bin_width
+            # Each pixel has one observation per band, the indices are unique
+            histograms[pixels[valid], bins[valid]] += 1
+        self._histograms[yoff:yoff + ysize, xoff:xoff + xsize] = histograms.reshape(ysize, xsize, self.bins)
+
+    def count(self, window):
+        """
+        Number of valid observations of the pixels of the window.
+        """
+
+        xoff, yoff, xsize, ysize = window
+        return numpy.sum(self._histograms[yoff:yoff + ysize, xoff:xoff + xsize], axis=2, dtype=numpy.int64)
+
+    def percentiles(self, window, percentiles):
+        """
+        Get the percentiles of the pixels of the window as (percentiles,
+        rows, cols) float array, see histogram_percentiles().
+        """
+
+        xoff, yoff, xsize, ysize = window
+        histograms = self._histograms[yoff:yoff + ysize, xoff:xoff + xsize].reshape(-1, self.bins)
+        result = histogram_percentiles(histograms, percentiles, self.value_range[0], self.bin_width)
+        # The last bin may extend beyond the valid range
+        result = numpy.clip(result, self.value_range[0], self.value_range[1])
+        return result.reshape(len(percentiles), ysize, xsize)
+
+    def invalidate(self):
+        """
+        Mark the store as incomplete before the histograms are changed, an
+        interrupted update is rebuilt by the next run.
+        """
+
+        metadata = self._metadata()
+        metadata["dates"] = None
+        write_atomically(self.metadata_filename, json.dumps(metadata, indent=2, sort_keys=True))
+
+    def flush(self, dates=None):
+        """
+        Write the histograms and record the dates of the absorbed bands.
+        """
+
+        if dates is not None:
+            self.dates = list(dates)
+        self._histograms.flush()
+        metadata = self._metadata()
+        metadata["dates"] = self.dates
+        write_atomically(self.metadata_filename, json.dumps(metadata, indent=2, sort_keys=True))
+
+    def close(self):
+        self._histograms = None
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+#
+# Journal of completed blocks to checkpoint and resume long tile runs
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import os
+import re
+import json
+import shutil
+
+def write_atomically(filename, content):
+    """
+    Write a string to a file. The content is written to a temporary file first
+    which is renamed afterwards, readers either see the complete file or none.
+    """
+
+    tmp = "%s.tmp" % filename
+    f = open(tmp, "w")
+    try:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    finally:
+        f.close()
+    os.rename(tmp, filename)
+
+def file_identity(filename):
+    """
+    Get the size and the modification time of an input file for the settings
+    of a journal, a replaced file invalidates the journal.
+    """
+
+    return [os.path.getsize(filename), os.path.getmtime(filename)]
+
+class BlockJournal(object):
+    """
+    Journal of the completed blocks of a tile. The results of each block are
+    committed atomically to their own file. If the settings of the run differ
+    from the settings of an existing journal, the journal is discarded.
+    """
+
+    def __init__(self, directory, settings):
+
+        self.directory = directory
+
+        settingsFile = os.path.join(directory, "settings.json")
+        if os.path.exists(settingsFile):
+            f = open(settingsFile)
+            try:
+                previous = json.load(f)
+            finally:
+                f.close()
+            if previous != json.loads(json.dumps(settings)):
+                self.clear()
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        if not os.path.exists(settingsFile):
+            write_atomically(settingsFile, json.dumps(settings))
+
+    def _filename(self, window):
+        return os.path.join(self.directory, "block_%d_%d_%d_%d.json" % tuple(window))
+
+    def _codes_filename(self, window):
+        return os.path.join(self.directory, "block_%d_%d_%d_%d.codes.json" % tuple(window))
+
+    def completed(self):
+        """
+        Get the set of completed windows (xoff, yoff, xsize, ysize).
+        """
+
+        windows = set()
+        for name in os.listdir(self.directory):
+            matchObj = re.match(r"block_(\d+)_(\d+)_(\d+)_(\d+)\.json$", name)
+            if matchObj is not None:
+                windows.add(tuple(int(v) for v in matchObj.groups()))
+        return windows
+
+    def commit(self, window, results, codes=None):
+        """
+        Store the results of a completed block. The results are a list of
+        (col, row, breakpoints) tuples. Additional per-pixel codes, e.g. of
+        the pre-screening, are stored first in their own file.
+        """
+
+        if codes is not None:
+            write_atomically(self._codes_filename(window), json.dumps([int(c) for c in codes]))
+        content = json.dumps([[int(col), int(row), [int(b) for b in bps]] for col, row, bps in results])
+        write_atomically(self._filename(window), content)
+
+    def load(self, window):
+        """
+        Get the stored results of a completed block.
+        """
+
+        f = open(self._filename(window))
+        try:
+            return [(col, row, bps) for col, row, bps in json.load(f)]
+        finally:
+            f.close()
+
+    def load_codes(self, window):
+        """
+        Get the stored codes of a completed block, None if there are none.
+        """
+
+        if not os.path.exists(self._codes_filename(window)):
+            return None
+        f = open(self._codes_filename(window))
+        try:
+            return json.load(f)
+        finally:
+            f.close()
+
+    def clear(self):
+        """
+        Remove the journal, e.g. after the outputs have been written.
+        """
+
+        if os.path.exists(self.directory):
+            shutil.rmtree(self.directory)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+#
+# Sparse index of the valid pixels of a MASK raster
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import os
+import re
+import numpy
+try:
+    import gdal
+except ImportError:
+    import osgeo.gdal as gdal
+try:
+    import gdalconst
+except ImportError:
+    import osgeo.gdalconst as gdalconst
+from processing.utilities import get_block_windows
+
+class MaskIndex(object):
+    """
+    The blocks of a raster that contain valid mask pixels and the offsets of
+    the valid pixels within each block. Blocks without any valid pixel are
+    not part of the index.
+    """
+
+    def __init__(self, windows, offsets, splits):
+
+        # (blocks, 4) array of (xoff, yoff, xsize, ysize)
+        self.windows = windows
+        # Flat offsets (row * xsize + col) within the block of all blocks
+        self.offsets = offsets
+        # Start of the offsets of each block, with the total count at the end
+        self.splits = splits
+
+    def __len__(self):
+        return len(self.windows)
+
+    @property
+    def count(self):
+        """
+        Number of valid pixels.
+        """
+
+        return int(self.splits[-1])
+
+    def __iter__(self):
+        """
+        Iterate over the blocks. For each block the window (xoff, yoff, xsize,
+        ysize) and an array of (row, col) offsets of the valid pixels within
+        the block is returned.
+        """
+
+        for i in range(len(self.windows)):
+            window = tuple(int(v) for v in self.windows[i])
+            offsets = self.offsets[self.splits[i]:self.splits[i + 1]]
+            yield window, numpy.column_stack((offsets // window[2], offsets % window[2]))
+
+def build_mask_index(mask_band, windows):
+    """
+    Build the index of the valid (non-NODATA) pixels of a mask band for the
+    given windows.
+    """
+
+    mask_NODATA = mask_band.GetNoDataValue()
+
+    blocks = []
+    offsets = []
+    splits = [0]
+    for window in windows:
+        mask_block = mask_band.ReadAsArray(*window)
+        if mask_NODATA is None:
+            valid = numpy.arange(mask_block.size)
+        else:
+            valid = numpy.flatnonzero(mask_block.astype(float) != mask_NODATA)
+        if len(valid) > 0:
+            blocks.append(window)
+            offsets.append(valid.astype(numpy.int32))
+            splits.append(splits[-1] + len(valid))
+
+    return MaskIndex(numpy.array(blocks, dtype=numpy.int32).reshape(-1, 4),
+                     numpy.concatenate(offsets) if offsets else numpy.zeros(0, dtype=numpy.int32),
+                     numpy.array(splits, dtype=numpy.int64))
+
+def get_mask_index(mask_filename, dataset, block_size=None):
+    """
+    Get the index of the valid pixels of a mask for the block layout of the
+    dataset. The index is cached next to the mask, e.g. MASK_<tile>.128x128.idx.npz
+    for 128x128 blocks, and rebuilt if the mask has changed since.
+    """
+
+    windows = list(get_block_windows(dataset, block_size))
+    blockXSize, blockYSize = windows[0][2], windows[0][3]
+    cache = "%s.%dx%d.idx.npz" % (re.sub(r"\.tif$", "", mask_filename), blockXSize, blockYSize)
+    # The modification time and size of the mask and the raster size identify
+    # the cached index
+    stat = os.stat(mask_filename)
+    source = numpy.array([stat.st_mtime, stat.st_size, dataset.RasterXSize, dataset.RasterYSize], dtype=float)
+
+    if os.path.exists(cache):
+        data = numpy.load(cache)
+        try:
+            if numpy.array_equal(data["source"], source):
+                return MaskIndex(data["windows"], data["offsets"], data["splits"])
+        finally:
+            data.close()
+
+    mask_dataset = gdal.Open(mask_filename, gdalconst.GA_ReadOnly)
+    if mask_dataset is None:
+        raise IOError('Raster file "%s" could not be opened.' % mask_filename)
+    index = build_mask_index(mask_dataset.GetRasterBand(1), windows)
+
+    # Write the cache to a temporary file first and rename it afterwards
+    tmp = "%s.tmp.npz" % cache[:-len(".npz")]
+    numpy.savez(tmp, source=source, windows=index.windows, offsets=index.offsets, splits=index.splits)
+    os.rename(tmp, cache)
+    return index
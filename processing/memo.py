@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+#
+# Cache of the breakpoints of repeated time series
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+# Many masked pixels have identical series, e.g. fill values or flat barren
+# ground. The breakpoints only depend on the series, they are cached with the
+# hash of the int16 values of the stack as key.
+
+import os
+import json
+import hashlib
+import numpy
+from collections import OrderedDict
+from processing.journal import write_atomically
+
+def series_key(series):
+    """
+    Get the cache key of a series of int16 stack values.
+    """
+
+    return hashlib.sha1(numpy.ascontiguousarray(series, dtype=numpy.int16)).hexdigest()
+
+class BreakpointCache(object):
+    """
+    Least recently used cache of breakpoints with at most max_entries series.
+    The cache is only valid for one set of settings, e.g. the engine and the
+    time axis. A cache file with other settings is ignored.
+    """
+
+    def __init__(self, max_entries=100000, settings=None):
+
+        self.max_entries = max_entries
+        self.settings = settings
+        self._entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, series):
+        """
+        Get the breakpoints of a series, None if the series is not cached.
+        """
+
+        key = series_key(series)
+        breakpoints = self._entries.pop(key, None)
+        if breakpoints is None:
+            self.misses += 1
+            return None
+        # Move the entry to the end, the most recently used position
+        self._entries[key] = breakpoints
+        self.hits += 1
+        return list(breakpoints)
+
+    def put(self, series, breakpoints):
+        """
+        Store the breakpoints of a series.
+        """
+
+        if self.max_entries <= 0:
+            return
+        key = series_key(series)
+        self._entries.pop(key, None)
+        self._entries[key] = [int(b) for b in breakpoints]
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups > 0 else 0.0
+
+    def stats(self):
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "hit_rate": self.hit_rate()}
+
+    def load(self, filename):
+        """
+        Load the entries of a cache file written with the same settings.
+        False is returned if the file does not exist or has other settings.
+        """
+
+        if self.max_entries <= 0 or not os.path.exists(filename):
+            return False
+        f = open(filename)
+        try:
+            content = json.load(f)
+        finally:
+            f.close()
+        if content.get("settings") != json.loads(json.dumps(self.settings)):
+            return False
+        # The entries are stored from least to most recently used
+        for key, breakpoints in content["entries"][-self.max_entries:]:
+            self._entries[key] = breakpoints
+        return True
+
+    def save(self, filename):
+        """
+        Save the settings and the entries to a cache file.
+        """
+
+        write_atomically(filename, json.dumps({"settings": self.settings,
+                                               "entries": list(self._entries.items())}))
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+#
+# Aggregated counters and latency histograms of the processing stages
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+# Logging a line per pixel costs more than some of the stages it measures.
+# The stages (e.g. read, fit, write) record their latencies in histograms
+# with logarithmic buckets instead, and a summary with the throughput, the
+# estimated time to completion and the tail latencies is logged every few
+# seconds. Histograms of worker processes are merged in the main process.
+
+import math
+import time
+import json
+from processing.journal import write_atomically
+
+# Buckets per factor of ten and the smallest latency of the histograms
+BUCKETS_PER_DECADE = 20
+MIN_LATENCY = 1e-6
+# Latencies up to MIN_LATENCY * 10^DECADES seconds are kept apart
+DECADES = 9
+
+class LatencyHistogram(object):
+    """
+    Histogram of latencies in seconds with logarithmic buckets. Percentiles
+    are accurate to the bucket width, about 12% of the latency.
+    """
+
+    def __init__(self):
+
+        self.buckets = [0] * (BUCKETS_PER_DECADE * DECADES + 1)
+        self.count = 0
+        self.items = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, seconds, items=1):
+        """
+        Record the latency of one call that processed a number of items,
+        e.g. the pixels of a block.
+        """
+
+        if seconds <= MIN_LATENCY:
+            bucket = 0
+        else:
+            bucket = int(math.log10(seconds / MIN_LATENCY) * BUCKETS_PER_DECADE) + 1
+            bucket = min(bucket, len(self.buckets) - 1)
+        self.buckets[bucket] += 1
+        self.count += 1
+        self.items += items
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        """
+        Add the latencies of another histogram.
+        """
+
+        for i, n in enumerate(other.buckets):
+            self.buckets[i] += n
+        self.count += other.count
+        self.items += other.items
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def percentile(self, q):
+        """
+        Get the latency below which q percent of the calls are. The upper
+        bound of the bucket is returned, but at most the maximum latency.
+        The last bucket has no upper bound, its latencies are above the
+        range of the histogram.
+        """
+
+        if self.count == 0:
+            return None
+        rank = q / 100.0 * self.count
+        cumulated = 0
+        for i, n in enumerate(self.buckets):
+            cumulated += n
+            if cumulated >= rank and n > 0:
+                if i == len(self.buckets) - 1:
+                    return self.max
+                upper = MIN_LATENCY * 10.0 ** (float(i) / BUCKETS_PER_DECADE)
+                return min(upper, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "items": self.items,
+            "total": self.total,
+            "mean": self.total / self.count if self.count > 0 else None,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "p999": self.percentile(99.9)
+        }
+
+class Metrics(object):
+    """
+    Counters and latency histograms of the stages of a run. The number of
+    items to process, e.g. the valid pixels of a tile, is used to estimate
+    the remaining time. A summary is logged at most every interval seconds.
+    Stages of very cheap calls can be sampled: only every sample_every-th
+    call is timed, see sampled().
+    """
+
+    def __init__(self, name, total=None, log=None, interval=60.0, sample_every=1):
+
+        self.name = name
+        self.total = total
+        self.log = log
+        self.interval = interval
+        self.sample_every = max(1, int(sample_every))
+
+        self.stages = {}
+        self.counters = {}
+        self.done = 0
+        self.start_time = time.time()
+        self._last_summary = self.start_time
+        self._calls = 0
+
+    def sampled(self):
+        """
+        Return True if the current call should be timed.
+        """
+
+        self._calls += 1
+        return self._calls % self.sample_every == 0
+
+    def record(self, stage, seconds, items=1):
+        """
+        Record the latency of a call of a stage.
+        """
+
+        if stage not in self.stages:
+            self.stages[stage] = LatencyHistogram()
+        self.stages[stage].record(seconds, items)
+
+    def increment(self, counter, value=1):
+        """
+        Increment a counter.
+        """
+
+        self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def merge(self, stages, counters=None):
+        """
+        Add the histograms and counters of a worker process.
+        """
+
+        for stage, histogram in stages.items():
+            if stage not in self.stages:
+                self.stages[stage] = LatencyHistogram()
+            self.stages[stage].merge(histogram)
+        for counter, value in (counters or {}).items():
+            self.increment(counter, value)
+
+    def progress(self, items):
+        """
+        Add completed items and log a summary if the interval has passed.
+        """
+
+        self.done += items
+        now = time.time()
+        if self.log is not None and now - self._last_summary >= self.interval:
+            self._last_summary = now
+            self.log_summary()
+
+    def rate(self):
+        """
+        Completed items per second since the start.
+        """
+
+        elapsed = time.time() - self.start_time
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def eta(self):
+        """
+        Estimated seconds until all items are completed, None if unknown.
+        """
+
+        rate = self.rate()
+        if self.total is None or rate == 0:
+            return None
+        return max(0.0, (self.total - self.done) / rate)
+
+    def log_summary(self):
+        """
+        Log the throughput, the estimated time to completion and the latencies
+        of each stage.
+        """
+
+        eta = self.eta()
+        if self.total is not None:
+            progress = "%d of %d items (%.1f%%)" % (self.done, self.total, 100.0 * self.done / max(self.total, 1))
+        else:
+            progress = "%d items" % self.done
+        self.log.info("%s: %s, %.2f items/sec, ETA %s" % (
+            self.name, progress, self.rate(), "%.0f s" % eta if eta is not None else "unknown"))
+        for stage in sorted(self.stages):
+            h = self.stages[stage]
+            self.log.info("%s: %s %d calls, p50 %.6f s, p99 %.6f s, max %.6f s" % (
+                self.name, stage, h.count, h.percentile(50), h.percentile(99), h.max))
+
+    def summary(self):
+        """
+        Get all numbers of the run as dictionary.
+        """
+
+        return {
+            "name": self.name,
+            "elapsed": time.time() - self.start_time,
+            "done": self.done,
+            "total": self.total,
+            "items_per_second": self.rate(),
+            "sample_every": self.sample_every,
+            "counters": self.counters,
+            "stages": dict((stage, h.to_dict()) for stage, h in self.stages.items())
+        }
+
+    def export(self, filename):
+        """
+        Write the summary to a JSON file.
+        """
+
+        write_atomically(filename, json.dumps(self.summary(), indent=2, sort_keys=True))
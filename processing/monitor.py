@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+#
+# Incremental bfastmonitor-style monitoring of newly arrived acquisitions
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+# The monitoring follows bfastmonitor in the R package bfast: a season and
+# trend model is fitted to a stable history period and new observations are
+# tested with the OLS-MOSUM of the residuals against a boundary that widens
+# with sqrt(2 * log(t)). The moving sum is updated with each new band, so an
+# update only needs the new band and the band that leaves the window.
+
+import os
+import math
+import json
+import numpy
+from processing.journal import write_atomically
+from processing.regression import get_model
+from processing.regression import season_trend_rows
+
+def log_plus(x):
+    """
+    log(x) for x > e, 1 otherwise (logPlus in strucchange).
+    """
+
+    x = numpy.asarray(x, dtype=float)
+    return numpy.where(x > math.e, numpy.log(numpy.maximum(x, math.e)), 1.0)
+
+def critical_value(history, window, frequency=23, order=3, level=0.05, period=2, simulations=1000):
+    """
+    Critical value of the monitoring boundary for a history of the given
+    length, simulated with white noise for a monitoring period of up to
+    period times the history length. The extrapolated trend dominates long
+    periods, the value should match the period that is actually monitored.
+    """
+
+    # A fixed seed makes the critical value reproducible between runs
+    random = numpy.random.RandomState(20140101)
+    total = int(history * period)
+    X = season_trend_rows(numpy.arange(1, total + 1), frequency, order)
+    pinv = numpy.linalg.pinv(X[:history])
+    k = X.shape[1]
+    t = numpy.arange(history + 1, total + 1)
+    boundary = numpy.sqrt(2.0 * log_plus(t / float(history)))
+
+    stats = []
+    for i in range(0, simulations, 200):
+        size = min(200, simulations - i)
+        e = random.standard_normal((total, size))
+        residuals = e - numpy.dot(X, numpy.dot(pinv, e[:history]))
+        sigma = numpy.sqrt(numpy.sum(residuals[:history] ** 2, axis=0) / (history - k))
+        process = numpy.zeros((total + 1, size))
+        process[1:] = numpy.cumsum(residuals, axis=0)
+        mosum = (process[t] - process[t - window]) / (sigma * math.sqrt(history))
+        stats.append(numpy.max(numpy.abs(mosum) / boundary[:, None], axis=0))
+    return float(numpy.percentile(numpy.concatenate(stats), 100.0 * (1.0 - level)))
+
+def fit_history(cube, window, frequency=23, order=3):
+    """
+    Fit the season and trend model to the history cube (time, rows, cols).
+    Missing observations are NaN and left out of the fit of their pixel, the
+    model of pixels with no more valid observations than regressors is NaN.
+    The coefficients, the residual standard deviation and the sum of the last
+    window residuals are returned per pixel, missing observations have a
+    residual of 0 in the sum.
+    """
+
+    cube = numpy.asarray(cube, dtype=float)
+    history = cube.shape[0]
+    model = get_model(history, frequency, order)
+    X = model.full.X
+    k = X.shape[1]
+    valid = ~numpy.isnan(cube)
+    count = numpy.sum(valid, axis=0)
+
+    # Pixels with complete series share the pseudo-inverse of the model
+    fit = model.fit(numpy.where(valid, cube, 0.0))
+    coefficients = fit.coefficients.reshape(k, -1)
+    fitResiduals = fit.residuals.reshape(history, -1)
+
+    # The other pixels are fitted with their valid observations only
+    gaps = numpy.flatnonzero((count < history).ravel())
+    if len(gaps) > 0:
+        Y = cube.reshape(history, -1)[:, gaps]
+        W = valid.reshape(history, -1)[:, gaps].astype(float)
+        XtWX = numpy.einsum("tp,ti,tj->pij", W, X, X)
+        XtWy = numpy.einsum("tp,ti,tp->pi", W, X, numpy.where(W > 0, Y, 0.0))
+        solvable = count.ravel()[gaps] > k
+        b = numpy.empty((len(gaps), k))
+        b[:] = numpy.nan
+        if numpy.any(solvable):
+            # The pseudo-inverse also handles gaps that leave the normal
+            # equations singular, e.g. a missing season
+            b[solvable] = numpy.einsum("pij,pj->pi", numpy.linalg.pinv(XtWX[solvable]), XtWy[solvable])
+        coefficients[:, gaps] = b.T
+        fitResiduals[:, gaps] = numpy.where(W > 0, Y - numpy.dot(X, b.T), 0.0)
+    coefficients = coefficients.reshape((k,) + cube.shape[1:])
+    fitResiduals = fitResiduals.reshape(cube.shape)
+
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        sigma = numpy.sqrt(numpy.sum(fitResiduals ** 2, axis=0) / (count - k))
+    sigma[count <= k] = numpy.nan
+    window_sum = numpy.sum(fitResiduals[history - window:], axis=0)
+    return coefficients, sigma, window_sum
+
+def residuals(values, index, coefficients, frequency=23, order=3):
+    """
+    Residuals of the observations of one band with the 1-based index against
+    the stored models of each pixel. Missing observations (NaN) have a
+    residual of 0.
+    """
+
+    x = season_trend_rows([index], frequency, order)[0]
+    values = numpy.asarray(values, dtype=float)
+    return numpy.where(numpy.isnan(values), 0.0, values - numpy.tensordot(x, coefficients, axes=1))
+
+class MonitorStore(object):
+    """
+    The history models and the monitoring state of a tile. The per-pixel
+    arrays are stored as .npy files in a directory and memory-mapped:
+
+    coefficients: model coefficients (regressors, rows, cols)
+    sigma:        residual standard deviation of the history fit
+    window_sum:   moving sum of the residuals over the last window bands
+    processed:    last band tested for each pixel
+    break_band:   1-based index of the first band that exceeds the boundary
+
+    The settings and the last band tested for the whole tile are kept in
+    state.json.
+    """
+
+    arrays = ["coefficients", "sigma", "window_sum", "processed", "break_band"]
+
+    def __init__(self, directory):
+
+        self.directory = directory
+        self.state = None
+
+    def _filename(self, name):
+        return os.path.join(self.directory, "%s.npy" % name)
+
+    def exists(self):
+        return os.path.exists(os.path.join(self.directory, "state.json"))
+
+    def create(self, size, state):
+        """
+        Create a new store for a raster of the given size (cols, rows).
+        Masked pixels keep NaN coefficients and are never tested.
+        """
+
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        # Remove an existing state first, the store is only valid once all
+        # history models are fitted and the state is saved
+        if self.exists():
+            os.remove(os.path.join(self.directory, "state.json"))
+        shape = (size[1], size[0])
+        k = 2 + 2 * state["order"]
+        open_memmap = numpy.lib.format.open_memmap
+        self.coefficients = open_memmap(self._filename("coefficients"), "w+", numpy.float32, (k,) + shape)
+        self.coefficients[:] = numpy.nan
+        self.sigma = open_memmap(self._filename("sigma"), "w+", numpy.float32, shape)
+        self.window_sum = open_memmap(self._filename("window_sum"), "w+", numpy.float32, shape)
+        self.processed = open_memmap(self._filename("processed"), "w+", numpy.int16, shape)
+        self.processed[:] = state["history"]
+        self.break_band = open_memmap(self._filename("break_band"), "w+", numpy.int16, shape)
+        self.state = state
+
+    def open(self):
+        """
+        Open an existing store for updates.
+        """
+
+        f = open(os.path.join(self.directory, "state.json"))
+        try:
+            self.state = json.load(f)
+        finally:
+            f.close()
+        for name in self.arrays:
+            setattr(self, name, numpy.load(self._filename(name), mmap_mode="r+"))
+
+    def save(self):
+        """
+        Flush the arrays and save the state.
+        """
+
+        for name in self.arrays:
+            getattr(self, name).flush()
+        write_atomically(os.path.join(self.directory, "state.json"), json.dumps(self.state))
+
+    def fit_block(self, window, cube, valid=None):
+        """
+        Fit the history models of a block cube (history, rows, cols). Pixels
+        that are not valid according to the boolean (rows, cols) mask are
+        not monitored.
+        """
+
+        xoff, yoff, xsize, ysize = window
+        coefficients, sigma, window_sum = fit_history(cube, self.state["window"], self.state["frequency"], self.state["order"])
+        if valid is not None:
+            coefficients[:, ~valid] = numpy.nan
+        self.coefficients[:, yoff:yoff + ysize, xoff:xoff + xsize] = coefficients
+        self.sigma[yoff:yoff + ysize, xoff:xoff + xsize] = sigma
+        self.window_sum[yoff:yoff + ysize, xoff:xoff + xsize] = window_sum
+
+    def update_block(self, window, index, values, dropped):
+        """
+        Test the new band with the 1-based index of a block. The values of the
+        band that leaves the moving window are needed to update the moving
+        sum. Missing observations (NaN) do not change the moving sum and are
+        not tested. The number of new breaks is returned.
+        """
+
+        xoff, yoff, xsize, ysize = window
+        block = (slice(yoff, yoff + ysize), slice(xoff, xoff + xsize))
+        state = self.state
+        history = state["history"]
+
+        # Skip pixels that already include this band, e.g. after a crash
+        pending = self.processed[block] < index
+        coefficients = self.coefficients[(slice(None),) + block]
+        window_sum = numpy.array(self.window_sum[block], dtype=float)
+        window_sum += residuals(values, index, coefficients, state["frequency"], state["order"])
+        window_sum -= residuals(dropped, index - state["window"], coefficients, state["frequency"], state["order"])
+
+        boundary = state["critical_value"] * math.sqrt(2.0 * log_plus(float(index) / history))
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            exceeded = numpy.abs(window_sum) / (self.sigma[block] * math.sqrt(history)) > boundary
+        breaks = pending & exceeded & ~numpy.isnan(values) & (self.break_band[block] == 0)
+
+        self.window_sum[block] = numpy.where(pending, window_sum, self.window_sum[block])
+        self.break_band[block] = numpy.where(breaks, index, self.break_band[block])
+        self.processed[block] = numpy.where(pending, index, self.processed[block])
+        return int(numpy.sum(breaks))
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+#
+# Vectorised pre-screening of the time series of a block
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import numpy
+try:
+    import gdalconst
+except ImportError:
+    import osgeo.gdalconst as gdalconst
+from processing.utilities import create_gtiff
+
+# Fill value of the MOD13Q1 NDVI and EVI bands
+NDVI_NODATA = -3000
+
+# Reason codes of the diagnostic raster. 0 is NODATA, i.e. outside the mask.
+SCREEN_PASSED = 1
+SCREEN_ALL_NODATA = 2
+SCREEN_TOO_FEW_VALID = 3
+SCREEN_LOW_VARIANCE = 4
+
+SCREEN_REASONS = {
+    SCREEN_PASSED: "passed",
+    SCREEN_ALL_NODATA: "all NODATA",
+    SCREEN_TOO_FEW_VALID: "too few valid observations",
+    SCREEN_LOW_VARIANCE: "low variance"
+}
+
+class Prescreen(object):
+    """
+    Label the series that cannot have breaks before they are passed to a
+    BFast engine: series without any valid observation, with fewer than
+    min_valid valid observations (two segments of size h need at least 2 * h)
+    and series whose standard deviation is below min_std in stack units.
+    """
+
+    def __init__(self, nodata=NDVI_NODATA, min_valid=46, min_std=10.0):
+
+        self.nodata = nodata
+        self.min_valid = min_valid
+        self.min_std = min_std
+
+    def screen(self, series):
+        """
+        Get the reason code of each series in the (time, pixels) array.
+        """
+
+        series = numpy.asarray(series)
+        valid = series != self.nodata
+        count = numpy.sum(valid, axis=0)
+
+        # Standard deviation of the valid observations only
+        values = numpy.where(valid, series, 0).astype(float)
+        n = numpy.maximum(count, 1)
+        mean = numpy.sum(values, axis=0) / n
+        variance = numpy.sum(numpy.where(valid, (values - mean) ** 2, 0.0), axis=0) / n
+
+        codes = numpy.empty(series.shape[1], dtype=numpy.uint8)
+        codes[:] = SCREEN_PASSED
+        codes[variance < self.min_std ** 2] = SCREEN_LOW_VARIANCE
+        codes[count < self.min_valid] = SCREEN_TOO_FEW_VALID
+        codes[count == 0] = SCREEN_ALL_NODATA
+        return codes
+
+class ScreenMap(object):
+    """
+    The reason codes of the pre-screening of a tile, written as diagnostic
+    raster.
+    """
+
+    def __init__(self, size):
+
+        self.size = size
+        self.codes = numpy.zeros((size[1], size[0]), dtype=numpy.uint8)
+
+    def add(self, xoff, yoff, valid_pixels, codes):
+        """
+        Add the codes of the valid (row, col) pixels of a block.
+        """
+
+        self.codes[yoff + valid_pixels[:, 0], xoff + valid_pixels[:, 1]] = codes
+
+    def counts(self):
+        """
+        Get the number of pixels per reason code.
+        """
+
+        counts = numpy.bincount(self.codes.ravel(), minlength=len(SCREEN_REASONS) + 1)
+        return dict((code, int(counts[code])) for code in SCREEN_REASONS)
+
+    def skip_ratio(self):
+        """
+        Share of the screened pixels that were skipped.
+        """
+
+        counts = self.counts()
+        total = sum(counts.values())
+        return 1.0 - float(counts[SCREEN_PASSED]) / total if total > 0 else 0.0
+
+    def flush(self, filename, projection, geotransform):
+        """
+        Write the diagnostic raster.
+        """
+
+        dataset = create_gtiff(filename, self.size, projection, geotransform, gdalconst.GDT_Byte)
+        dataset.GetRasterBand(1).WriteArray(self.codes, 0, 0)
+        # Close the dataset in order to write the data persistently to the file
+        dataset = None
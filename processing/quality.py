@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+#
+# Masking of unreliable observations with the QUAL stack
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+# The QUAL stack holds the "250m 16 days VI Quality" bit field of MOD13Q1 with
+# the same bands and tiling as the NDVI stack. Its bits 0-1 are the MODLAND QA
+# of the observation, observations whose MODLAND QA is worse than the accepted
+# level are set to NODATA. The bit field is unsigned but stacked as Int16, the
+# low bits are the same. The BFast engines need complete series, the gaps are
+# filled by linear interpolation in time like zoo::na.approx.
+
+import numpy
+try:
+    import gdal
+except ImportError:
+    import osgeo.gdal as gdal
+try:
+    import gdalconst
+except ImportError:
+    import osgeo.gdalconst as gdalconst
+from processing.utilities import read_block
+
+# MODLAND QA, bits 0-1 of the VI Quality
+MODLAND_MASK = 0x3
+MODLAND_GOOD = 0
+MODLAND_CHECK_QA = 1
+MODLAND_CLOUDY = 2
+MODLAND_NOT_PRODUCED = 3
+
+def modland_qa(qual):
+    """
+    Get the MODLAND QA level of VI Quality values.
+    """
+
+    return numpy.bitwise_and(numpy.asarray(qual).astype(numpy.int32), MODLAND_MASK)
+
+def mask_unreliable(cube, qual, max_reliability=MODLAND_CHECK_QA, nodata=-3000):
+    """
+    Set the observations of a cube whose MODLAND QA in the VI Quality cube
+    is worse than max_reliability to NODATA, e.g. 1 keeps good observations
+    and observations to check with the other QA bits. The cube and the QUAL
+    cube have the same shape, a masked copy of the cube is returned.
+    """
+
+    unreliable = modland_qa(qual) > max_reliability
+    return numpy.where(unreliable, numpy.asarray(nodata, dtype=cube.dtype), cube)
+
+def fill_gaps(series, nodata=-3000):
+    """
+    Fill NODATA observations of the (time, pixels) series by linear
+    interpolation between the neighbouring valid observations. Leading and
+    trailing gaps get the nearest valid observation. Series without any
+    valid observation are returned unchanged. A float array is returned.
+    """
+
+    series = numpy.asarray(series, dtype=float)
+    valid = series != nodata
+    length = series.shape[0]
+    columns = numpy.arange(series.shape[1])[None, :]
+    index = numpy.arange(length)[:, None]
+
+    # Index of the last valid observation at or before and of the next one
+    # at or after each observation
+    previous = numpy.maximum.accumulate(numpy.where(valid, index, -1), axis=0)
+    following = numpy.minimum.accumulate(numpy.where(valid, index, length)[::-1], axis=0)[::-1]
+    hasPrevious = previous >= 0
+    hasFollowing = following < length
+    previous = numpy.where(hasPrevious, previous, following)
+    following = numpy.where(hasFollowing, following, previous)
+    # Series without valid observations keep their values
+    keep = valid | ~(hasPrevious | hasFollowing)
+    previous = numpy.clip(previous, 0, length - 1)
+    following = numpy.clip(following, 0, length - 1)
+
+    before = series[previous, columns]
+    after = series[following, columns]
+    span = numpy.maximum(following - previous, 1)
+    filled = before + (index - previous) / span.astype(float) * (after - before)
+    return numpy.where(keep, series, filled)
+
+class QualityMask(object):
+    """
+    Mask the blocks of a stack with the matching blocks of its QUAL stack.
+    The QUAL stack is opened on first use, e.g. in a worker process.
+    """
+
+    def __init__(self, filename, max_reliability=MODLAND_CHECK_QA, nodata=-3000):
+
+        self.filename = filename
+        self.max_reliability = max_reliability
+        self.nodata = nodata
+        self._dataset = None
+
+    def __getstate__(self):
+        # GDAL datasets can not be passed to other processes
+        state = dict(self.__dict__)
+        state["_dataset"] = None
+        return state
+
+    @property
+    def dataset(self):
+        if self._dataset is None:
+            self._dataset = gdal.Open(self.filename, gdalconst.GA_ReadOnly)
+            if self._dataset is None:
+                raise IOError('Raster file "%s" could not be opened.' % self.filename)
+        return self._dataset
+
+    def mask(self, cube, window, bands=None):
+        """
+        Read the QUAL block of the window and mask the unreliable
+        observations of the (bands, rows, cols) cube.
+        """
+
+        qual = read_block(self.dataset, *window, bands=bands)
+        return mask_unreliable(cube, qual, self.max_reliability, self.nodata)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+#
+# Cached point access to the time series of a stack
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+# A point query reads one pixel of every band, which decompresses the whole
+# internal block of each band. The reader keeps the decoded blocks of all
+# bands as (bands, rows, cols) tiles, repeated and neighbouring queries are
+# served from memory.
+
+from collections import OrderedDict
+try:
+    import gdal
+except ImportError:
+    import osgeo.gdal as gdal
+try:
+    import gdalconst
+except ImportError:
+    import osgeo.gdalconst as gdalconst
+from processing.utilities import get_block_size
+from processing.utilities import read_block
+
+class TimeSeriesReader(object):
+    """
+    Read the time series of single pixels of a stack through a least
+    recently used cache of tiles aligned to the internal blocks. The cache
+    holds at most max_bytes of decoded tiles, a tile larger than the budget
+    is read but not cached. The stack is opened on first use.
+    """
+
+    def __init__(self, filename, max_bytes=256 * 1024 * 1024):
+
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self._dataset = None
+        self.block_size = None
+        self._tiles = OrderedDict()
+        self.bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getstate__(self):
+        # GDAL datasets can not be passed to other processes
+        state = dict(self.__dict__)
+        state["_dataset"] = None
+        return state
+
+    @property
+    def dataset(self):
+        if self._dataset is None:
+            self._dataset = gdal.Open(self.filename, gdalconst.GA_ReadOnly)
+            if self._dataset is None:
+                raise IOError('Raster file "%s" could not be opened.' % self.filename)
+            self.block_size = get_block_size(self._dataset)
+        return self._dataset
+
+    def __len__(self):
+        return len(self._tiles)
+
+    def pixel(self, x, y):
+        """
+        Get the (col, row) of the pixel at the georeferenced position.
+        """
+
+        transform = self.dataset.GetGeoTransform()
+        return int((x - transform[0]) / transform[1]), int((y - transform[3]) / transform[5])
+
+    def read(self, col, row):
+        """
+        Get the time series of the pixel at (col, row) as numpy.array.
+        """
+
+        dataset = self.dataset
+        if not (0 <= col < dataset.RasterXSize and 0 <= row < dataset.RasterYSize):
+            raise IndexError("Pixel (%d, %d) is outside the raster" % (col, row))
+        blockXSize, blockYSize = self.block_size
+        tile = self._tile(col // blockXSize, row // blockYSize)
+        return tile[:, row % blockYSize, col % blockXSize].copy()
+
+    def read_point(self, x, y):
+        """
+        Get the time series of the pixel at the georeferenced position.
+        """
+
+        return self.read(*self.pixel(x, y))
+
+    def _tile(self, blockX, blockY):
+        """
+        Get the (bands, rows, cols) tile of an internal block, clipped to the
+        raster size.
+        """
+
+        key = (blockX, blockY)
+        tile = self._tiles.pop(key, None)
+        if tile is not None:
+            # Move the tile to the end, the most recently used position
+            self._tiles[key] = tile
+            self.hits += 1
+            return tile
+
+        self.misses += 1
+        blockXSize, blockYSize = self.block_size
+        xoff, yoff = blockX * blockXSize, blockY * blockYSize
+        tile = read_block(self.dataset, xoff, yoff,
+                          min(blockXSize, self.dataset.RasterXSize - xoff),
+                          min(blockYSize, self.dataset.RasterYSize - yoff))
+        if tile.nbytes > self.max_bytes:
+            return tile
+        while self.bytes + tile.nbytes > self.max_bytes:
+            evicted = self._tiles.popitem(last=False)[1]
+            self.bytes -= evicted.nbytes
+            self.evictions += 1
+        self._tiles[key] = tile
+        self.bytes += tile.nbytes
+        return tile
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups > 0 else 0.0
+
+    def stats(self):
+        return {"tiles": len(self._tiles), "bytes": self.bytes, "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "hit_rate": self.hit_rate()}
+
+    def close(self):
+        """
+        Drop the cached tiles and close the stack.
+        """
+
+        self._tiles.clear()
+        self.bytes = 0
+        self._dataset = None
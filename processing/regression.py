@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+#
+# Batched harmonic season and trend regression with shared design matrices
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+# All pixels of a tile share the same time axis. The design matrices and
+# their pseudo-inverses are therefore computed once per series length and
+# season settings and applied to a whole block with a single matrix multiply.
+# Time series are numpy.array with the time as first axis, e.g. (time, pixels)
+# or a block cube (time, rows, cols).
+
+import numpy
+
+# Cached models, see get_model()
+_models = {}
+
+def trend_design(n, frequency=23):
+    """
+    Design matrix of a linear trend with intercept. The trend regressor is the
+    time in years since the first observation.
+    """
+
+    return trend_rows(numpy.arange(1, n + 1), frequency)
+
+def harmonic_design(n, frequency=23, order=3):
+    """
+    Design matrix of the harmonic season model used by bfast: an intercept and
+    a cosine and sine term per harmonic.
+    """
+
+    return harmonic_rows(numpy.arange(1, n + 1), frequency, order)
+
+def trend_rows(indices, frequency=23):
+    """
+    Rows of the trend design matrix for 1-based observation indices.
+    """
+
+    indices = numpy.asarray(indices, dtype=float)
+    return numpy.column_stack((numpy.ones(len(indices)), (indices - 1) / frequency))
+
+def harmonic_rows(indices, frequency=23, order=3):
+    """
+    Rows of the harmonic design matrix for 1-based observation indices.
+    """
+
+    tl = numpy.asarray(indices, dtype=float)
+    columns = [numpy.ones(len(tl))]
+    for i in range(1, order + 1):
+        columns.append(numpy.cos(2.0 * numpy.pi * tl * i / frequency))
+        columns.append(numpy.sin(2.0 * numpy.pi * tl * i / frequency))
+    return numpy.column_stack(columns)
+
+def season_trend_rows(indices, frequency=23, order=3):
+    """
+    Rows of the combined design matrix (intercept, trend and harmonic terms)
+    for 1-based observation indices, e.g. of observations appended after the
+    period a model was fitted to.
+    """
+
+    return numpy.column_stack((trend_rows(indices, frequency), harmonic_rows(indices, frequency, order)[:, 1:]))
+
+class DesignMatrix(object):
+    """
+    A design matrix with its precomputed pseudo-inverse and residual maker.
+    """
+
+    def __init__(self, X):
+
+        self.X = X
+        self.pinv = numpy.linalg.pinv(X)
+        # I - X * pinv(X) turns observations into residuals with one multiply
+        self.residual_maker = numpy.eye(X.shape[0]) - numpy.dot(X, self.pinv)
+
+    def coefficients(self, Y):
+        """
+        OLS coefficients of each series in Y.
+        """
+
+        return _apply(self.pinv, Y)
+
+    def fitted(self, Y):
+        """
+        Fitted values of each series in Y.
+        """
+
+        return _apply(numpy.dot(self.X, self.pinv), Y)
+
+    def residuals(self, Y):
+        """
+        Residuals of each series in Y.
+        """
+
+        return _apply(self.residual_maker, Y)
+
+class SeasonTrendFit(object):
+    """
+    Result of a joint season and trend fit of a block. All arrays have the
+    same shape as the fitted series, the coefficients have the number of
+    regressors as first axis.
+    """
+
+    def __init__(self, coefficients, trend, season, residuals):
+
+        self.coefficients = coefficients
+        self.trend = trend
+        self.season = season
+        self.residuals = residuals
+
+    @property
+    def fitted(self):
+        return self.trend + self.season
+
+class SeasonTrendModel(object):
+    """
+    The design matrices of a time axis: a linear trend, the harmonic season
+    and both combined. Use get_model() to share them between blocks.
+    """
+
+    def __init__(self, length, frequency=23, order=3):
+
+        self.length = length
+        self.frequency = frequency
+        self.order = order
+
+        self.trend = DesignMatrix(trend_design(length, frequency))
+        self.season = DesignMatrix(harmonic_design(length, frequency, order))
+        # One intercept, the trend and the harmonic terms
+        self.full = DesignMatrix(season_trend_rows(numpy.arange(1, length + 1), frequency, order))
+
+    def fit(self, Y):
+        """
+        Fit the trend and the season jointly to each series in Y. The
+        intercept is part of the trend.
+        """
+
+        coefficients = self.full.coefficients(Y)
+        trend = _apply(self.full.X[:, :2], coefficients[:2])
+        season = _apply(self.full.X[:, 2:], coefficients[2:])
+        residuals = numpy.asarray(Y, dtype=float) - trend - season
+        return SeasonTrendFit(coefficients, trend, season, residuals)
+
+def _apply(matrix, Y):
+    """
+    Multiply a matrix with series with the time as first axis and any shape.
+    """
+
+    Y = numpy.asarray(Y, dtype=float)
+    result = numpy.dot(matrix, Y.reshape(Y.shape[0], -1))
+    return result.reshape((matrix.shape[0],) + Y.shape[1:])
+
+def get_model(length, frequency=23, order=3):
+    """
+    Get the season and trend model for a series length and season settings.
+    The model is created on the first call and cached.
+    """
+
+    key = (length, frequency, order)
+    if key not in _models:
+        _models[key] = SeasonTrendModel(length, frequency, order)
+    return _models[key]
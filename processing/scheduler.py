@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+#
+# Concurrent scheduler of the processing scripts for many tiles
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+# Each job processes one product of one tile in its own process by running
+# the script of the product, e.g. read_bfast_breaks.py h27v06. Jobs are
+# started as long as the CPUs and the memory they need are available. The
+# GDAL block cache of each job is limited with GDAL_CACHEMAX to its share of
+# the total cache. A job that needs more than the limits on its own is only
+# started when no other job is running.
+
+import os
+import sys
+import time
+import json
+import subprocess
+from processing.journal import write_atomically
+
+# The MODIS tiles of the vi-ts platform
+TILES = ["h16v08", "h17v08", "h18v04", "h20v09", "h21v07", "h21v08", "h21v09",
+"h21v10", "h22v07", "h22v08", "h22v09", "h27v06", "h27v07", "h27v08", "h28v06",
+"h28v07", "h28v08"]
+
+# Memory of a Python process with NumPy and GDAL, and of an R session with
+# the bfast package, in bytes
+PYTHON_MEMORY = 100 * 1024 * 1024
+R_MEMORY = 200 * 1024 * 1024
+
+class Job(object):
+    """
+    A product of a tile to process. The command is run in its own process,
+    the CPUs and the memory in bytes are the resources it is expected to use.
+    """
+
+    def __init__(self, product, tile, command, cpus=1, memory=PYTHON_MEMORY, stack_mtime=None):
+
+        self.product = product
+        self.tile = tile
+        self.command = command
+        self.cpus = cpus
+        self.memory = memory
+        # Modification time of the input stack, newer data than at the last
+        # successful run puts the job first
+        self.stack_mtime = stack_mtime
+
+        self.process = None
+        self.log_file = None
+        self.started = None
+
+    @property
+    def key(self):
+        return "%s/%s" % (self.product, self.tile)
+
+class TileScheduler(object):
+    """
+    Run jobs concurrently within limits of CPUs, memory in bytes and GDAL
+    cache in megabytes. The status of each job is kept in a JSON file, jobs
+    whose input stack is unchanged since their last successful run are not
+    run again unless forced.
+    """
+
+    def __init__(self, status_filename, cpus, memory, gdal_cache, log=None, poll_interval=1.0):
+
+        self.status_filename = status_filename
+        self.cpus = cpus
+        self.memory = memory
+        self.gdal_cache = gdal_cache
+        self.log = log
+        self.poll_interval = poll_interval
+
+        self.status = {}
+        if os.path.exists(status_filename):
+            f = open(status_filename)
+            try:
+                self.status = json.load(f)
+            finally:
+                f.close()
+
+    def _set_status(self, job, state, **values):
+        record = self.status.get(job.key, {})
+        record.update(values)
+        record["state"] = state
+        record["updated"] = time.time()
+        self.status[job.key] = record
+        write_atomically(self.status_filename, json.dumps(self.status, indent=2, sort_keys=True))
+
+    def _log(self, message):
+        if self.log is not None:
+            self.log.info(message)
+
+    def has_new_data(self, job):
+        """
+        Return True if the input stack of the job changed since its last
+        successful run or if the job never succeeded.
+        """
+
+        record = self.status.get(job.key, {})
+        if record.get("state") != "done":
+            return True
+        return job.stack_mtime is not None and job.stack_mtime != record.get("stack_mtime")
+
+    def order(self, jobs, force=False):
+        """
+        Get the jobs to run: jobs of tiles with new data first, then jobs
+        that are current but forced. The order of the jobs is kept otherwise.
+        """
+
+        new = [job for job in jobs if self.has_new_data(job)]
+        current = [job for job in jobs if not self.has_new_data(job)]
+        for job in current:
+            if not force:
+                self._log("%s is up to date" % job.key)
+        return new + (current if force else [])
+
+    def _fits(self, job, running):
+        if len(running) == 0:
+            return True
+        cpus = sum(j.cpus for j in running) + job.cpus
+        memory = sum(j.memory for j in running) + job.memory
+        return cpus <= self.cpus and memory <= self.memory
+
+    def _start(self, job, log_directory):
+        env = dict(os.environ)
+        # The share of the GDAL cache of the job according to its CPUs
+        env["GDAL_CACHEMAX"] = str(max(1, self.gdal_cache * min(job.cpus, self.cpus) // self.cpus))
+        job.log_file = open(os.path.join(log_directory, "%s_%s.log" % (job.product, job.tile)), "w")
+        job.process = subprocess.Popen(job.command, stdout=job.log_file, stderr=subprocess.STDOUT, env=env)
+        job.started = time.time()
+        self._set_status(job, "running", started=job.started, command=job.command, pid=job.process.pid)
+        self._log("Started %s with %d CPUs and %d MB" % (job.key, job.cpus, job.memory // (1024 * 1024)))
+
+    def _finish(self, job):
+        returncode = job.process.returncode
+        job.log_file.close()
+        elapsed = time.time() - job.started
+        if returncode == 0:
+            self._set_status(job, "done", finished=time.time(), elapsed=elapsed,
+                             returncode=returncode, stack_mtime=job.stack_mtime)
+            self._log("Finished %s in %.0f s" % (job.key, elapsed))
+        else:
+            self._set_status(job, "failed", finished=time.time(), elapsed=elapsed, returncode=returncode)
+            self._log("%s failed with exit code %d after %.0f s" % (job.key, returncode, elapsed))
+
+    def run(self, jobs, log_directory, force=False):
+        """
+        Run the jobs and wait until all are finished. The output of each job
+        is written to a log file in the log directory. The number of failed
+        jobs is returned.
+        """
+
+        if not os.path.exists(log_directory):
+            os.makedirs(log_directory)
+
+        queue = self.order(jobs, force)
+        for job in queue:
+            self._set_status(job, "pending")
+
+        running = []
+        failed = 0
+        try:
+            while len(queue) > 0 or len(running) > 0:
+                # Start the first jobs of the queue that fit into the limits
+                for job in list(queue):
+                    if self._fits(job, running):
+                        queue.remove(job)
+                        self._start(job, log_directory)
+                        running.append(job)
+                    elif len(running) > 0:
+                        # Keep the order: do not start later jobs that fit
+                        # while the first one waits for resources
+                        break
+
+                time.sleep(self.poll_interval)
+                for job in list(running):
+                    if job.process.poll() is not None:
+                        running.remove(job)
+                        self._finish(job)
+                        if job.process.returncode != 0:
+                            failed += 1
+        finally:
+            # Do not leave orphaned jobs behind, e.g. after Ctrl+C
+            for job in running:
+                job.process.terminate()
+                job.process.wait()
+                job.log_file.close()
+                self._set_status(job, "failed", finished=time.time(), returncode=job.process.returncode)
+        return failed
+
+def stack_mtime(filename):
+    """
+    Get the modification time of a stack, None if it does not exist.
+    """
+
+    if not os.path.exists(filename):
+        return None
+    return os.path.getmtime(filename)
+
+def python_command(script, arguments):
+    """
+    Get the command to run a script of this repository with the current
+    Python interpreter.
+    """
+
+    directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return [sys.executable, os.path.join(directory, script)] + [str(a) for a in arguments]
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+#
+# Temporal summary statistics of block cubes
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import warnings
+import numpy
+
+# Statistics of block_statistics() in their default order
+STATISTICS = ["mean", "std", "min", "max", "p10", "p90", "count", "median"]
+
+def masked_cube(cube, nodata):
+    """
+    Get a float copy of a (time, rows, cols) cube with NaN for NODATA.
+    """
+
+    values = numpy.array(cube, dtype=float)
+    if nodata is not None:
+        values[cube == nodata] = numpy.nan
+    return values
+
+def block_median(cube, nodata):
+    """
+    Median over the time axis of a (time, rows, cols) cube ignoring NODATA
+    observations, see block_statistics().
+    """
+
+    return block_statistics(cube, nodata, ["median"])["median"]
+
+def block_statistics(cube, nodata, statistics=STATISTICS):
+    """
+    Calculate several statistics over the time axis of a (time, rows, cols)
+    cube from one masked copy, ignoring NODATA observations. A dictionary of
+    int16 (rows, cols) arrays per statistic name is returned, see STATISTICS.
+    Percentiles are given as p<percent>, e.g. p10. The statistics are
+    truncated to integers like the stack values, pixels without any valid
+    observation get NODATA except for the count.
+    """
+
+    values = masked_cube(cube, nodata)
+    count = numpy.sum(~numpy.isnan(values), axis=0)
+    empty = count == 0
+
+    # All percentiles, including the median, share one partial sort
+    percentiles = [float(name[1:]) for name in statistics if name.startswith("p")]
+    if "median" in statistics:
+        percentiles.append(50.0)
+    quantiles = {}
+    if len(percentiles) > 0:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            result = numpy.nanpercentile(values, percentiles, axis=0)
+        quantiles = dict(zip(percentiles, result))
+
+    results = {}
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        for name in statistics:
+            if name == "count":
+                results[name] = count.astype(numpy.int16)
+                continue
+            if name == "mean":
+                value = numpy.nanmean(values, axis=0)
+            elif name == "std":
+                value = numpy.nanstd(values, axis=0)
+            elif name == "min":
+                value = numpy.nanmin(values, axis=0)
+            elif name == "max":
+                value = numpy.nanmax(values, axis=0)
+            elif name == "median":
+                value = quantiles[50.0]
+            elif name.startswith("p"):
+                value = quantiles[float(name[1:])]
+            else:
+                raise ValueError('Unknown statistic "%s"' % name)
+            value = numpy.where(empty, 0, value)
+            value = numpy.trunc(value).astype(numpy.int16)
+            value[empty] = nodata
+            results[name] = value
+    return results
+
+# Valid range of the MOD13Q1 NDVI and EVI bands, the bins of the histograms
+# of StreamingStatistics
+HISTOGRAM_RANGE = (-2000, 10000)
+
+def histogram_percentiles(histogram, percentiles, low, bin_width=1, chunk=256):
+    """
+    Get the percentiles of the values counted in a (pixels, bins) histogram
+    whose first bin starts at the value low, as (percentiles, pixels) float
+    array. The closest ranks are interpolated linearly like
+    numpy.percentile. With a bin width of one the percentiles are exact,
+    otherwise the values of a bin are assumed to be evenly spread over the
+    bin. Pixels without any value get 0.
+    """
+
+    count = numpy.sum(histogram, axis=1, dtype=numpy.int64)
+    results = numpy.zeros((len(percentiles), histogram.shape[0]), dtype=float)
+    for start in range(0, histogram.shape[0], chunk):
+        stop = min(start + chunk, histogram.shape[0])
+        bins = numpy.asarray(histogram[start:stop])
+        cumulative = numpy.cumsum(bins, axis=1, dtype=numpy.int64)
+        last = numpy.maximum(count[start:stop] - 1, 0)
+        pixels = numpy.arange(stop - start)
+        for i, percentile in enumerate(percentiles):
+            position = percentile / 100.0 * last
+            lower = numpy.floor(position).astype(numpy.int64)
+            values = []
+            for rank in (lower, numpy.minimum(lower + 1, last)):
+                # The bin of a rank is the first bin whose cumulative count
+                # exceeds the rank
+                index = numpy.minimum(numpy.sum(cumulative <= rank[:, None], axis=1), bins.shape[1] - 1)
+                before = cumulative[pixels, index] - bins[pixels, index]
+                inside = (rank - before + 0.5) / numpy.maximum(bins[pixels, index], 1) * bin_width - 0.5
+                values.append(index * bin_width + numpy.clip(inside, 0, bin_width - 1))
+            results[i, start:stop] = values[0] + (position - lower) * (values[1] - values[0])
+    results[:, count == 0] = 0
+    return results + low
+
+class StreamingStatistics(object):
+    """
+    Accumulate the statistics of block_statistics() band by band for the
+    pixels of a (rows, cols) window, so that the memory does not depend on
+    the length of the time series. Count, sum, minimum and maximum are kept
+    per pixel, the variance with Welford's algorithm. Percentiles and the
+    median are exact from a histogram with one bin per stack value in
+    value_range, values outside the range are counted in the first or last
+    bin. The histogram is only kept if percentiles are requested and needs
+    2 bytes per bin and pixel.
+    """
+
+    def __init__(self, shape, nodata, statistics=STATISTICS, value_range=HISTOGRAM_RANGE):
+
+        for name in statistics:
+            if name not in STATISTICS and not name.startswith("p"):
+                raise ValueError('Unknown statistic "%s"' % name)
+        self.shape = tuple(shape)
+        self.nodata = nodata
+        self.statistics = list(statistics)
+        self.value_range = value_range
+
+        self.count = numpy.zeros(self.shape, dtype=numpy.int32)
+        self.sum = numpy.zeros(self.shape, dtype=numpy.int64)
+        self.mean = numpy.zeros(self.shape, dtype=float)
+        self.m2 = numpy.zeros(self.shape, dtype=float)
+        self.min = numpy.empty(self.shape, dtype=float)
+        self.min[:] = numpy.inf
+        self.max = numpy.empty(self.shape, dtype=float)
+        self.max[:] = -numpy.inf
+
+        self.histogram = None
+        if any(name == "median" or name.startswith("p") for name in self.statistics):
+            bins = value_range[1] - value_range[0] + 1
+            self.histogram = numpy.zeros((self.shape[0] * self.shape[1], bins), dtype=numpy.uint16)
+            self._pixels = numpy.arange(self.shape[0] * self.shape[1])
+
+    def update(self, bands):
+        """
+        Add the observations of a (bands, rows, cols) group of bands or a
+        single (rows, cols) band.
+        """
+
+        bands = numpy.asarray(bands)
+        if bands.ndim == 2:
+            bands = bands[None]
+        for band in bands:
+            valid = band != self.nodata if self.nodata is not None else numpy.ones(self.shape, dtype=bool)
+            values = band.astype(float)
+
+            self.count += valid
+            self.sum += numpy.where(valid, band, 0).astype(numpy.int64)
+            # Welford's update of the mean and the sum of squared deviations
+            delta = numpy.where(valid, values - self.mean, 0.0)
+            self.mean += delta / numpy.maximum(self.count, 1)
+            self.m2 += delta * numpy.where(valid, values - self.mean, 0.0)
+            numpy.minimum(self.min, numpy.where(valid, values, numpy.inf), out=self.min)
+            numpy.maximum(self.max, numpy.where(valid, values, -numpy.inf), out=self.max)
+
+            if self.histogram is not None:
+                # Each pixel has one observation per band, i.e. the indices
+                # are unique and a fancy indexed increment is exact
+                bins = numpy.clip(band.ravel().astype(numpy.int64), self.value_range[0], self.value_range[1])
+                bins -= self.value_range[0]
+                pixels = self._pixels[valid.ravel()]
+                self.histogram[pixels, bins[valid.ravel()]] += 1
+
+    def result(self):
+        """
+        Get a dictionary of int16 (rows, cols) arrays per statistic name like
+        block_statistics().
+        """
+
+        empty = self.count == 0
+        n = numpy.maximum(self.count, 1)
+
+        percentiles = [float(name[1:]) for name in self.statistics if name.startswith("p")]
+        if "median" in self.statistics:
+            percentiles.append(50.0)
+        quantiles = {}
+        if len(percentiles) > 0:
+            result = histogram_percentiles(self.histogram, percentiles, self.value_range[0])
+            quantiles = dict(zip(percentiles, result.reshape((len(percentiles),) + self.shape)))
+
+        results = {}
+        for name in self.statistics:
+            if name == "count":
+                results[name] = self.count.astype(numpy.int16)
+                continue
+            if name == "mean":
+                value = self.sum / n.astype(float)
+            elif name == "std":
+                value = numpy.sqrt(self.m2 / n)
+            elif name == "min":
+                value = self.min
+            elif name == "max":
+                value = self.max
+            elif name == "median":
+                value = quantiles[50.0]
+            else:
+                value = quantiles[float(name[1:])]
+            value = numpy.where(empty, 0, value)
+            value = numpy.trunc(value).astype(numpy.int16)
+            value[empty] = self.nodata
+            results[name] = value
+        return results
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+#
+# Time axis of a stacked MODIS raster
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+# The bands of a stack are the single date rasters sorted by file name, see
+# extract_bands.merge_files(). The acquisition dates are part of the MODIS
+# file names, e.g. NDVI_MOD13Q1.A2000049.h27v06.005.2008237034925.tif for
+# the composite starting on day 49 of 2000. The dates are saved next to the
+# stack, e.g. NDVI.dates.json for NDVI.tif.
+
+import os
+import re
+import json
+from processing.journal import write_atomically
+
+# Days per MOD13Q1 composite period
+COMPOSITE_DAYS = 16
+
+class TimeAxis(object):
+    """
+    The acquisition dates of the bands of a stack, e.g. "A2000049", in band
+    order. Bands are 1-based like GDAL and R indexes.
+    """
+
+    def __init__(self, dates, composite_days=COMPOSITE_DAYS):
+
+        self.dates = list(dates)
+        self.composite_days = composite_days
+        self._bands = dict((date, band) for band, date in enumerate(self.dates, 1))
+        if len(self._bands) != len(self.dates):
+            raise ValueError("The dates of the time axis are not unique")
+
+    def __len__(self):
+        return len(self.dates)
+
+    def date(self, band):
+        """
+        Get the date of a 1-based band index.
+        """
+
+        if band < 1:
+            raise IndexError("Band index %d out of range" % band)
+        return self.dates[band - 1]
+
+    def band(self, date):
+        """
+        Get the 1-based band index of a date.
+        """
+
+        return self._bands[date]
+
+    @property
+    def frequency(self):
+        """
+        Number of composite periods per year, 23 for 16-day composites.
+        """
+
+        return -(-366 // self.composite_days)
+
+    def period(self, band):
+        """
+        Get the year and the 1-based composite period within the year of a band.
+        """
+
+        year, doy = parse_date(self.date(band))
+        return year, (doy - 1) // self.composite_days + 1
+
+    @property
+    def start(self):
+        """
+        Start of the series as (year, period) like the start of a R ts object.
+        """
+
+        return self.period(1)
+
+    def missing(self):
+        """
+        Get the (year, period) of composites that are missing between the
+        first and the last band. The bands are treated as regular series,
+        missing composites shift the season of all later bands.
+        """
+
+        result = []
+        for band in range(1, len(self.dates)):
+            year, period = self.period(band)
+            following = self.period(band + 1)
+            while True:
+                period += 1
+                if period > self.frequency:
+                    year, period = year + 1, 1
+                if (year, period) >= following:
+                    break
+                result.append((year, period))
+        return result
+
+    def save(self, filename):
+        """
+        Save the dates to a JSON file.
+        """
+
+        write_atomically(filename, json.dumps({"dates": self.dates, "composite_days": self.composite_days}))
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Load the dates from a JSON file written by save().
+        """
+
+        f = open(filename)
+        try:
+            content = json.load(f)
+        finally:
+            f.close()
+        return cls(content["dates"], content.get("composite_days", COMPOSITE_DAYS))
+
+def parse_date(date):
+    """
+    Get the year and the day of the year of a MODIS date, e.g. "A2000049".
+    """
+
+    matchObj = re.match(r"A(\d{4})(\d{3})$", date)
+    if matchObj is None:
+        raise ValueError('"%s" is not a MODIS date' % date)
+    return int(matchObj.group(1)), int(matchObj.group(2))
+
+def date_from_filename(filename):
+    """
+    Get the MODIS date of a file name, e.g. "A2000049".
+    """
+
+    matchObj = re.search(r"\.(A\d{7})\.", os.path.basename(filename))
+    if matchObj is None:
+        raise ValueError('File name "%s" contains no MODIS date' % filename)
+    return matchObj.group(1)
+
+def time_axis_from_files(filenames):
+    """
+    Build the time axis of a stack from the sorted file names of its bands.
+    """
+
+    return TimeAxis([date_from_filename(f) for f in filenames])
+
+def time_axis_filename(stack_filename):
+    """
+    Get the name of the time axis file of a stack, e.g. NDVI.dates.json for
+    NDVI.tif.
+    """
+
+    return "%s.dates.json" % re.sub(r"\.tif$", "", stack_filename)
+
+def get_time_axis(stack_filename):
+    """
+    Get the time axis of a stack. Stacks merged before the time axis was saved
+    get it from the single date rasters next to the stack.
+    """
+
+    filename = time_axis_filename(stack_filename)
+    if os.path.exists(filename):
+        return TimeAxis.load(filename)
+
+    directory = os.path.dirname(os.path.abspath(stack_filename))
+    tile = os.path.basename(directory)
+    files = sorted(f for f in os.listdir(directory)
+                   if re.search('.*%s.*tif$' % tile, f) is not None)
+    if len(files) == 0:
+        raise IOError('No time axis found for stack "%s"' % stack_filename)
+    return time_axis_from_files(files)
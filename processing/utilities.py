@@ -49,6 +49,94 @@ def get_time_array(dataset, x, y):
     # Return a numpy array
     return numpy.array(result)
 
+def get_block_size(dataset):
+    """
+    Get the internal block size of the dataset as tuple (columns, rows). All
+    bands of a stacked GeoTIFF share the same tiling, the first band is used.
+    """
+
+    return tuple(dataset.GetRasterBand(1).GetBlockSize())
+
+def get_block_windows(dataset, block_size=None):
+    """
+    Iterate over the dataset in windows that are aligned to the internal tiling
+    of the GeoTIFF. Each window is returned as tuple (xoff, yoff, xsize, ysize).
+    If a block size (columns, rows) is requested it is rounded up to a multiple
+    of the internal block size. Windows at the right and bottom border are
+    clipped to the raster size.
+    """
+
+    nbrOfCols = dataset.RasterXSize
+    nbrOfRows = dataset.RasterYSize
+
+    blockXSize, blockYSize = get_block_size(dataset)
+    if block_size is not None:
+        # Round up to full internal blocks to avoid decompressing a block twice
+        blockXSize *= max(1, -(-block_size[0] // blockXSize))
+        blockYSize *= max(1, -(-block_size[1] // blockYSize))
+    blockXSize = min(blockXSize, nbrOfCols)
+    blockYSize = min(blockYSize, nbrOfRows)
+
+    for yoff in range(0, nbrOfRows, blockYSize):
+        ysize = min(blockYSize, nbrOfRows - yoff)
+        for xoff in range(0, nbrOfCols, blockXSize):
+            xsize = min(blockXSize, nbrOfCols - xoff)
+            yield (xoff, yoff, xsize, ysize)
+
+def read_block(dataset, xoff, yoff, xsize, ysize, bands=None):
+    """
+    Read the time series of all pixels in a window as numpy.array with the
+    shape (bands, rows, cols). Each band is read with a single call. Optionally
+    only the given 1-based band indices are read.
+    """
+
+    if bands is None:
+        bands = range(1, dataset.RasterCount + 1)
+    bands = list(bands)
+
+    # Read the first band to get the data type of the stack
+    data = dataset.GetRasterBand(bands[0]).ReadAsArray(xoff, yoff, xsize, ysize)
+    cube = numpy.empty((len(bands), ysize, xsize), dtype=data.dtype)
+    cube[0] = data
+
+    # Loop the remaining bands
+    for j in range(1, len(bands)):
+        # 1-based index
+        band = dataset.GetRasterBand(bands[j])
+        cube[j] = band.ReadAsArray(xoff, yoff, xsize, ysize)
+
+    return cube
+
+def iter_time_blocks(dataset, block_size=None):
+    """
+    Iterate over the dataset block by block. For each block the window
+    (xoff, yoff, xsize, ysize) and the time series cube with the shape
+    (bands, rows, cols) is returned.
+    """
+
+    for window in get_block_windows(dataset, block_size):
+        yield window, read_block(dataset, *window)
+
+def create_gtiff(filename, size, projection, geotransform, bandtype=gdalconst.GDT_Byte, bands=1, nodata=0):
+    """
+    Create a new tiled and LZW compressed GeoTIFF with the given size, projection
+    and transformation. The NODATA value is set on all bands.
+    """
+
+    # Get the GeoTIFF driver and register it
+    driver = gdal.GetDriverByName("GTiff")
+    driver.Register()
+
+    dataset = driver.Create(filename, size[0], size[1], bands, bandtype, ['COMPRESS=LZW', 'PREDICTOR=2', 'BLOCKXSIZE=128', 'BLOCKYSIZE=128', 'TILED=YES'])
+    # Set the input projection and transformation
+    dataset.SetProjection(projection)
+    dataset.SetGeoTransform(geotransform)
+    # Set the NODATA value
+    for j in range(bands):
+        dataset.GetRasterBand(j + 1).SetNoDataValue(nodata)
+
+    return dataset
+
 def write_to_gtiff(filename, value, pixel, size, projection, geotransform, bandtype=gdalconst.GDT_Byte):
     """
     Write a pixel value to a file at the specified position. If the file does not
@@ -56,25 +144,14 @@ def write_to_gtiff(filename, value, pixel, size, projection, geotransform, bandt
     with the new value.
     """
 
-    # Get the GeoTIFF driver and register it
-    driver = gdal.GetDriverByName("GTiff")
-    driver.Register()
-    
     # Check if the output file already exists. If yes, it is opened and get the
     # first band.
     if os.path.exists(filename):
         dataset = gdal.Open(filename, gdalconst.GA_Update)
-        band = dataset.GetRasterBand(1)
     else:
         # Create a new file if it does not yet exist
-        dataset = driver.Create(filename, size[0], size[1], 1, bandtype, ['COMPRESS=LZW', 'PREDICTOR=2', 'BLOCKXSIZE=128', 'BLOCKYSIZE=128', 'TILED=YES'])
-        # Set the input projection and transformation
-        dataset.SetProjection(projection)
-        dataset.SetGeoTransform(geotransform)
-        # Get the first band
-        band = dataset.GetRasterBand(1)
-        # Set the NODATA value
-        band.SetNoDataValue(0)
+        dataset = create_gtiff(filename, size, projection, geotransform, bandtype)
+    band = dataset.GetRasterBand(1)
     
     # Write the single value to the specified pixel position
     band.WriteArray(numpy.array([[value]]), pixel[0], pixel[1])
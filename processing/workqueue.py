@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+#
+# File-based work queue on a shared filesystem
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+# The queue is a directory that all workers can reach, e.g. on the shared
+# VITS_DATA_PATH:
+#
+# units/<unit>.json     description of each work unit
+# leases/<unit>.lease   worker and expiry time of a claimed unit
+# results/<unit>.json   results of a completed unit
+#
+# A unit is claimed by hard linking a lease file to its name, which fails if
+# the unit is already leased. Hard links are atomic on NFS as well, unlike
+# O_EXCL on older NFS versions. A worker renews its lease while it works on
+# a unit from a heartbeat thread, leases of crashed workers expire and are
+# claimed again. A lease is only renewed while it still names the worker. A
+# unit description may set its own lease time in seconds as "lease", e.g.
+# for engines that hold the interpreter for a long time. The expiry is
+# compared with the local clock, the clocks of the nodes must therefore
+# be synchronized to well within the lease time. Results are committed
+# atomically, a unit that is processed twice after an expired lease gets the
+# same results again.
+
+import os
+import re
+import json
+import time
+import errno
+import socket
+import threading
+from processing.journal import write_atomically
+
+class WorkQueue(object):
+    """
+    A queue of work units in a directory. Units are identified by a name of
+    letters, digits, dots, dashes and underscores and described by any JSON
+    serializable value.
+    """
+
+    def __init__(self, directory, lease_time=600.0, worker=None):
+
+        self.directory = directory
+        self.lease_time = lease_time
+        if worker is None:
+            worker = "%s-%d" % (socket.gethostname(), os.getpid())
+        self.worker = worker
+        # Lease times of the claimed units that set their own
+        self._lease_times = {}
+
+        for name in ["units", "leases", "results"]:
+            path = os.path.join(directory, name)
+            try:
+                os.makedirs(path)
+            except OSError as e:
+                # Another worker may have created the directory meanwhile
+                if e.errno != errno.EEXIST:
+                    raise
+
+    def _path(self, kind, unit, extension="json"):
+        return os.path.join(self.directory, kind, "%s.%s" % (unit, extension))
+
+    def _names(self, kind):
+        names = []
+        for name in os.listdir(os.path.join(self.directory, kind)):
+            matchObj = re.match(r"([A-Za-z0-9_.\-]+)\.json$", name)
+            if matchObj is not None:
+                names.append(matchObj.group(1))
+        return sorted(names)
+
+    def add(self, unit, description):
+        """
+        Add a work unit. Existing units are kept, adding is idempotent.
+        """
+
+        if re.match(r"[A-Za-z0-9_.\-]+$", unit) is None:
+            raise ValueError('Invalid unit name "%s"' % unit)
+        if not os.path.exists(self._path("units", unit)):
+            write_atomically(self._path("units", unit), json.dumps(description))
+
+    def units(self):
+        """
+        Get the names of all units.
+        """
+
+        return self._names("units")
+
+    def completed(self):
+        """
+        Get the names of the completed units.
+        """
+
+        return self._names("results")
+
+    def description(self, unit):
+        f = open(self._path("units", unit))
+        try:
+            return json.load(f)
+        finally:
+            f.close()
+
+    def _read_lease(self, unit):
+        try:
+            f = open(self._path("leases", unit, "lease"))
+        except IOError:
+            return None
+        try:
+            try:
+                return json.load(f)
+            except ValueError:
+                # A lease that is being written, treat it as valid
+                return {"worker": None, "expires": time.time() + self.lease_time}
+        finally:
+            f.close()
+
+    def _lease_time(self, unit):
+        return self._lease_times.get(unit, self.lease_time)
+
+    def _write_lease(self, unit):
+        """
+        Try to create the lease of a unit, return True on success.
+        """
+
+        tmp = self._path("leases", "%s.%s" % (unit, self.worker), "tmp")
+        write_atomically(tmp, json.dumps({"worker": self.worker, "expires": time.time() + self._lease_time(unit)}))
+        try:
+            os.link(tmp, self._path("leases", unit, "lease"))
+            return True
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+            return False
+        finally:
+            os.remove(tmp)
+
+    def _break_lease(self, unit, lease):
+        """
+        Remove an expired lease. Only one of several workers that found the
+        same expired lease removes it.
+        """
+
+        filename = self._path("leases", unit, "lease")
+        expired = "%s.expired.%s" % (filename, self.worker)
+        try:
+            os.rename(filename, expired)
+        except OSError:
+            # Another worker was faster
+            return
+        f = open(expired)
+        try:
+            try:
+                content = json.load(f)
+            except ValueError:
+                content = None
+        finally:
+            f.close()
+        if content != lease:
+            # A new lease was created between reading and renaming it, put it
+            # back unless yet another lease exists already
+            try:
+                os.link(expired, filename)
+            except OSError:
+                pass
+        os.remove(expired)
+
+    def claim(self):
+        """
+        Claim the next unit that is neither completed nor leased. The name and
+        the description of the unit are returned, None if there is no unit
+        left to claim.
+        """
+
+        completed = set(self.completed())
+        for unit in self.units():
+            if unit in completed:
+                continue
+            lease = self._read_lease(unit)
+            if lease is not None:
+                if lease["expires"] > time.time():
+                    continue
+                self._break_lease(unit, lease)
+            description = self.description(unit)
+            if isinstance(description, dict) and "lease" in description:
+                self._lease_times[unit] = float(description["lease"])
+            if self._write_lease(unit):
+                # The unit may have been completed meanwhile
+                if os.path.exists(self._path("results", unit)):
+                    self.release(unit)
+                    continue
+                return unit, description
+        return None
+
+    def renew(self, unit):
+        """
+        Extend the lease of a unit claimed by this worker. False is returned
+        if the lease was lost, e.g. because it expired and another worker
+        claimed the unit.
+        """
+
+        lease = self._read_lease(unit)
+        if lease is None or lease["worker"] != self.worker:
+            return False
+        # The lease may expire and be claimed by another worker after it was
+        # read. It is therefore moved away atomically and only replaced if it
+        # is still the lease of this worker, like an expired lease is broken.
+        filename = self._path("leases", unit, "lease")
+        held = "%s.renew.%s" % (filename, self.worker)
+        try:
+            os.rename(filename, held)
+        except OSError:
+            return False
+        try:
+            f = open(held)
+            try:
+                try:
+                    current = json.load(f)
+                except ValueError:
+                    current = None
+            finally:
+                f.close()
+            if current is None or current["worker"] != self.worker:
+                # Put the lease of the other worker back unless yet another
+                # lease exists already
+                try:
+                    os.link(held, filename)
+                except OSError:
+                    pass
+                return False
+            return self._write_lease(unit)
+        finally:
+            os.remove(held)
+
+    def release(self, unit):
+        """
+        Give up the lease of a unit claimed by this worker.
+        """
+
+        lease = self._read_lease(unit)
+        if lease is not None and lease["worker"] == self.worker:
+            try:
+                os.remove(self._path("leases", unit, "lease"))
+            except OSError:
+                pass
+
+    def complete(self, unit, results):
+        """
+        Store the results of a unit and release its lease.
+        """
+
+        write_atomically(self._path("results", unit), json.dumps(results))
+        self.release(unit)
+
+    def load(self, unit):
+        """
+        Get the results of a completed unit.
+        """
+
+        f = open(self._path("results", unit))
+        try:
+            return json.load(f)
+        finally:
+            f.close()
+
+class Heartbeat(threading.Thread):
+    """
+    Renew the lease of a unit in the background while the unit is processed.
+    The lease is renewed four times per lease time, lost is set if the
+    lease was lost meanwhile.
+    """
+
+    def __init__(self, queue, unit):
+
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.queue = queue
+        self.unit = unit
+        self.interval = queue._lease_time(unit) / 4.0
+        self.lost = False
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            if not self.queue.renew(self.unit):
+                self.lost = True
+                return
+
+    def stop(self):
+        """
+        Stop renewing the lease and wait for the thread.
+        """
+
+        self._stopped.set()
+        self.join()
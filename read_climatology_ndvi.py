@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+#
+# Script which calculates the day-of-year climatology of MODIS NDVI time series
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import os
+import os.path
+import sys
+import time
+import argparse
+import logging
+import logging.config
+try:
+    import gdal
+except ImportError:
+    import osgeo.gdal as gdal
+try:
+    import gdalconst
+except ImportError:
+    import osgeo.gdalconst as gdalconst
+from processing.utilities import get_block_windows
+from processing.utilities import create_gtiff
+from processing.prescreen import NDVI_NODATA
+from processing.quality import QualityMask
+from processing.summary import STATISTICS
+from processing.timeaxis import get_time_axis
+from processing.climatology import CLIMATOLOGY_STATISTICS
+from processing.climatology import ClimatologyState
+from processing.climatology import period_bands
+from processing.climatology import block_climatology
+from processing.metrics import Metrics
+
+# Variable log needs to be global
+log = None
+
+def climatology_filename(tile, statistic=None):
+    """
+    Get the climatology of a statistic of a tile, e.g.
+    CLIMATOLOGY/<tile>/CLIMATOLOGY_MEAN_MOD13Q1.<tile>.tif, or without
+    statistic the common prefix of the files of the tile.
+    """
+
+    directory = "%s/MODIS/processed/CLIMATOLOGY/%s" % (os.environ['VITS_DATA_PATH'], tile)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    if statistic is None:
+        return "%s/CLIMATOLOGY_MOD13Q1.%s" % (directory, tile)
+    return "%s/CLIMATOLOGY_%s_MOD13Q1.%s.tif" % (directory, statistic.upper(), tile)
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+
+    # Parse the command line options
+    parser = argparse.ArgumentParser(description="Calculate the statistics of each composite period over all years of MODIS NDVI time series.")
+    parser.add_argument("tiles", nargs="+", help="MODIS tiles, e.g. h16v08")
+    parser.add_argument("--statistics", nargs="+", choices=STATISTICS, default=CLIMATOLOGY_STATISTICS,
+                        help="Statistics per composite period (default: %s)" % " ".join(CLIMATOLOGY_STATISTICS))
+    parser.add_argument("--max-reliability", type=int, choices=[0, 1, 2],
+                        help="Ignore observations whose MODLAND QA (bits 0-1 of the QUAL stack) is worse: 0 keeps good quality only, 1 also observations to check with the other QA bits, 2 also probably cloudy ones (default: all observations)")
+    parser.add_argument("--force", action="store_true",
+                        help="Recalculate all composite periods even if their bands did not change")
+    args = parser.parse_args(argv[1:])
+
+    # Get the logging configuration file
+    logging.config.fileConfig(argv[0].replace("py", "ini"))
+    # Get the root logger from the config file
+    global log
+    log = logging.getLogger(__name__)
+
+    # Register the GeoTiff driver
+    driver = gdal.GetDriverByName("GTiff")
+    driver.Register()
+
+    # Process MODIS tiles
+    for tile in args.tiles:
+
+        # Check if VITS_DATA_PATH is set as environment variable
+        if "VITS_DATA_PATH" not in os.environ:
+            log.error('"VITS_DATA_PATH" is not set in the environment.')
+            sys.exit(1)
+        # Open the stacked NDVI image
+        filename = '%s/MODIS/processed/NDVI/%s/NDVI.tif' % (os.environ['VITS_DATA_PATH'], tile)
+        ds = gdal.Open(filename, gdalconst.GA_ReadOnly)
+        if ds is None:
+            log.error('Raster file "%s" could not be opened.' % filename)
+            sys.exit(1)
+
+        # The dates of the bands of the stack
+        time_axis = get_time_axis(filename)
+        if len(time_axis) != ds.RasterCount:
+            log.error('The time axis of "%s" has %d dates but the stack has %d bands.' % (filename, len(time_axis), ds.RasterCount))
+            sys.exit(1)
+        bands = period_bands(time_axis)
+
+        size = (ds.RasterXSize, ds.RasterYSize)
+        proj = ds.GetProjection()
+        trans = ds.GetGeoTransform()
+        # The fill value of the stack is the NODATA value of the climatology
+        nodata = ds.GetRasterBand(1).GetNoDataValue()
+        if nodata is None:
+            nodata = NDVI_NODATA
+        quality = None
+        if args.max_reliability is not None:
+            quality = QualityMask('%s/MODIS/processed/QUAL/%s/QUAL.tif' % (os.environ['VITS_DATA_PATH'], tile),
+                                  args.max_reliability, nodata)
+
+        # Only the periods with new bands are recalculated, all periods if
+        # a climatology is missing or the settings changed
+        state = ClimatologyState("%s.json" % climatology_filename(tile),
+                                 {"statistics": sorted(args.statistics), "max_reliability": args.max_reliability, "nodata": nodata})
+        periods = state.updated_periods(time_axis)
+        outputs = {}
+        for statistic in args.statistics:
+            output = None
+            if not args.force and os.path.exists(climatology_filename(tile, statistic)):
+                output = gdal.Open(climatology_filename(tile, statistic), gdalconst.GA_Update)
+            if output is None or output.RasterCount != time_axis.frequency:
+                output = create_gtiff(climatology_filename(tile, statistic), size, proj, trans,
+                                      gdalconst.GDT_Int16, time_axis.frequency, nodata)
+                for period in range(1, time_axis.frequency + 1):
+                    output.GetRasterBand(period).SetDescription("period %d" % period)
+                    # Periods without any band, e.g. of a short stack
+                    if len(bands[period]) == 0:
+                        output.GetRasterBand(period).Fill(nodata)
+                periods = range(1, time_axis.frequency + 1)
+            outputs[statistic] = output
+        if len(periods) == 0:
+            log.info("The climatology of tile %s is up to date" % tile)
+            continue
+        log.info("Calculating %d composite periods of the climatology of tile %s" % (len(periods), tile))
+
+        metrics = Metrics("Tile %s" % tile, size[0] * size[1], log)
+
+        # Each band of the changed periods is read once per block
+        for window in get_block_windows(ds):
+            xoff, yoff, xsize, ysize = window
+            for period in periods:
+                if len(bands[period]) == 0:
+                    continue
+                starttime = time.time()
+                results = block_climatology(ds, window, bands[period], args.statistics, nodata, quality)
+                metrics.record("climatology", time.time() - starttime, xsize * ysize)
+
+                starttime = time.time()
+                for statistic in args.statistics:
+                    outputs[statistic].GetRasterBand(period).WriteArray(results[statistic], xoff, yoff)
+                metrics.record("write", time.time() - starttime, xsize * ysize)
+            metrics.progress(xsize * ysize)
+
+        # Close the datasets in order to write the data persistently to the files
+        outputs = None
+        state.save(time_axis)
+
+        metrics.log_summary()
+        metrics.export("%s.metrics.json" % climatology_filename(tile))
+
+if __name__ == "__main__":
+    sys.exit(main())
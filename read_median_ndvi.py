@@ -22,8 +22,10 @@
 
 import os
 import os.path
+import re
 import sys
 import time
+import argparse
 import logging
 import logging.config
 import numpy
@@ -35,8 +37,16 @@ try:
     import gdalconst
 except ImportError:
     import osgeo.gdalconst as gdalconst
-from processing.utilities import get_time_array
-from processing.utilities import write_to_gtiff
+from processing.utilities import iter_time_blocks
+from processing.utilities import get_block_windows
+from processing.utilities import read_block
+from processing.utilities import create_gtiff
+from processing.prescreen import NDVI_NODATA
+from processing.quality import QualityMask
+from processing.summary import block_median
+from processing.histstore import HistogramStore
+from processing.timeaxis import get_time_axis
+from processing.metrics import Metrics
 
 # Variable log needs to be global
 log = None
@@ -44,7 +54,21 @@ log = None
 def main(argv=None):
     if argv is None:
         argv = sys.argv
-        
+
+    # Parse the command line options
+    parser = argparse.ArgumentParser(description="Calculate the median of MODIS NDVI time series.")
+    parser.add_argument("tiles", nargs="*", default=["h16v08"],
+                        help="MODIS tiles, e.g. h16v08 (default: h16v08)")
+    parser.add_argument("--max-reliability", type=int, choices=[0, 1, 2],
+                        help="Ignore observations whose MODLAND QA (bits 0-1 of the QUAL stack) is worse: 0 keeps good quality only, 1 also observations to check with the other QA bits, 2 also probably cloudy ones (default: all observations)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Keep value histograms next to the median and read only the bands appended since the last run. The median and the percentiles are interpolated within the histogram bins and may differ from the exact values by up to one bin width, the method and the bin width are recorded in the metadata of the outputs")
+    parser.add_argument("--bin-width", type=int, default=100,
+                        help="Width of the histogram bins in stack units in incremental mode, 1 gives the exact values (default: 100)")
+    parser.add_argument("--percentiles", nargs="+", type=int, default=[],
+                        help="Percentiles written in incremental mode in addition to the median, e.g. 10 90")
+    args = parser.parse_args(argv[1:])
+
     logging.config.fileConfig(argv[0].replace("py", "ini"))
     # Get the root logger from the config file
     global log
@@ -55,7 +79,7 @@ def main(argv=None):
     driver.Register()
     
     # Process MODIS tiles
-    for tile in ["h16v08"]:
+    for tile in args.tiles:
         
         # Check if VITS_DATA_PATH is set as environment variable
         if "VITS_DATA_PATH" not in os.environ:
@@ -69,6 +93,15 @@ def main(argv=None):
             log.error('Raster file "%s" could not be opened.' % filename)
             sys.exit(1)
             
+        # The dates of the bands of the stack identify the bands absorbed by
+        # the histograms
+        time_axis = None
+        if args.incremental:
+            time_axis = get_time_axis(filename)
+            if len(time_axis) != ds.RasterCount:
+                log.error('The time axis of "%s" has %d dates but the stack has %d bands.' % (filename, len(time_axis), ds.RasterCount))
+                sys.exit(1)
+
         # Get the file size in pixels
         nbrOfCols =  ds.RasterXSize
         nbrOfRows = ds.RasterYSize
@@ -81,17 +114,107 @@ def main(argv=None):
         #result = calc_bfast(time_array)
         #log.debug(result)
 
-        # Loop over each pixel
-        for row in range(0, nbrOfRows):
-            for col in range(0, nbrOfCols):
+        filename = "%s/MODIS/processed/MEDIAN/%s/MEDIAN_MOD13Q1.%s.tif" % (os.environ['VITS_DATA_PATH'], tile, tile)
+
+        # The fill value of the stack is the NODATA value of the median
+        nodata = ds.GetRasterBand(1).GetNoDataValue()
+        if nodata is None:
+            nodata = NDVI_NODATA
+        quality = None
+        if args.max_reliability is not None:
+            quality = QualityMask('%s/MODIS/processed/QUAL/%s/QUAL.tif' % (os.environ['VITS_DATA_PATH'], tile),
+                                  args.max_reliability, nodata)
+
+        metrics = Metrics("Tile %s" % tile, nbrOfCols * nbrOfRows, log)
+        output = create_gtiff(filename, (nbrOfCols, nbrOfRows), proj, trans, gdalconst.GDT_Int16, nodata=nodata)
+        outBand = output.GetRasterBand(1)
+        # The incremental values depend on the bin width, the outputs tell
+        # how they were calculated
+        metadata = {"METHOD": "exact"}
+        if args.incremental:
+            metadata = {"METHOD": "histogram", "HISTOGRAM_BIN_WIDTH": str(args.bin_width)}
+        for key in sorted(metadata):
+            output.SetMetadataItem(key, metadata[key])
+
+        if args.incremental:
+            store = HistogramStore(re.sub(r"\.tif$", ".hist.npy", filename), (nbrOfCols, nbrOfRows), args.bin_width,
+                                   settings={"max_reliability": args.max_reliability, "nodata": nodata})
+            if not store.open(time_axis):
+                log.info("Building the histograms of tile %s from all bands" % tile)
+                store.create()
+            newBands = range(store.bands + 1, ds.RasterCount + 1)
+            log.info("Adding %d bands to the histograms of tile %s" % (len(newBands), tile))
+            if len(newBands) > 0:
+                store.invalidate()
+
+            percentileBands = []
+            for percentile in args.percentiles:
+                percentileFilename = "%s/MODIS/processed/P%d/%s/P%d_MOD13Q1.%s.tif" % (os.environ['VITS_DATA_PATH'], percentile, tile, percentile, tile)
+                if not os.path.exists(os.path.dirname(percentileFilename)):
+                    os.makedirs(os.path.dirname(percentileFilename))
+                percentileOutput = create_gtiff(percentileFilename, (nbrOfCols, nbrOfRows), proj, trans, gdalconst.GDT_Int16, nodata=nodata)
+                for key in sorted(metadata):
+                    percentileOutput.SetMetadataItem(key, metadata[key])
+                percentileBands.append((percentileOutput, percentileOutput.GetRasterBand(1)))
+
+            # Read only the new bands of each block, the median and the
+            # percentiles are recomputed from the histograms
+            for window in get_block_windows(ds):
+                xoff, yoff, xsize, ysize = window
+                starttime = time.time()
+                if len(newBands) > 0:
+                    cube = read_block(ds, *window, bands=newBands)
+                    if quality is not None:
+                        cube = quality.mask(cube, window, bands=newBands)
+                    metrics.record("read", time.time() - starttime, xsize * ysize)
+
+                    starttime = time.time()
+                    store.add(window, cube, nodata)
+                    metrics.record("histogram", time.time() - starttime, xsize * ysize)
+
                 starttime = time.time()
-                # Get the time series for the current pixel
-                time_array = get_time_array(ds, col, row)
-                filename = "%s/MODIS/processed/MEDIAN/%s/MEDIAN_MOD13Q1.%s.tif" % (os.environ['VITS_DATA_PATH'], tile, tile)
-                #log.debug("Selecting file \"%s\"" % filename)
-                write_to_gtiff(filename, int(numpy.median(time_array)), (col, row), (nbrOfCols, nbrOfRows), proj, trans, gdalconst.GDT_Int16)
-                endtime = time.time()
-                log.debug("It took %s" % (endtime - starttime))
-                    
+                values = store.percentiles(window, [50.0] + [float(p) for p in args.percentiles])
+                empty = store.count(window) == 0
+                values = numpy.trunc(values).astype(numpy.int16)
+                values[:, empty] = nodata
+                metrics.record("median", time.time() - starttime, xsize * ysize)
+
+                starttime = time.time()
+                outBand.WriteArray(values[0], xoff, yoff)
+                for i, (percentileOutput, percentileBand) in enumerate(percentileBands):
+                    percentileBand.WriteArray(values[i + 1], xoff, yoff)
+                metrics.record("write", time.time() - starttime, xsize * ysize)
+                metrics.progress(xsize * ysize)
+
+            store.flush(time_axis.dates)
+            store.close()
+            percentileBands = None
+        else:
+            # Loop over the stack block by block, aligned to its internal tiling,
+            # and write each block of the median once
+            starttime = time.time()
+            for window, cube in iter_time_blocks(ds):
+                xoff, yoff, xsize, ysize = window
+                if quality is not None:
+                    cube = quality.mask(cube, window)
+                metrics.record("read", time.time() - starttime, xsize * ysize)
+
+                starttime = time.time()
+                median = block_median(cube, nodata)
+                metrics.record("median", time.time() - starttime, xsize * ysize)
+
+                starttime = time.time()
+                outBand.WriteArray(median, xoff, yoff)
+                metrics.record("write", time.time() - starttime, xsize * ysize)
+                metrics.progress(xsize * ysize)
+                starttime = time.time()
+
+        # Close the dataset in order to write the data persistently to the file
+        outBand = None
+        output = None
+
+        metrics.log_summary()
+        metrics.export(re.sub(r"\.tif$", ".metrics.json", filename))
+
 if __name__ == "__main__":
     sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+#
+# Script which calculates temporal statistics of MODIS NDVI time series
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import os
+import os.path
+import re
+import sys
+import time
+import argparse
+import logging
+import logging.config
+try:
+    import gdal
+except ImportError:
+    import osgeo.gdal as gdal
+try:
+    import gdalconst
+except ImportError:
+    import osgeo.gdalconst as gdalconst
+from processing.utilities import iter_time_blocks
+from processing.utilities import get_block_windows
+from processing.utilities import read_block
+from processing.utilities import create_gtiff
+from processing.prescreen import NDVI_NODATA
+from processing.quality import QualityMask
+from processing.summary import STATISTICS
+from processing.summary import block_statistics
+from processing.summary import HISTOGRAM_RANGE
+from processing.summary import StreamingStatistics
+from processing.metrics import Metrics
+
+# Variable log needs to be global
+log = None
+
+def statistic_filename(tile, statistic):
+    """
+    Get the output file of a statistic of a tile, e.g.
+    MEDIAN/<tile>/MEDIAN_MOD13Q1.<tile>.tif for the median.
+    """
+
+    name = statistic.upper()
+    directory = "%s/MODIS/processed/%s/%s" % (os.environ['VITS_DATA_PATH'], name, tile)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    return "%s/%s_MOD13Q1.%s.tif" % (directory, name, tile)
+
+def histogram_pixels(statistics, histogram_memory):
+    """
+    Number of pixels whose percentile histograms fit into histogram_memory
+    MB, None if no statistic needs a histogram.
+    """
+
+    if not any(statistic == "median" or statistic.startswith("p") for statistic in statistics):
+        return None
+    bins = HISTOGRAM_RANGE[1] - HISTOGRAM_RANGE[0] + 1
+    return histogram_memory * 1024 * 1024 // (bins * 2)
+
+def iter_streaming_statistics(ds, statistics, nodata, quality=None, band_group=23, histogram_memory=64):
+    """
+    Calculate the statistics block by block reading a group of bands at a
+    time. Blocks are split into strips of rows, or of columns of a single row,
+    whose histograms fit into histogram_memory MB, so the memory does not
+    depend on the number of bands. For each strip the window and the
+    statistics are returned.
+    """
+
+    pixels = histogram_pixels(statistics, histogram_memory)
+    if pixels is not None and pixels < 1:
+        raise ValueError("The histogram of a single pixel does not fit into %d MB" % histogram_memory)
+    for xoff, yoff, xsize, ysize in get_block_windows(ds):
+        if pixels is None:
+            rows, cols = ysize, xsize
+        elif pixels >= xsize:
+            rows, cols = min(ysize, pixels // xsize), xsize
+        else:
+            # A single row of e.g. a striped stack is already too large
+            rows, cols = 1, pixels
+        for stripYOffset in range(yoff, yoff + ysize, rows):
+            for stripXOffset in range(xoff, xoff + xsize, cols):
+                window = (stripXOffset, stripYOffset,
+                          min(cols, xoff + xsize - stripXOffset), min(rows, yoff + ysize - stripYOffset))
+                accumulator = StreamingStatistics((window[3], window[2]), nodata, statistics)
+                for first in range(1, ds.RasterCount + 1, band_group):
+                    bands = range(first, min(first + band_group, ds.RasterCount + 1))
+                    cube = read_block(ds, *window, bands=bands)
+                    if quality is not None:
+                        cube = quality.mask(cube, window, bands=bands)
+                    accumulator.update(cube)
+                yield window, accumulator.result()
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+
+    # Parse the command line options
+    parser = argparse.ArgumentParser(description="Calculate temporal statistics of MODIS NDVI time series with one read of the stack.")
+    parser.add_argument("tiles", nargs="+", help="MODIS tiles, e.g. h16v08")
+    parser.add_argument("--statistics", nargs="+", default=STATISTICS,
+                        help="Statistics to calculate: mean, std, min, max, count, median and percentiles as p<percent>, e.g. p10 (default: %s)" % " ".join(STATISTICS))
+    parser.add_argument("--combined", action="store_true",
+                        help="Write one STATISTICS product with a band per statistic instead of a product per statistic")
+    parser.add_argument("--streaming", action="store_true",
+                        help="Read a group of bands at a time, the memory does not depend on the number of bands")
+    parser.add_argument("--band-group", type=int, default=23,
+                        help="Number of bands read at a time in streaming mode (default: 23)")
+    parser.add_argument("--histogram-memory", type=int, default=64,
+                        help="Memory in MB of the percentile histograms in streaming mode (default: 64)")
+    parser.add_argument("--max-reliability", type=int, choices=[0, 1, 2],
+                        help="Ignore observations whose MODLAND QA (bits 0-1 of the QUAL stack) is worse: 0 keeps good quality only, 1 also observations to check with the other QA bits, 2 also probably cloudy ones (default: all observations)")
+    args = parser.parse_args(argv[1:])
+
+    for statistic in args.statistics:
+        if statistic not in STATISTICS and re.match(r"p\d+(\.\d+)?$", statistic) is None:
+            parser.error('Unknown statistic "%s"' % statistic)
+
+    if args.streaming:
+        pixels = histogram_pixels(args.statistics, args.histogram_memory)
+        if pixels is not None and pixels < 1:
+            parser.error("--histogram-memory %d MB is too small for the histogram of a single pixel" % args.histogram_memory)
+
+    # Get the logging configuration file
+    logging.config.fileConfig(argv[0].replace("py", "ini"))
+    # Get the root logger from the config file
+    global log
+    log = logging.getLogger(__name__)
+
+    # Register the GeoTiff driver
+    driver = gdal.GetDriverByName("GTiff")
+    driver.Register()
+
+    # Process MODIS tiles
+    for tile in args.tiles:
+
+        # Check if VITS_DATA_PATH is set as environment variable
+        if "VITS_DATA_PATH" not in os.environ:
+            log.error('"VITS_DATA_PATH" is not set in the environment.')
+            sys.exit(1)
+        # Open the stacked NDVI image
+        filename = '%s/MODIS/processed/NDVI/%s/NDVI.tif' % (os.environ['VITS_DATA_PATH'], tile)
+        ds = gdal.Open(filename, gdalconst.GA_ReadOnly)
+        if ds is None:
+            log.error('Raster file "%s" could not be opened.' % filename)
+            sys.exit(1)
+
+        size = (ds.RasterXSize, ds.RasterYSize)
+        proj = ds.GetProjection()
+        trans = ds.GetGeoTransform()
+        # The fill value of the stack is the NODATA value of the statistics
+        nodata = ds.GetRasterBand(1).GetNoDataValue()
+        if nodata is None:
+            nodata = NDVI_NODATA
+        quality = None
+        if args.max_reliability is not None:
+            quality = QualityMask('%s/MODIS/processed/QUAL/%s/QUAL.tif' % (os.environ['VITS_DATA_PATH'], tile),
+                                  args.max_reliability, nodata)
+
+        # The output band of each statistic
+        outputs = []
+        filenames = []
+        bands = {}
+        if args.combined:
+            filenames.append(statistic_filename(tile, "statistics"))
+            output = create_gtiff(filenames[-1], size, proj, trans,
+                                  gdalconst.GDT_Int16, len(args.statistics), nodata)
+            outputs.append(output)
+            for i, statistic in enumerate(args.statistics):
+                bands[statistic] = output.GetRasterBand(i + 1)
+                bands[statistic].SetDescription(statistic)
+        else:
+            for statistic in args.statistics:
+                filenames.append(statistic_filename(tile, statistic))
+                output = create_gtiff(filenames[-1], size, proj, trans,
+                                      gdalconst.GDT_Int16, 1, nodata)
+                outputs.append(output)
+                bands[statistic] = output.GetRasterBand(1)
+
+        metrics = Metrics("Tile %s" % tile, size[0] * size[1], log)
+
+        # Read each block of the stack once and write each block of every
+        # statistic once, in streaming mode a group of bands at a time
+        starttime = time.time()
+        if args.streaming:
+            blocks = iter_streaming_statistics(ds, args.statistics, nodata, quality,
+                                               args.band_group, args.histogram_memory)
+        else:
+            blocks = iter_time_blocks(ds)
+        for window, block in blocks:
+            xoff, yoff, xsize, ysize = window
+            if args.streaming:
+                results = block
+                metrics.record("statistics", time.time() - starttime, xsize * ysize)
+            else:
+                cube = block
+                if quality is not None:
+                    cube = quality.mask(cube, window)
+                metrics.record("read", time.time() - starttime, xsize * ysize)
+
+                starttime = time.time()
+                results = block_statistics(cube, nodata, args.statistics)
+                metrics.record("statistics", time.time() - starttime, xsize * ysize)
+
+            starttime = time.time()
+            for statistic in args.statistics:
+                bands[statistic].WriteArray(results[statistic], xoff, yoff)
+            metrics.record("write", time.time() - starttime, xsize * ysize)
+            metrics.progress(xsize * ysize)
+            starttime = time.time()
+
+        # Close the datasets in order to write the data persistently to the files
+        bands = None
+        outputs = None
+
+        metrics.log_summary()
+        # The metrics of the run next to each written product
+        for product in filenames:
+            metrics.export(re.sub(r"\.tif$", ".metrics.json", product))
+        log.info("%d statistics of tile %s written" % (len(args.statistics), tile))
+
+if __name__ == "__main__":
+    sys.exit(main())
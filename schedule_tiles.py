@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+#
+# Script which keeps the products of many MODIS tiles current
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import os
+import os.path
+import sys
+import argparse
+import logging
+import logging.config
+import multiprocessing
+try:
+    import gdal
+except ImportError:
+    import osgeo.gdal as gdal
+try:
+    import gdalconst
+except ImportError:
+    import osgeo.gdalconst as gdalconst
+from processing.scheduler import TILES
+from processing.scheduler import PYTHON_MEMORY
+from processing.scheduler import R_MEMORY
+from processing.scheduler import Job
+from processing.scheduler import TileScheduler
+from processing.scheduler import python_command
+from processing.scheduler import stack_mtime
+from processing.utilities import get_block_size
+
+# Variable log needs to be global
+log = None
+
+def window_pixels(stack):
+    """
+    Number of pixels of the windows the scripts read, i.e. of the internal
+    blocks of the stack, e.g. one row of a striped stack written by
+    gdal_merge or 128 x 128 pixels of a tiled stack.
+    """
+
+    blockXSize, blockYSize = get_block_size(stack)
+    return min(blockXSize, stack.RasterXSize) * min(blockYSize, stack.RasterYSize)
+
+def bfast_job(tile, stack, args):
+    """
+    Get the job that detects the BFast breakpoints of a tile.
+    """
+
+    command = python_command("read_bfast_breaks.py", [tile, "--workers", args.workers,
+                                                      "--engine", args.engine, "--output", args.output])
+    bands, cols, rows = stack.RasterCount, stack.RasterXSize, stack.RasterYSize
+    # The break maps of the whole tile are kept in memory
+    if args.output == "compact":
+        memory = cols * rows * (3 + 2 * 5)
+    else:
+        memory = cols * rows * bands // 8
+    # The int16 block cube and its float copy per worker
+    memory += args.workers * window_pixels(stack) * bands * (2 + 8)
+    # An R session or the RSS tables of a chunk of 128 pixels per worker
+    if args.engine != "numpy":
+        memory += args.workers * (PYTHON_MEMORY + R_MEMORY)
+    else:
+        memory += args.workers * (PYTHON_MEMORY + 128 * bands * bands * 8)
+    return Job("bfast", tile, command, args.workers, PYTHON_MEMORY + memory)
+
+def median_job(tile, stack, args):
+    """
+    Get the job that calculates the NDVI median of a tile.
+    """
+
+    command = python_command("read_median_ndvi.py", [tile])
+    # One block of all bands as int16 and as float
+    return Job("median", tile, command, 1, PYTHON_MEMORY + window_pixels(stack) * stack.RasterCount * (2 + 8))
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+
+    # Parse the command line options
+    parser = argparse.ArgumentParser(description="Process the products of many MODIS tiles concurrently.")
+    parser.add_argument("tiles", nargs="*", default=TILES,
+                        help="MODIS tiles (default: all tiles of update_tiles.py)")
+    parser.add_argument("--products", nargs="+", choices=["bfast", "median"], default=["bfast", "median"],
+                        help="Products to process (default: bfast median)")
+    parser.add_argument("--cpus", type=int, default=multiprocessing.cpu_count(),
+                        help="Number of CPUs used by all jobs (default: all CPUs)")
+    parser.add_argument("--memory", type=int, default=8192,
+                        help="Memory in MB used by all jobs (default: 8192)")
+    parser.add_argument("--gdal-cache", type=int, default=1024,
+                        help="GDAL block cache in MB shared by all jobs (default: 1024)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of worker processes of each BFast job (default: 1)")
+    parser.add_argument("--engine", choices=["r", "rblock", "numpy"], default="r",
+                        help="BFast implementation (default: r)")
+    parser.add_argument("--output", choices=["dates", "compact"], default="dates",
+                        help="BFast output (default: dates)")
+    parser.add_argument("--force", action="store_true",
+                        help="Process tiles again even if their stacks did not change")
+    args = parser.parse_args(argv[1:])
+
+    # Get the logging configuration file
+    logging.config.fileConfig(argv[0].replace("py", "ini"))
+    # Get the root logger from the config file
+    global log
+    log = logging.getLogger(__name__)
+
+    # Check if VITS_DATA_PATH is set as environment variable
+    if "VITS_DATA_PATH" not in os.environ:
+        log.error('"VITS_DATA_PATH" is not set in the environment.')
+        sys.exit(1)
+    status_path = "%s/MODIS/processed/STATUS" % os.environ['VITS_DATA_PATH']
+
+    factories = {"bfast": bfast_job, "median": median_job}
+    jobs = []
+    for tile in args.tiles:
+        filename = '%s/MODIS/processed/NDVI/%s/NDVI.tif' % (os.environ['VITS_DATA_PATH'], tile)
+        stack = gdal.Open(filename, gdalconst.GA_ReadOnly)
+        if stack is None:
+            log.warning('Raster file "%s" could not be opened, skipping tile %s.' % (filename, tile))
+            continue
+        for product in args.products:
+            job = factories[product](tile, stack, args)
+            job.stack_mtime = stack_mtime(filename)
+            jobs.append(job)
+        stack = None
+
+    scheduler = TileScheduler(os.path.join(status_path, "status.json"), args.cpus,
+                              args.memory * 1024 * 1024, args.gdal_cache, log)
+    failed = scheduler.run(jobs, status_path, args.force)
+    if failed > 0:
+        log.error("%d jobs failed, see the logs in %s" % (failed, status_path))
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
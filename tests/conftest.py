@@ -0,0 +1,73 @@
+#
+# Test configuration of vi-ts-scripts
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+# The processing package is imported from the repository like the scripts do
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+class InMemoryBand(object):
+    """
+    A band of an InMemoryDataset.
+    """
+
+    def __init__(self, dataset, data):
+
+        self.dataset = dataset
+        self.data = data
+
+    def GetBlockSize(self):
+        return list(self.dataset.block_size)
+
+    def GetNoDataValue(self):
+        return self.dataset.nodata
+
+    def ReadAsArray(self, xoff, yoff, xsize, ysize):
+        self.dataset.reads += 1
+        return self.data[yoff:yoff + ysize, xoff:xoff + xsize].copy()
+
+class InMemoryDataset(object):
+    """
+    A (bands, rows, cols) array with the interface of a tiled GDAL dataset
+    that counts the reads of its bands.
+    """
+
+    def __init__(self, data, block_size=(128, 128), nodata=None):
+
+        self.data = data
+        self.block_size = block_size
+        self.nodata = nodata
+        self.RasterCount, self.RasterYSize, self.RasterXSize = data.shape
+        self.reads = 0
+
+    def GetRasterBand(self, band):
+        return InMemoryBand(self, self.data[band - 1])
+
+    def GetGeoTransform(self):
+        return (1000.0, 250.0, 0.0, 5000.0, 0.0, -250.0)
+
+@pytest.fixture
+def in_memory_dataset():
+    return InMemoryDataset
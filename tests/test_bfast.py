@@ -0,0 +1,101 @@
+#
+# Tests of the persistent R BFast engine
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+
+import math
+import numpy
+import pytest
+pytest.importorskip("rpy2")
+
+from processing import bfast
+
+FREQUENCY = 23
+# Four years of 16-day composites with a drop of the NDVI after two years
+LENGTH = 4 * FREQUENCY
+BREAK = 2 * FREQUENCY
+
+def synthetic_series(pixels, shift=-0.3, noise=0.04, seed=1):
+    """
+    Harmonic season with a level shift after observation BREAK, as
+    (time, pixels) array.
+    """
+
+    random = numpy.random.RandomState(seed)
+    t = numpy.arange(1, LENGTH + 1, dtype=float)
+    Y = 0.5 + 0.2 * numpy.sin(2.0 * math.pi * t / FREQUENCY)
+    Y = numpy.repeat(Y[:, None], pixels, axis=1)
+    Y[BREAK:] += shift
+    return Y + noise * random.standard_normal(Y.shape)
+
+@pytest.fixture
+def engine(monkeypatch):
+    """
+    A new process engine, R is only initialized by its creation.
+    """
+
+    initialized = []
+    initr = bfast.rinterface.initr
+    def count_initr(*args, **kwargs):
+        initialized.append(True)
+        return initr(*args, **kwargs)
+    monkeypatch.setattr(bfast.rinterface, "initr", count_initr)
+    monkeypatch.setattr(bfast, "_engine", None)
+    engine = bfast.get_engine((2000, 1), FREQUENCY)
+    engine.initialized = initialized
+    return engine
+
+def test_one_session_per_process(engine):
+    Y = synthetic_series(2)
+    for i in range(Y.shape[1]):
+        assert bfast.get_engine((2000, 1), FREQUENCY) is engine
+        engine.breakpoints(Y[:, i])
+    assert bfast.get_engine() is engine
+    assert len(engine.initialized) == 1
+
+def test_overhead_counters(engine):
+    stats = engine.overhead()
+    assert stats["calls"] == 0
+    assert stats["init_time"] > 0.0
+
+    Y = synthetic_series(2)
+    engine.breakpoints(Y[:, 0])
+    first = engine.overhead()
+    assert first["calls"] == 1
+    assert first["fit_time_per_call"] > 0.0
+    assert first["setup_time_per_call"] > 0.0
+    assert 0.0 < first["setup_ratio"] < 1.0
+
+    engine.breakpoints(Y[:, 1])
+    second = engine.overhead()
+    assert second["calls"] == 2
+    assert engine.fit_time > first["fit_time_per_call"]
+    # The initialization is not repeated
+    assert second["init_time"] == first["init_time"]
+
+def test_block_matches_per_pixel_calls(engine):
+    Y = synthetic_series(4)
+    Y[:, 3] = synthetic_series(1, shift=0.0, seed=3)[:, 0]
+    expected = [engine.breakpoints(Y[:, i]) for i in range(Y.shape[1])]
+    calls = engine.calls
+    assert engine.breakpoints_block(Y) == expected
+    assert engine.errors == 0
+    # The counters of the block mode advance per pixel
+    assert engine.calls == calls + Y.shape[1]
@@ -0,0 +1,106 @@
+#
+# Tests of the NumPy BFast engine
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import math
+import numpy
+import pytest
+from processing.regression import get_model
+from processing.bfast_numpy import mosum_pvalue
+from processing.bfast_numpy import breakpoints
+from processing.bfast_numpy import NumpyBfastEngine
+
+FREQUENCY = 23
+# Eight years of 16-day composites with a drop of the NDVI after four years
+LENGTH = 8 * FREQUENCY
+BREAK = 4 * FREQUENCY
+
+def synthetic_series(pixels, shift=-0.3, noise=0.04, seed=1):
+    """
+    Harmonic season on a slight trend with a level shift after observation
+    BREAK, as (time, pixels) array.
+    """
+
+    random = numpy.random.RandomState(seed)
+    t = numpy.arange(1, LENGTH + 1, dtype=float)
+    season = 0.2 * numpy.sin(2.0 * math.pi * t / FREQUENCY)
+    Y = 0.5 + 0.0002 * t + season
+    Y = numpy.repeat(Y[:, None], pixels, axis=1)
+    Y[BREAK:] += shift
+    return Y + noise * random.standard_normal(Y.shape)
+
+def test_mosum_pvalue():
+    model = get_model(LENGTH, FREQUENCY, 3)
+    h = float(FREQUENCY) / LENGTH
+    pvalues = mosum_pvalue(model.trend, synthetic_series(3), h)
+    assert numpy.all(pvalues < 0.01)
+    pvalues = mosum_pvalue(model.trend, synthetic_series(3, shift=0.0), h)
+    assert numpy.all(pvalues > 0.05)
+    # A constant series has no variance
+    assert mosum_pvalue(model.trend, numpy.ones((LENGTH, 1)), h)[0] == 1.0
+
+def test_breakpoints_of_a_shift():
+    X = get_model(LENGTH, FREQUENCY, 3).trend.X
+    Y = numpy.repeat(numpy.arange(LENGTH, dtype=float)[:, None] * 0.001, 2, axis=1)
+    Y[BREAK:, 0] += 1.0
+    Y += 0.01 * numpy.random.RandomState(2).standard_normal(Y.shape)
+    bps = breakpoints(X, Y, FREQUENCY)
+    assert list(bps[0][bps[0] > 0]) == [BREAK]
+    assert numpy.all(bps[1] == 0)
+
+def test_breakpoints_segment_size():
+    X = get_model(LENGTH, FREQUENCY, 3).trend.X
+    with pytest.raises(ValueError):
+        breakpoints(X, numpy.zeros((LENGTH, 1)), X.shape[1])
+    with pytest.raises(ValueError):
+        breakpoints(X, numpy.zeros((LENGTH, 1)), LENGTH // 2 + 1)
+
+def test_engine_detects_the_break():
+    engine = NumpyBfastEngine(FREQUENCY)
+    Y = synthetic_series(4)
+    Y[:, 3] = synthetic_series(1, shift=0.0, seed=3)[:, 0]
+    result = engine.breakpoints_block(Y)
+    for bps in result[:3]:
+        assert len(bps) == 1
+        assert abs(bps[0] - BREAK) <= 1
+    assert result[3] == []
+    assert engine.breakpoints(Y[:, 0]) == result[0]
+    assert engine.calls == 5
+
+def test_engine_runs_two_iterations_without_breaks():
+    # The season of the first iteration comes from the initial decomposition,
+    # like bfast the second iteration runs even if no break was found
+    engine = NumpyBfastEngine(FREQUENCY)
+    calls = []
+    detect = engine._detect
+    engine._detect = lambda *args: calls.append(1) or detect(*args)
+    assert engine.breakpoints_block(synthetic_series(2, shift=0.0)) == [[], []]
+    assert len(calls) == 4
+
+def test_engine_matches_r():
+    # The R engine needs R with the bfast package
+    bfast = pytest.importorskip("processing.bfast")
+    Y = synthetic_series(4)
+    Y[:, 3] = synthetic_series(1, shift=0.0, seed=3)[:, 0]
+    expected = bfast.BfastEngine(frequency=FREQUENCY).breakpoints_block(Y)
+    result = NumpyBfastEngine(FREQUENCY).breakpoints_block(Y)
+    for bps, rbps in zip(result, expected):
+        assert len(bps) == len(rbps)
+        assert numpy.all(numpy.abs(numpy.array(bps) - numpy.array(rbps)) <= 1)
@@ -0,0 +1,70 @@
+#
+# Tests of the break map accumulators
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import sqlite3
+import numpy
+import pytest
+
+pytest.importorskip("osgeo.gdal")
+
+from processing.breakmap import BreakMapAccumulator
+from processing.breakmap import CompactBreakAccumulator
+from processing.breakmap import write_break_events
+
+BREAKS = [(0, 0, [5]), (9, 0, [5, 40]), (3, 2, []), (8, 4, [40, 12])]
+
+@pytest.mark.parametrize("scratch", [False, True])
+def test_break_maps(tmpdir, scratch):
+    accumulator = BreakMapAccumulator((10, 5), 46, str(tmpdir.join("scratch.dat")) if scratch else None)
+    for col, row, bps in BREAKS:
+        accumulator.add(col, row, bps)
+    assert accumulator.bands_with_breaks() == [5, 12, 40]
+
+    expected = numpy.zeros((46, 5, 10), dtype=numpy.uint8)
+    for col, row, bps in BREAKS:
+        for bp in bps:
+            expected[bp - 1, row, col] = 1
+    for band in accumulator.bands_with_breaks():
+        assert accumulator.get_break_map(band).shape == (5, 10)
+        assert numpy.array_equal(accumulator.get_break_map(band), expected[band - 1])
+
+def test_compact_breaks():
+    accumulator = CompactBreakAccumulator((10, 5), max_breaks=1)
+    for col, row, bps in BREAKS:
+        accumulator.add(col, row, bps)
+    assert accumulator.count[0, 9] == 2
+    assert accumulator.count[2, 3] == 0
+    # The breaks are sorted, the indices keep the first max_breaks
+    assert accumulator.indices[0, 4, 8] == 12
+    assert accumulator.last[4, 8] == 40
+    assert accumulator.last[0, 0] == 5
+    assert sorted(accumulator.events) == [(0, 0, 5), (8, 4, 12), (8, 4, 40), (9, 0, 5), (9, 0, 40)]
+
+def test_break_events(tmpdir):
+    filename = str(tmpdir.join("BREAK_EVENTS.sqlite"))
+    tmpdir.join("BREAK_EVENTS.sqlite").write("stale")
+    write_break_events(filename, [(9, 0, 5), (9, 0, 40), (8, 4, 12)], lambda band: "A%07d" % band)
+    connection = sqlite3.connect(filename)
+    try:
+        rows = connection.execute("SELECT band, date FROM breaks WHERE row = 0 AND col = 9 ORDER BY band").fetchall()
+    finally:
+        connection.close()
+    assert [tuple(row) for row in rows] == [(5, "A0000005"), (40, "A0000040")]
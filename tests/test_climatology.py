@@ -0,0 +1,57 @@
+#
+# Tests of the day-of-year climatology
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import pytest
+
+pytest.importorskip("osgeo.gdal")
+
+from processing.timeaxis import TimeAxis
+from processing.climatology import period_bands
+from processing.climatology import ClimatologyState
+
+# Two years of 16-day composites starting with the fourth period of 2000
+DATES = ["A%d%03d" % (year, day) for year in (2000, 2001) for day in range(1, 366, 16)][3:]
+
+def test_period_bands():
+    bands = period_bands(TimeAxis(DATES))
+    assert len(bands) == 23
+    assert bands[1] == [21]
+    assert bands[4] == [1, 24]
+    assert bands[23] == [20, 43]
+    # Every band belongs to exactly one period
+    assert sorted(band for period in bands.values() for band in period) == list(range(1, len(DATES) + 1))
+
+def test_updated_periods(tmpdir):
+    filename = str(tmpdir.join("CLIMATOLOGY.json"))
+    settings = {"statistics": ["mean"], "max_reliability": None, "nodata": -3000}
+    state = ClimatologyState(filename, settings)
+    assert state.updated_periods(TimeAxis(DATES[:40])) == list(range(1, 24))
+    state.save(TimeAxis(DATES[:40]))
+
+    # Only the periods of the appended bands change
+    assert ClimatologyState(filename, settings).updated_periods(TimeAxis(DATES)) == [21, 22, 23]
+    assert ClimatologyState(filename, settings).updated_periods(TimeAxis(DATES[:40])) == []
+
+    # A rebuilt stack or other settings recalculate all periods
+    dates = list(DATES)
+    dates[39] = "A2001274"
+    assert ClimatologyState(filename, settings).updated_periods(TimeAxis(dates)) == list(range(1, 24))
+    assert ClimatologyState(filename, dict(settings, nodata=0)).updated_periods(TimeAxis(DATES)) == list(range(1, 24))
@@ -0,0 +1,140 @@
+#
+# Tests of the incremental histograms of a stack
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import os
+import numpy
+import pytest
+from processing.timeaxis import TimeAxis
+from processing.histstore import HistogramStore
+
+NODATA = -3000
+# Three years of 16-day composites
+DATES = ["A%d%03d" % (year, day) for year in (2000, 2001, 2002) for day in range(1, 366, 16)]
+SIZE = (7, 5)
+WINDOWS = [(0, 0, 7, 3), (0, 3, 7, 2)]
+
+def random_cube(seed=1):
+    random = numpy.random.RandomState(seed)
+    cube = random.randint(-2000, 10001, (len(DATES), SIZE[1], SIZE[0])).astype(numpy.int16)
+    cube[random.uniform(size=cube.shape) < 0.2] = NODATA
+    cube[:, 0, 0] = NODATA
+    return cube
+
+def absorb(store, cube, bands):
+    for xoff, yoff, xsize, ysize in WINDOWS:
+        store.add((xoff, yoff, xsize, ysize), cube[bands, yoff:yoff + ysize, xoff:xoff + xsize], NODATA)
+
+def percentiles(store, percentiles=[50.0, 10.0, 90.0]):
+    return numpy.concatenate([store.percentiles(window, percentiles) for window in WINDOWS], axis=1)
+
+def test_incremental_matches_rebuilt(tmpdir):
+    cube = random_cube()
+    filename = str(tmpdir.join("MEDIAN.hist.npy"))
+
+    # Two years first, the third year is appended by a later run
+    store = HistogramStore(filename, SIZE)
+    assert not store.open(TimeAxis(DATES[:46]))
+    store.create()
+    absorb(store, cube, slice(0, 46))
+    store.flush(DATES[:46])
+    store.close()
+
+    store = HistogramStore(filename, SIZE)
+    assert store.open(TimeAxis(DATES))
+    assert store.bands == 46
+    absorb(store, cube, slice(46, len(DATES)))
+    store.flush(DATES)
+    incremental = percentiles(store)
+    count = numpy.concatenate([store.count(window) for window in WINDOWS])
+    store.close()
+
+    rebuilt = HistogramStore(str(tmpdir.join("REBUILT.hist.npy")), SIZE)
+    rebuilt.create()
+    absorb(rebuilt, cube, slice(0, len(DATES)))
+    assert numpy.array_equal(incremental, percentiles(rebuilt))
+    assert numpy.array_equal(count, numpy.sum(cube != NODATA, axis=0))
+
+    # The values of a bin are spread over the bin, the median is within one
+    # bin width of the exact median
+    valid = count > 0
+    values = numpy.ma.masked_equal(cube, NODATA).astype(float)
+    exact = numpy.ma.median(values, axis=0)
+    assert numpy.all(numpy.abs(incremental[0][valid] - exact[valid]) <= 100)
+
+def test_percentiles_within_range(tmpdir):
+    store = HistogramStore(str(tmpdir.join("MEDIAN.hist.npy")), (1, 1))
+    store.create()
+    store.add((0, 0, 1, 1), numpy.array([[[10000]], [[10000]], [[12000]]]), NODATA)
+    store.add((0, 0, 1, 1), numpy.array([[[-2500]]]), NODATA)
+    result = store.percentiles((0, 0, 1, 1), [0.0, 50.0, 100.0])
+    assert -2000 <= result[0, 0, 0] < -1900
+    assert result[1, 0, 0] <= 10000
+    assert result[2, 0, 0] == 10000
+
+def test_rebuild_on_changed_dates(tmpdir):
+    filename = str(tmpdir.join("MEDIAN.hist.npy"))
+    store = HistogramStore(filename, SIZE)
+    store.create()
+    absorb(store, random_cube(), slice(0, 46))
+    store.flush(DATES[:46])
+    store.close()
+
+    # A replaced composite or a shorter stack do not match the histograms
+    dates = list(DATES)
+    dates[10] = "A2000162"
+    assert not HistogramStore(filename, SIZE).open(TimeAxis(dates))
+    assert not HistogramStore(filename, SIZE).open(TimeAxis(DATES[:40]))
+    assert HistogramStore(filename, SIZE).open(TimeAxis(DATES[:46]))
+
+    # Other settings or bins
+    assert not HistogramStore(filename, SIZE, settings={"max_reliability": 1}).open(TimeAxis(DATES))
+    assert not HistogramStore(filename, SIZE, bin_width=50).open(TimeAxis(DATES))
+
+def test_rebuild_after_interrupted_update(tmpdir):
+    filename = str(tmpdir.join("MEDIAN.hist.npy"))
+    store = HistogramStore(filename, SIZE)
+    store.create()
+    store.flush(DATES[:46])
+    store.invalidate()
+    absorb(store, random_cube(), slice(46, 50))
+    store.close()
+    assert os.path.exists(store.metadata_filename)
+    assert not HistogramStore(filename, SIZE).open(TimeAxis(DATES))
+
+@pytest.mark.parametrize("bin_width", [1, 50, 100])
+def test_error_bound(tmpdir, bin_width):
+    cube = random_cube(seed=2)
+    # Observations on a bin edge are spread over the whole bin
+    cube[:, 1, 1] = 3000
+    cube[::2, 1, 2] = 3000
+    store = HistogramStore(str(tmpdir.join("MEDIAN.hist.npy")), SIZE, bin_width)
+    store.create()
+    absorb(store, cube, slice(0, len(DATES)))
+    result = percentiles(store)
+    values = numpy.where(cube == NODATA, numpy.nan, cube.astype(float))
+    valid = numpy.sum(cube != NODATA, axis=0) > 0
+    for i, percentile in enumerate([50.0, 10.0, 90.0]):
+        exact = numpy.nanpercentile(values[:, valid], percentile, axis=0)
+        error = numpy.abs(result[i][valid] - exact)
+        if bin_width == 1:
+            assert numpy.allclose(error, 0.0)
+        else:
+            assert numpy.all(error < bin_width)
@@ -0,0 +1,115 @@
+#
+# Tests of the block journal of interrupted runs
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import os
+import time
+import pytest
+from processing.journal import BlockJournal
+from processing.journal import write_atomically
+from processing.journal import file_identity
+
+WINDOWS = [(xoff, yoff, 4, 2) for yoff in (0, 2, 4) for xoff in (0, 4)]
+
+class Crash(Exception):
+    pass
+
+def block_results(window):
+    """
+    Breakpoints and pre-screening codes of the pixels of a block.
+    """
+
+    xoff, yoff, xsize, ysize = window
+    results = []
+    codes = []
+    for row in range(yoff, yoff + ysize):
+        for col in range(xoff, xoff + xsize):
+            results.append((col, row, [(col * 7 + row) % 40 + 1] if (col + row) % 3 == 0 else []))
+            codes.append((col + row) % 4)
+    return results, codes
+
+def run(journal, crash_after=None):
+    """
+    Process all blocks like read_bfast_breaks, blocks of the journal are
+    loaded instead of processed. The results and codes of all pixels and the
+    processed windows are returned.
+    """
+
+    completed = journal.completed()
+    results = []
+    codes = []
+    processed = []
+    for window in WINDOWS:
+        if window in completed:
+            results.extend(journal.load(window))
+            codes.extend(journal.load_codes(window))
+            continue
+        if crash_after is not None and len(processed) == crash_after:
+            raise Crash()
+        blockResults, blockCodes = block_results(window)
+        journal.commit(window, blockResults, blockCodes)
+        results.extend(blockResults)
+        codes.extend(blockCodes)
+        processed.append(window)
+    return results, codes, processed
+
+def test_resume_matches_uninterrupted_run(tmpdir):
+    settings = {"engine": "numpy", "bands": 46, "size": [8, 6]}
+    expected = run(BlockJournal(str(tmpdir.join("complete")), settings))
+
+    directory = str(tmpdir.join("journal"))
+    with pytest.raises(Crash):
+        run(BlockJournal(directory, settings), crash_after=4)
+    assert BlockJournal(directory, settings).completed() == set(WINDOWS[:4])
+    results, codes, processed = run(BlockJournal(directory, settings))
+    assert processed == WINDOWS[4:]
+    assert results == expected[0]
+    assert codes == expected[1]
+
+def test_changed_settings_discard_the_journal(tmpdir):
+    directory = str(tmpdir.join("journal"))
+    settings = {"engine": "numpy", "bands": 46, "mask": [1024, 1400000000.0], "quality": None}
+    with pytest.raises(Crash):
+        run(BlockJournal(directory, settings), crash_after=3)
+
+    # Another mask or the quality masking invalidate the finished blocks
+    settings = dict(settings, quality=[2048, 1400000000.0])
+    results, codes, processed = run(BlockJournal(directory, settings))
+    assert processed == WINDOWS
+    assert BlockJournal(directory, settings).completed() == set(WINDOWS)
+
+def test_blocks_without_codes(tmpdir):
+    journal = BlockJournal(str(tmpdir.join("journal")), {})
+    journal.commit(WINDOWS[0], [(0, 0, [3, 17])])
+    assert journal.load(WINDOWS[0]) == [(0, 0, [3, 17])]
+    assert journal.load_codes(WINDOWS[0]) is None
+    journal.clear()
+    assert not os.path.exists(journal.directory)
+
+def test_file_identity(tmpdir):
+    filename = str(tmpdir.join("MASK.tif"))
+    write_atomically(filename, "mask")
+    assert not os.path.exists("%s.tmp" % filename)
+    identity = file_identity(filename)
+    assert identity == file_identity(filename)
+
+    # A replaced file of the same size has another modification time
+    os.utime(filename, (time.time() + 10, time.time() + 10))
+    assert file_identity(filename) != identity
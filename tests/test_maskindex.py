@@ -0,0 +1,57 @@
+#
+# Tests of the valid pixel index of a mask
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import numpy
+import pytest
+
+pytest.importorskip("osgeo.gdal")
+
+from processing.utilities import get_block_windows
+from processing.maskindex import build_mask_index
+
+def test_mask_index(in_memory_dataset):
+    mask = numpy.zeros((1, 5, 10), dtype=numpy.uint8)
+    mask[0, 0, 1] = mask[0, 1, 3] = 1
+    mask[0, 4, 9] = 1
+    dataset = in_memory_dataset(mask, (4, 2), nodata=0)
+    windows = list(get_block_windows(dataset))
+    index = build_mask_index(dataset.GetRasterBand(1), windows)
+
+    # Blocks without valid pixels are left out
+    assert len(index) == 2
+    assert index.count == 3
+    blocks = list(index)
+    assert blocks[0][0] == (0, 0, 4, 2)
+    assert blocks[0][1].tolist() == [[0, 1], [1, 3]]
+    assert blocks[1][0] == (8, 4, 2, 1)
+    assert blocks[1][1].tolist() == [[0, 1]]
+
+def test_mask_without_nodata(in_memory_dataset):
+    dataset = in_memory_dataset(numpy.zeros((1, 3, 4), dtype=numpy.uint8), (4, 2))
+    index = build_mask_index(dataset.GetRasterBand(1), list(get_block_windows(dataset)))
+    assert index.count == 12
+    assert [window for window, pixels in index] == [(0, 0, 4, 2), (0, 2, 4, 1)]
+
+def test_empty_mask(in_memory_dataset):
+    dataset = in_memory_dataset(numpy.zeros((1, 3, 4), dtype=numpy.uint8), (4, 2), nodata=0)
+    index = build_mask_index(dataset.GetRasterBand(1), list(get_block_windows(dataset)))
+    assert len(index) == 0 and index.count == 0
+    assert list(index) == []
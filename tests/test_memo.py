@@ -0,0 +1,76 @@
+#
+# Tests of the breakpoint cache
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import numpy
+from processing.memo import series_key
+from processing.memo import BreakpointCache
+
+def series(value, length=46):
+    return numpy.array([value] * length, dtype=numpy.int16)
+
+def test_series_key():
+    assert series_key(series(1)) == series_key([1] * 46)
+    assert series_key(series(1)) != series_key(series(2))
+    assert series_key(series(1)) != series_key(series(1, 45))
+
+def test_least_recently_used_entries_are_evicted():
+    cache = BreakpointCache(max_entries=2)
+    assert cache.get(series(1)) is None
+    cache.put(series(1), [10])
+    cache.put(series(2), numpy.array([20, 30]))
+    assert cache.get(series(1)) == [10]
+    cache.put(series(3), [])
+    # Series 2 was used least recently
+    assert cache.get(series(2)) is None
+    assert cache.get(series(1)) == [10]
+    assert cache.get(series(3)) == []
+    assert cache.stats() == {"entries": 2, "hits": 3, "misses": 2, "evictions": 1, "hit_rate": 0.6}
+
+def test_returned_breakpoints_are_copies():
+    cache = BreakpointCache()
+    cache.put(series(1), [10])
+    cache.get(series(1)).append(20)
+    assert cache.get(series(1)) == [10]
+
+def test_disabled_cache():
+    cache = BreakpointCache(max_entries=0)
+    cache.put(series(1), [10])
+    assert cache.get(series(1)) is None
+    assert len(cache) == 0
+
+def test_cache_file(tmpdir):
+    filename = str(tmpdir.join("cache.json"))
+    settings = {"engine": "numpy", "dates": ["A2000049", "A2000065"]}
+    cache = BreakpointCache(settings=settings)
+    for value in range(5):
+        cache.put(series(value), [value + 10])
+    cache.get(series(0))
+    cache.save(filename)
+
+    loaded = BreakpointCache(max_entries=2, settings=settings)
+    assert loaded.load(filename)
+    # The most recently used entries are kept
+    assert loaded.get(series(0)) == [10]
+    assert loaded.get(series(4)) == [14]
+    assert loaded.get(series(3)) is None
+
+    assert not BreakpointCache(settings=dict(settings, engine="r")).load(filename)
+    assert not BreakpointCache(settings=settings).load(str(tmpdir.join("missing.json")))
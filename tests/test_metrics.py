@@ -0,0 +1,85 @@
+#
+# Tests of the hot path metrics
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import json
+import logging
+from processing.metrics import LatencyHistogram
+from processing.metrics import Metrics
+
+def test_latency_percentiles():
+    histogram = LatencyHistogram()
+    for i in range(1, 101):
+        histogram.record(i * 0.001, items=10)
+    assert histogram.count == 100
+    assert histogram.items == 1000
+    assert histogram.min == 0.001 and histogram.max == 0.1
+    # Percentiles are accurate to the bucket width of about 12%
+    assert 0.050 <= histogram.percentile(50) <= 0.050 * 1.13
+    assert 0.090 <= histogram.percentile(90) <= 0.090 * 1.13
+    assert histogram.percentile(100) == 0.1
+    assert LatencyHistogram().percentile(50) is None
+
+def test_extreme_latencies():
+    histogram = LatencyHistogram()
+    histogram.record(0.0)
+    histogram.record(1e6)
+    assert histogram.percentile(1) == 1e-6
+    assert histogram.percentile(100) == 1e6
+
+def test_merge_of_worker_metrics():
+    main = Metrics("Tile h16v08", total=200)
+    main.record("read", 0.01, 100)
+    worker = Metrics("worker")
+    worker.record("read", 0.02, 100)
+    worker.record("bfast", 2.0, 100)
+    worker.increment("cache_hits", 5)
+    main.merge(worker.stages, worker.counters)
+    main.increment("cache_hits")
+    assert main.stages["read"].count == 2
+    assert main.stages["read"].max == 0.02
+    assert main.stages["bfast"].items == 100
+    assert main.counters == {"cache_hits": 6}
+
+def test_sampling():
+    metrics = Metrics("Tile h16v08", sample_every=4)
+    assert [metrics.sampled() for i in range(8)] == [False, False, False, True] * 2
+
+def test_progress_and_export(tmpdir):
+    messages = []
+    class Handler(logging.Handler):
+        def emit(self, record):
+            messages.append(record.getMessage())
+    log = logging.getLogger("test_metrics")
+    log.setLevel(logging.INFO)
+    log.addHandler(Handler())
+
+    metrics = Metrics("Tile h16v08", total=100, log=log, interval=0.0)
+    metrics.record("write", 0.5, 50)
+    metrics.progress(50)
+    assert messages[0].startswith("Tile h16v08: 50 of 100 items (50.0%)")
+    assert metrics.eta() is not None
+
+    filename = str(tmpdir.join("metrics.json"))
+    metrics.export(filename)
+    with open(filename) as f:
+        summary = json.load(f)
+    assert summary["done"] == 50
+    assert summary["stages"]["write"]["items"] == 50
@@ -0,0 +1,113 @@
+#
+# Tests of the monitoring of new composites
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import math
+import numpy
+from processing.regression import season_trend_rows
+from processing.monitor import fit_history
+from processing.monitor import residuals
+from processing.monitor import critical_value
+from processing.monitor import MonitorStore
+
+FREQUENCY = 23
+HISTORY = 4 * FREQUENCY
+WINDOW = FREQUENCY
+TOTAL = 6 * FREQUENCY
+
+def synthetic_cube(rows=3, cols=4, shift=None, noise=0.03, seed=1):
+    """
+    NDVI (time, rows, cols) series of a harmonic season on a trend with a
+    level shift of the pixels of the first row after the band shift.
+    """
+
+    random = numpy.random.RandomState(seed)
+    t = numpy.arange(1, TOTAL + 1, dtype=float)
+    series = 0.5 + 0.0005 * t + 0.2 * numpy.sin(2.0 * math.pi * t / FREQUENCY)
+    cube = numpy.repeat(numpy.repeat(series[:, None, None], rows, axis=1), cols, axis=2)
+    if shift is not None:
+        cube[shift:, 0] -= 0.3
+    return cube + noise * random.standard_normal(cube.shape)
+
+def test_fit_history_with_gaps():
+    cube = synthetic_cube()[:HISTORY]
+    complete = fit_history(cube, WINDOW, FREQUENCY)
+
+    gaps = cube.copy()
+    gaps[5:15, 1, 1] = numpy.nan
+    gaps[::3, 2, 2] = numpy.nan
+    gaps[4:, 0, 3] = numpy.nan
+    coefficients, sigma, window_sum = fit_history(gaps, WINDOW, FREQUENCY)
+
+    # The other pixels keep their fit
+    untouched = numpy.ones(cube.shape[1:], dtype=bool)
+    untouched[1, 1] = untouched[2, 2] = untouched[0, 3] = False
+    assert numpy.allclose(coefficients[:, untouched], complete[0][:, untouched])
+    assert numpy.allclose(sigma[untouched], complete[1][untouched])
+    assert numpy.allclose(window_sum[untouched], complete[2][untouched])
+
+    # A pixel with gaps is fitted with its valid observations only
+    valid = ~numpy.isnan(gaps[:, 1, 1])
+    X = season_trend_rows(numpy.arange(1, HISTORY + 1), FREQUENCY, 3)
+    expected = numpy.linalg.lstsq(X[valid], gaps[valid, 1, 1], rcond=None)[0]
+    assert numpy.allclose(coefficients[:, 1, 1], expected)
+    assert numpy.isfinite(sigma[2, 2]) and numpy.isfinite(window_sum[2, 2])
+
+    # Too few observations for the model
+    assert numpy.all(numpy.isnan(coefficients[:, 0, 3]))
+    assert numpy.isnan(sigma[0, 3])
+
+def test_residuals_of_missing_observations():
+    coefficients = fit_history(synthetic_cube()[:HISTORY], WINDOW, FREQUENCY)[0]
+    values = synthetic_cube()[HISTORY]
+    values[0, 0] = numpy.nan
+    result = residuals(values, HISTORY + 1, coefficients, FREQUENCY)
+    assert result[0, 0] == 0.0
+    assert numpy.all(numpy.abs(result[1:]) < 0.2)
+
+def monitor(tmpdir, cube):
+    store = MonitorStore(str(tmpdir))
+    store.create((cube.shape[2], cube.shape[1]), {
+        "history": HISTORY, "window": WINDOW, "frequency": FREQUENCY, "order": 3,
+        "critical_value": critical_value(HISTORY, WINDOW, FREQUENCY)
+    })
+    window = (0, 0, cube.shape[2], cube.shape[1])
+    store.fit_block(window, cube[:HISTORY])
+    for index in range(HISTORY + 1, TOTAL + 1):
+        store.update_block(window, index, cube[index - 1], cube[index - 1 - WINDOW])
+    return store
+
+def test_monitor_detects_the_shift(tmpdir):
+    shift = HISTORY + 10
+    store = monitor(tmpdir, synthetic_cube(shift=shift))
+    breaks = numpy.array(store.break_band)
+    assert numpy.all(breaks[0] > shift)
+    assert numpy.all(breaks[0] <= shift + WINDOW)
+    assert numpy.all(breaks[1:] == 0)
+    assert numpy.all(numpy.array(store.processed) == TOTAL)
+
+def test_monitor_ignores_missing_observations(tmpdir):
+    cube = synthetic_cube()
+    # NODATA of the new composites is NaN, e.g. clouds in the monitoring
+    # period must neither cause nor hide breaks
+    cube[HISTORY + 5:HISTORY + 30, 1] = numpy.nan
+    store = monitor(tmpdir, cube)
+    assert numpy.all(numpy.array(store.break_band) == 0)
+    assert numpy.all(numpy.isfinite(numpy.array(store.window_sum)))
@@ -0,0 +1,58 @@
+#
+# Tests of the pre-screening of series
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import numpy
+import pytest
+
+# The diagnostic raster is written with GDAL
+pytest.importorskip("osgeo.gdal")
+
+from processing.prescreen import Prescreen
+from processing.prescreen import ScreenMap
+from processing.prescreen import SCREEN_PASSED
+from processing.prescreen import SCREEN_ALL_NODATA
+from processing.prescreen import SCREEN_TOO_FEW_VALID
+from processing.prescreen import SCREEN_LOW_VARIANCE
+
+NODATA = -3000
+
+def test_screen():
+    random = numpy.random.RandomState(1)
+    series = random.randint(2000, 8000, (92, 5))
+    series[:, 1] = NODATA
+    series[40:, 2] = NODATA
+    series[:, 3] = 3000
+    # Constant valid observations with gaps
+    series[:, 4] = 3000
+    series[::2, 4] = NODATA
+    codes = Prescreen(NODATA, min_valid=46, min_std=10.0).screen(series)
+    assert list(codes) == [SCREEN_PASSED, SCREEN_ALL_NODATA, SCREEN_TOO_FEW_VALID,
+                           SCREEN_LOW_VARIANCE, SCREEN_LOW_VARIANCE]
+
+def test_screen_map():
+    screenMap = ScreenMap((4, 3))
+    pixels = numpy.array([[0, 1], [1, 1], [1, 2]])
+    screenMap.add(1, 1, pixels, numpy.array([SCREEN_PASSED, SCREEN_LOW_VARIANCE, SCREEN_PASSED]))
+    assert screenMap.codes[1, 2] == SCREEN_PASSED
+    assert screenMap.codes[2, 2] == SCREEN_LOW_VARIANCE
+    assert screenMap.counts()[SCREEN_PASSED] == 2
+    assert abs(screenMap.skip_ratio() - 1.0 / 3) < 1e-12
+    assert ScreenMap((4, 3)).skip_ratio() == 0.0
@@ -0,0 +1,69 @@
+#
+# Tests of the quality masking and gap filling
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import numpy
+import pytest
+
+# The quality masks read the QUAL stack with GDAL
+pytest.importorskip("osgeo.gdal")
+
+from processing.quality import MODLAND_GOOD
+from processing.quality import MODLAND_CHECK_QA
+from processing.quality import MODLAND_CLOUDY
+from processing.quality import modland_qa
+from processing.quality import mask_unreliable
+from processing.quality import fill_gaps
+
+NODATA = -3000
+
+def test_modland_qa():
+    # VI Quality values with other QA bits set, e.g. adjacent cloud (bit 8)
+    # and mixed clouds (bit 10), and the unsigned 0xFFFF stacked as Int16
+    qual = numpy.array([0x0000, 0x0101, 0x0402, 0x0843, -1], dtype=numpy.int16)
+    assert list(modland_qa(qual)) == [0, 1, 2, 3, 3]
+
+def test_mask_unreliable():
+    cube = numpy.array([[[5000, 6000, 7000, 8000]]], dtype=numpy.int16)
+    qual = numpy.array([[[0x0000, 0x0101, 0x0402, 0x0843]]], dtype=numpy.int16)
+    assert mask_unreliable(cube, qual, MODLAND_GOOD, NODATA).tolist() == [[[5000, NODATA, NODATA, NODATA]]]
+    masked = mask_unreliable(cube, qual, MODLAND_CHECK_QA, NODATA)
+    assert masked.tolist() == [[[5000, 6000, NODATA, NODATA]]]
+    assert masked.dtype == numpy.int16
+    assert mask_unreliable(cube, qual, MODLAND_CLOUDY, NODATA).tolist() == [[[5000, 6000, 7000, NODATA]]]
+    # The cube is not changed
+    assert cube[0, 0, 3] == 8000
+
+def test_fill_gaps():
+    series = numpy.array([
+        [NODATA, 100, NODATA, NODATA],
+        [200, NODATA, NODATA, 10],
+        [NODATA, NODATA, NODATA, 20],
+        [NODATA, 400, NODATA, 30],
+        [500, NODATA, NODATA, 40],
+    ])
+    filled = fill_gaps(series, NODATA)
+    # Interpolated between valid observations
+    assert numpy.allclose(filled[:, 0], [200, 200, 300, 400, 500])
+    # Leading and trailing gaps get the nearest valid observation
+    assert numpy.allclose(filled[:, 1], [100, 200, 300, 400, 400])
+    # Series without valid observations are unchanged
+    assert numpy.all(filled[:, 2] == NODATA)
+    assert numpy.allclose(filled[:, 3], [10, 10, 20, 30, 40])
@@ -0,0 +1,77 @@
+#
+# Tests of the cached point access to a stack
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import pickle
+import numpy
+import pytest
+
+pytest.importorskip("osgeo.gdal")
+
+import processing.reader
+from processing.reader import TimeSeriesReader
+
+@pytest.fixture
+def stack(monkeypatch, in_memory_dataset):
+    data = numpy.arange(4 * 10 * 12, dtype=numpy.int16).reshape(4, 10, 12)
+    dataset = in_memory_dataset(data, (4, 4))
+    monkeypatch.setattr(processing.reader.gdal, "Open", lambda filename, access: dataset)
+    return dataset
+
+def test_read(stack):
+    reader = TimeSeriesReader("NDVI.tif")
+    assert numpy.array_equal(reader.read(5, 9), stack.data[:, 9, 5])
+    assert numpy.array_equal(reader.read(11, 9), stack.data[:, 9, 11])
+    assert numpy.array_equal(reader.read_point(1000.0 + 250.0 * 6.5, 5000.0 - 250.0 * 2.5), stack.data[:, 2, 6])
+    with pytest.raises(IndexError):
+        reader.read(12, 0)
+
+def test_neighbours_share_a_tile(stack):
+    reader = TimeSeriesReader("NDVI.tif")
+    for col in range(4):
+        for row in range(4):
+            reader.read(col, row)
+    assert reader.misses == 1 and reader.hits == 15
+    assert stack.reads == 4
+
+def test_least_recently_used_tiles_are_evicted(stack):
+    # Room for two tiles of 4 bands of 4 x 4 int16 values
+    reader = TimeSeriesReader("NDVI.tif", max_bytes=2 * 4 * 4 * 4 * 2)
+    reader.read(0, 0)
+    reader.read(4, 0)
+    # The first tile becomes the most recently used one
+    reader.read(1, 1)
+    reader.read(8, 0)
+    assert reader.evictions == 1
+    assert set(reader._tiles) == set([(0, 0), (2, 0)])
+    assert reader.bytes == reader.max_bytes
+    assert reader.stats()["hit_rate"] == 0.25
+
+def test_tiles_larger_than_the_cache(stack):
+    reader = TimeSeriesReader("NDVI.tif", max_bytes=16)
+    assert numpy.array_equal(reader.read(0, 0), stack.data[:, 0, 0])
+    assert len(reader) == 0 and reader.bytes == 0
+
+def test_pickled_reader_reopens_the_stack(stack):
+    reader = TimeSeriesReader("NDVI.tif")
+    reader.read(0, 0)
+    copy = pickle.loads(pickle.dumps(reader))
+    assert copy._dataset is None
+    assert numpy.array_equal(copy.read(0, 0), stack.data[:, 0, 0])
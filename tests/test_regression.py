@@ -0,0 +1,56 @@
+#
+# Tests of the shared season and trend design matrices
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import numpy
+from processing.regression import trend_design
+from processing.regression import harmonic_design
+from processing.regression import season_trend_rows
+from processing.regression import get_model
+
+def test_design_matrices():
+    X = trend_design(46)
+    assert X.shape == (46, 2)
+    assert numpy.allclose(X[:, 0], 1.0)
+    assert numpy.allclose(X[23, 1], 1.0)
+    X = harmonic_design(46, 23, 3)
+    assert X.shape == (46, 7)
+    # The season repeats every year
+    assert numpy.allclose(X[:23], X[23:])
+    # Rows of appended observations continue the full design matrix
+    assert numpy.allclose(season_trend_rows([47, 48]), season_trend_rows(numpy.arange(1, 49))[46:])
+
+def test_block_fit_matches_lstsq():
+    random = numpy.random.RandomState(1)
+    model = get_model(69, 23, 3)
+    cube = random.standard_normal((69, 3, 4))
+    fit = model.fit(cube)
+    assert fit.coefficients.shape == (8, 3, 4)
+    for row in range(3):
+        for col in range(4):
+            expected = numpy.linalg.lstsq(model.full.X, cube[:, row, col], rcond=None)[0]
+            assert numpy.allclose(fit.coefficients[:, row, col], expected)
+    assert numpy.allclose(fit.fitted + fit.residuals, cube)
+    assert numpy.allclose(model.full.residuals(cube), fit.residuals)
+    assert numpy.allclose(model.trend.fitted(cube) + model.trend.residuals(cube), cube)
+
+def test_models_are_shared():
+    assert get_model(46) is get_model(46, 23, 3)
+    assert get_model(46) is not get_model(46, 23, 2)
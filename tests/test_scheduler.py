@@ -0,0 +1,83 @@
+#
+# Tests of the multi-tile scheduler
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import os
+import sys
+import json
+from processing.scheduler import Job
+from processing.scheduler import TileScheduler
+
+MB = 1024 * 1024
+
+def job(tile, tmpdir, code="", cpus=1, memory=100 * MB, stack_mtime=1.0):
+    """
+    A job that records its start and end and its GDAL cache in the temporary
+    directory and then runs the code.
+    """
+
+    trace = str(tmpdir.join("trace.txt"))
+    script = ("import os, time\n"
+              "open(%r, 'a').write('start %s ' + os.environ['GDAL_CACHEMAX'] + '\\n')\n"
+              "time.sleep(0.3)\n"
+              "open(%r, 'a').write('end %s\\n')\n" % (trace, tile, trace, tile)) + code
+    return Job("median", tile, [sys.executable, "-c", script], cpus, memory, stack_mtime)
+
+def trace(tmpdir):
+    with open(str(tmpdir.join("trace.txt"))) as f:
+        return [line.split() for line in f]
+
+def scheduler(tmpdir, cpus=4, memory=1000 * MB):
+    return TileScheduler(str(tmpdir.join("status.json")), cpus, memory, 512, poll_interval=0.05)
+
+def test_jobs_within_the_memory(tmpdir):
+    jobs = [job("h16v08", tmpdir, memory=600 * MB), job("h17v08", tmpdir, memory=600 * MB)]
+    assert scheduler(tmpdir).run(jobs, str(tmpdir.join("logs"))) == 0
+    # The second job does not fit next to the first one
+    assert [line[:2] for line in trace(tmpdir)] == [["start", "h16v08"], ["end", "h16v08"],
+                                                    ["start", "h17v08"], ["end", "h17v08"]]
+    assert os.path.exists(str(tmpdir.join("logs", "median_h16v08.log")))
+
+def test_concurrent_jobs(tmpdir):
+    jobs = [job("h16v08", tmpdir, cpus=2), job("h17v08", tmpdir, cpus=2)]
+    assert scheduler(tmpdir).run(jobs, str(tmpdir.join("logs"))) == 0
+    lines = trace(tmpdir)
+    assert [line[0] for line in lines] == ["start", "start", "end", "end"]
+    # Each job gets its share of the GDAL cache
+    assert lines[0][2] == "256"
+
+def test_large_job_runs_alone(tmpdir):
+    jobs = [job("h16v08", tmpdir, cpus=8, memory=2000 * MB)]
+    assert scheduler(tmpdir).run(jobs, str(tmpdir.join("logs"))) == 0
+    assert trace(tmpdir)[0][2] == "512"
+
+def test_status_of_the_jobs(tmpdir):
+    jobs = [job("h16v08", tmpdir), job("h17v08", tmpdir, code="raise SystemExit(3)")]
+    assert scheduler(tmpdir).run(jobs, str(tmpdir.join("logs"))) == 1
+    with open(str(tmpdir.join("status.json"))) as f:
+        status = json.load(f)
+    assert status["median/h16v08"]["state"] == "done"
+    assert status["median/h17v08"]["state"] == "failed"
+    assert status["median/h17v08"]["returncode"] == 3
+
+    # Only the failed job and jobs with a newer stack are run again
+    jobs = [job("h16v08", tmpdir), job("h17v08", tmpdir), job("h16v08", tmpdir, stack_mtime=2.0)]
+    assert [j.tile for j in scheduler(tmpdir).order(jobs)] == ["h17v08", "h16v08"]
+    assert len(scheduler(tmpdir).order(jobs[:1], force=True)) == 1
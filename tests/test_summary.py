@@ -0,0 +1,141 @@
+#
+# Tests of the temporal statistics of a stack
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import numpy
+import pytest
+from processing.summary import STATISTICS
+from processing.summary import block_statistics
+from processing.summary import block_median
+from processing.summary import histogram_percentiles
+from processing.summary import StreamingStatistics
+
+NODATA = -3000
+
+def random_cube(bands=46, rows=5, cols=7, seed=1):
+    """
+    A (time, rows, cols) cube of NDVI values with NODATA gaps, a pixel without
+    any valid observation and a pixel with a single one.
+    """
+
+    random = numpy.random.RandomState(seed)
+    cube = random.randint(-2000, 10001, (bands, rows, cols)).astype(numpy.int16)
+    cube[random.uniform(size=cube.shape) < 0.2] = NODATA
+    cube[:, 0, 0] = NODATA
+    cube[1:, 0, 1] = NODATA
+    return cube
+
+def test_block_statistics():
+    cube = random_cube()
+    results = block_statistics(cube, NODATA, STATISTICS + ["p25"])
+    for name in STATISTICS + ["p25"]:
+        assert results[name].shape == (5, 7)
+        assert results[name].dtype == numpy.int16
+
+    values = numpy.ma.masked_equal(cube, NODATA).astype(float)
+    expected = {
+        "mean": values.mean(axis=0),
+        "std": values.std(axis=0),
+        "min": values.min(axis=0),
+        "max": values.max(axis=0),
+    }
+    valid = ~numpy.ma.getmaskarray(expected["mean"])
+    for name, value in expected.items():
+        assert numpy.array_equal(results[name][valid], numpy.trunc(value[valid]))
+    for name, percentile in [("median", 50), ("p10", 10), ("p90", 90), ("p25", 25)]:
+        for row, col in zip(*numpy.nonzero(valid)):
+            pixel = cube[:, row, col]
+            expected = numpy.percentile(pixel[pixel != NODATA].astype(float), percentile)
+            assert results[name][row, col] == int(numpy.trunc(expected))
+
+    assert numpy.array_equal(results["count"], numpy.sum(cube != NODATA, axis=0))
+    for name in STATISTICS:
+        if name != "count":
+            assert results[name][0, 0] == NODATA
+    assert results["median"][0, 1] == cube[0, 0, 1]
+    assert results["std"][0, 1] == 0
+
+def test_block_median():
+    cube = random_cube()
+    assert numpy.array_equal(block_median(cube, NODATA), block_statistics(cube, NODATA)["median"])
+
+def test_unknown_statistic():
+    with pytest.raises(ValueError):
+        block_statistics(random_cube(), NODATA, ["mode"])
+
+def test_histogram_percentiles():
+    random = numpy.random.RandomState(2)
+    values = random.randint(0, 50, (6, 31))
+    histogram = numpy.zeros((6, 50), dtype=numpy.uint16)
+    for pixel, row in enumerate(values):
+        for value in row:
+            histogram[pixel, value] += 1
+    percentiles = [0.0, 10.0, 50.0, 62.5, 90.0, 100.0]
+    result = histogram_percentiles(histogram, percentiles, -20, chunk=4)
+    assert numpy.allclose(result, numpy.percentile(values, percentiles, axis=1) - 20)
+
+    # Pixels without values get the first value
+    histogram[2] = 0
+    assert numpy.all(histogram_percentiles(histogram, [50.0], -20)[:, 2] == -20)
+
+def test_histogram_percentiles_of_wide_bins():
+    # Evenly spread values within one bin of width 10
+    histogram = numpy.zeros((1, 5), dtype=numpy.uint16)
+    histogram[0, 2] = 10
+    assert numpy.allclose(histogram_percentiles(histogram, [0.0, 50.0, 100.0], 0, 10), [[20.0], [24.5], [29.0]])
+
+@pytest.mark.parametrize("band_group", [1, 5, 46])
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_streaming_statistics(band_group, seed):
+    cube = random_cube(seed=seed)
+    statistics = STATISTICS + ["p25"]
+    accumulator = StreamingStatistics(cube.shape[1:], NODATA, statistics)
+    for first in range(0, cube.shape[0], band_group):
+        accumulator.update(cube[first:first + band_group])
+    results = accumulator.result()
+    expected = block_statistics(cube, NODATA, statistics)
+    for name in statistics:
+        assert results[name].dtype == numpy.int16
+        if name.startswith("p"):
+            # The interpolation of numpy.percentile rounds differently, e.g.
+            # 1234.9999999 is truncated to 1234
+            assert numpy.all(numpy.abs(results[name] - expected[name]) <= 1)
+        else:
+            assert numpy.array_equal(results[name], expected[name])
+
+def test_streaming_statistics_single_band():
+    cube = random_cube(bands=3)
+    accumulator = StreamingStatistics(cube.shape[1:], NODATA, ["count", "max"])
+    for band in cube:
+        accumulator.update(band)
+    assert accumulator.histogram is None
+    results = accumulator.result()
+    assert numpy.array_equal(results["count"], numpy.sum(cube != NODATA, axis=0))
+    assert numpy.array_equal(results["max"], block_statistics(cube, NODATA, ["max"])["max"])
+
+def test_streaming_statistics_out_of_range():
+    cube = numpy.array([[[-2500]], [[12000]], [[5000]]], dtype=numpy.int16)
+    accumulator = StreamingStatistics((1, 1), NODATA, ["min", "max", "median"])
+    accumulator.update(cube)
+    results = accumulator.result()
+    # Minimum and maximum are exact, the histogram clips to the valid range
+    assert results["min"][0, 0] == -2500
+    assert results["max"][0, 0] == 12000
+    assert results["median"][0, 0] == 5000
@@ -0,0 +1,68 @@
+#
+# Tests of the time axis of a stack
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import os
+import pytest
+from processing.timeaxis import TimeAxis
+from processing.timeaxis import parse_date
+from processing.timeaxis import time_axis_from_files
+from processing.timeaxis import time_axis_filename
+from processing.timeaxis import get_time_axis
+
+DATES = ["A2000049", "A2000065", "A2000097", "A2000353", "A2001001"]
+
+def test_time_axis():
+    time_axis = TimeAxis(DATES)
+    assert len(time_axis) == 5
+    assert time_axis.frequency == 23
+    assert time_axis.date(3) == "A2000097"
+    assert time_axis.band("A2000097") == 3
+    assert time_axis.start == (2000, 4)
+    assert time_axis.period(4) == (2000, 23)
+    assert time_axis.period(5) == (2001, 1)
+    assert time_axis.missing() == [(2000, 6)] + [(2000, period) for period in range(8, 23)]
+    with pytest.raises(IndexError):
+        time_axis.date(0)
+    with pytest.raises(ValueError):
+        TimeAxis(DATES + ["A2000049"])
+
+def test_parse_date():
+    assert parse_date("A2000049") == (2000, 49)
+    with pytest.raises(ValueError):
+        parse_date("2000049")
+
+def test_get_time_axis(tmpdir):
+    directory = tmpdir.mkdir("h16v08")
+    stack = str(directory.join("NDVI.tif"))
+    for date in reversed(DATES):
+        directory.join("NDVI_MOD13Q1.%s.h16v08.tif" % date).write("")
+
+    # Stacks without a time axis file get it from the single date rasters
+    assert get_time_axis(stack).dates == DATES
+    assert time_axis_from_files(sorted(os.listdir(str(directory)))).dates == DATES
+
+    TimeAxis(DATES[:3]).save(time_axis_filename(stack))
+    assert time_axis_filename(stack) == str(directory.join("NDVI.dates.json"))
+    assert get_time_axis(stack).dates == DATES[:3]
+
+def test_missing_time_axis(tmpdir):
+    with pytest.raises(IOError):
+        get_time_axis(str(tmpdir.mkdir("h16v08").join("NDVI.tif")))
@@ -0,0 +1,70 @@
+#
+# Tests of the block-wise reading of a stack
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import numpy
+import pytest
+
+pytest.importorskip("osgeo.gdal")
+
+from processing.utilities import get_block_size
+from processing.utilities import get_block_windows
+from processing.utilities import read_block
+from processing.utilities import iter_time_blocks
+
+def stack(in_memory_dataset, block_size=(4, 2)):
+    data = numpy.arange(3 * 5 * 10, dtype=numpy.int16).reshape(3, 5, 10)
+    return in_memory_dataset(data, block_size)
+
+def test_block_windows(in_memory_dataset):
+    dataset = stack(in_memory_dataset)
+    assert get_block_size(dataset) == (4, 2)
+    windows = list(get_block_windows(dataset))
+    assert windows[:4] == [(0, 0, 4, 2), (4, 0, 4, 2), (8, 0, 2, 2), (0, 2, 4, 2)]
+    assert windows[-1] == (8, 4, 2, 1)
+    # The windows cover every pixel once
+    covered = numpy.zeros((5, 10), dtype=int)
+    for xoff, yoff, xsize, ysize in windows:
+        covered[yoff:yoff + ysize, xoff:xoff + xsize] += 1
+    assert numpy.all(covered == 1)
+
+def test_requested_block_size(in_memory_dataset):
+    dataset = stack(in_memory_dataset)
+    # Rounded up to full internal blocks and clipped to the raster
+    assert list(get_block_windows(dataset, (5, 1))) == [(0, 0, 8, 2), (8, 0, 2, 2), (0, 2, 8, 2),
+                                                         (8, 2, 2, 2), (0, 4, 8, 1), (8, 4, 2, 1)]
+    assert list(get_block_windows(dataset, (100, 100))) == [(0, 0, 10, 5)]
+
+def test_read_block(in_memory_dataset):
+    dataset = stack(in_memory_dataset)
+    cube = read_block(dataset, 4, 2, 4, 2)
+    assert cube.shape == (3, 2, 4)
+    assert cube.dtype == numpy.int16
+    assert numpy.array_equal(cube, dataset.data[:, 2:4, 4:8])
+    assert numpy.array_equal(read_block(dataset, 4, 2, 4, 2, bands=[3, 1]), dataset.data[[2, 0], 2:4, 4:8])
+
+def test_iter_time_blocks(in_memory_dataset):
+    dataset = stack(in_memory_dataset)
+    blocks = list(iter_time_blocks(dataset))
+    assert len(blocks) == 9
+    # One read per band and block
+    assert dataset.reads == 9 * 3
+    for (xoff, yoff, xsize, ysize), cube in blocks:
+        assert numpy.array_equal(cube, dataset.data[:, yoff:yoff + ysize, xoff:xoff + xsize])
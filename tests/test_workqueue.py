@@ -0,0 +1,221 @@
+#
+# Tests of the file based work queue
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import os
+import json
+import time
+import threading
+import multiprocessing
+import pytest
+from processing.journal import write_atomically
+from processing.workqueue import WorkQueue
+from processing.workqueue import Heartbeat
+
+def queues(directory, lease_time, workers=2):
+    """
+    Queues of several workers on the same directory.
+    """
+
+    return [WorkQueue(directory, lease_time, "worker%d" % i) for i in range(workers)]
+
+def read_lease(directory, unit):
+    with open(os.path.join(directory, "leases", "%s.lease" % unit)) as f:
+        return json.load(f)
+
+def expire(directory, unit):
+    """
+    Let the lease of a unit expire, e.g. of a crashed worker.
+    """
+
+    lease = read_lease(directory, unit)
+    lease["expires"] = time.time() - 1.0
+    write_atomically(os.path.join(directory, "leases", "%s.lease" % unit), json.dumps(lease))
+
+def drain(directory, worker, claimed):
+    """
+    Process units of the queue until none is left, the claimed units are
+    written to a file of the worker.
+    """
+
+    queue = WorkQueue(directory, 60.0, worker)
+    f = open(claimed, "w")
+    try:
+        while True:
+            result = queue.claim()
+            if result is None:
+                return
+            f.write("%s\n" % result[0])
+            f.flush()
+            queue.complete(result[0], {"worker": worker, "value": result[1]})
+    finally:
+        f.close()
+
+def test_claim_each_unit_once(tmpdir):
+    first, second = queues(str(tmpdir), 60.0)
+    first.add("h16v08.0", {"rows": [0, 128]})
+    first.add("h16v08.1", {"rows": [128, 256]})
+    # Adding is idempotent
+    second.add("h16v08.0", {"rows": [0, 64]})
+
+    assert first.claim() == ("h16v08.0", {"rows": [0, 128]})
+    assert second.claim() == ("h16v08.1", {"rows": [128, 256]})
+    assert first.claim() is None
+    assert second.claim() is None
+
+    # A released unit can be claimed again, a completed one not
+    first.release("h16v08.0")
+    second.complete("h16v08.1", [[1, 2, [3]]])
+    assert second.claim() == ("h16v08.0", {"rows": [0, 128]})
+    assert first.claim() is None
+    assert first.load("h16v08.1") == [[1, 2, [3]]]
+    assert first.completed() == ["h16v08.1"]
+
+def test_release_of_another_worker(tmpdir):
+    first, second = queues(str(tmpdir), 60.0)
+    first.add("unit", {})
+    assert first.claim()[0] == "unit"
+    second.release("unit")
+    assert not second.renew("unit")
+    assert second.claim() is None
+    assert first.renew("unit")
+
+def test_concurrent_claims(tmpdir):
+    workers = queues(str(tmpdir), 60.0, 8)
+    for i in range(20):
+        workers[0].add("unit%02d" % i, i)
+    claimed = []
+    lock = threading.Lock()
+    def work(queue):
+        while True:
+            result = queue.claim()
+            if result is None:
+                return
+            with lock:
+                claimed.append(result[0])
+    threads = [threading.Thread(target=work, args=(queue,)) for queue in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claimed) == workers[0].units()
+
+def test_worker_processes(tmpdir):
+    directory = str(tmpdir.join("queue"))
+    queue = WorkQueue(directory)
+    for i in range(60):
+        queue.add("unit%02d" % i, i)
+    processes = [multiprocessing.Process(target=drain, args=(directory, "worker%d" % i, str(tmpdir.join("claimed%d" % i))))
+                 for i in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0
+
+    # Every unit is completed by exactly one worker
+    claimed = []
+    for i in range(4):
+        with open(str(tmpdir.join("claimed%d" % i))) as f:
+            claimed.extend(line.strip() for line in f)
+    assert sorted(claimed) == queue.units()
+    assert queue.completed() == queue.units()
+    for unit in queue.units():
+        assert queue.load(unit)["worker"] in ["worker%d" % i for i in range(4)]
+    assert os.listdir(os.path.join(directory, "leases")) == []
+
+def test_expired_lease(tmpdir):
+    first, second = queues(str(tmpdir), 60.0)
+    first.add("unit", {})
+    assert first.claim()[0] == "unit"
+    assert second.claim() is None
+
+    # The first worker crashed, its lease expires
+    expire(str(tmpdir), "unit")
+    assert second.claim()[0] == "unit"
+    assert not first.renew("unit")
+    assert first.claim() is None
+    assert read_lease(str(tmpdir), "unit")["worker"] == "worker1"
+    assert not any(name.endswith(".tmp") or ".expired." in name or ".renew." in name
+                   for name in os.listdir(os.path.join(str(tmpdir), "leases")))
+
+    # Both workers may commit the unit, the results are the same
+    first.complete("unit", [1])
+    second.complete("unit", [1])
+    assert second.load("unit") == [1]
+
+def test_renew_after_takeover(tmpdir):
+    first, second = queues(str(tmpdir), 60.0)
+    first.add("unit", {})
+    assert first.claim()[0] == "unit"
+    stale = read_lease(str(tmpdir), "unit")
+    expire(str(tmpdir), "unit")
+    assert second.claim()[0] == "unit"
+
+    # The first worker read its own lease just before the second worker took
+    # the unit over, the renewal must not replace the new lease
+    first._read_lease = lambda unit: stale
+    assert not first.renew("unit")
+    assert read_lease(str(tmpdir), "unit")["worker"] == "worker1"
+    assert second.renew("unit")
+    assert read_lease(str(tmpdir), "unit")["worker"] == "worker1"
+
+def test_lease_of_the_unit(tmpdir):
+    first, second = queues(str(tmpdir), 0.2)
+    first.add("unit", {"lease": 60})
+    assert first.claim()[0] == "unit"
+    assert read_lease(str(tmpdir), "unit")["expires"] > time.time() + 30
+    assert first.renew("unit")
+    assert read_lease(str(tmpdir), "unit")["expires"] > time.time() + 30
+    assert second.claim() is None
+
+def test_heartbeat_keeps_the_lease(tmpdir):
+    first, second = queues(str(tmpdir), 0.4)
+    first.add("unit", {})
+    assert first.claim()[0] == "unit"
+    heartbeat = Heartbeat(first, "unit")
+    heartbeat.start()
+    try:
+        time.sleep(1.0)
+        assert second.claim() is None
+        assert not heartbeat.lost
+    finally:
+        heartbeat.stop()
+    assert not heartbeat.is_alive()
+
+    expire(str(tmpdir), "unit")
+    assert second.claim()[0] == "unit"
+
+def test_heartbeat_detects_a_lost_lease(tmpdir):
+    first, second = queues(str(tmpdir), 0.4)
+    first.add("unit", {})
+    assert first.claim()[0] == "unit"
+    heartbeat = Heartbeat(first, "unit")
+    # The worker was suspended longer than the lease
+    expire(str(tmpdir), "unit")
+    assert second.claim()[0] == "unit"
+    heartbeat.start()
+    heartbeat.join(5.0)
+    assert heartbeat.lost
+    heartbeat.stop()
+
+def test_invalid_unit_name(tmpdir):
+    with pytest.raises(ValueError):
+        WorkQueue(str(tmpdir)).add("h16v08/0", {})
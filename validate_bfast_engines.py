@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+#
+# Script to compare the NumPy BFast engine with the R BFast implementation
+# Copyright (C) 2014 Adrian Weber
+# Centre for Development and Environment, University of Bern
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import os
+import os.path
+import sys
+import time
+import argparse
+import logging
+import logging.config
+import numpy
+try:
+    import gdal
+except ImportError:
+    import osgeo.gdal as gdal
+try:
+    import gdalconst
+except ImportError:
+    import osgeo.gdalconst as gdalconst
+import read_bfast_breaks
+from processing import bfast_numpy
+from processing.utilities import get_time_array
+
+# Variable log needs to be global
+log = None
+
+def compare_breakpoints(expected, actual, tolerance):
+    """
+    Two lists of breakpoints agree if they have the same number of breaks and
+    each break differs by at most tolerance bands.
+    """
+
+    if len(expected) != len(actual):
+        return False
+    return all(abs(e - a) <= tolerance for e, a in zip(expected, actual))
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+
+    # Parse the command line options
+    parser = argparse.ArgumentParser(description="Compare the breakpoints of the NumPy engine with calc_bfast on sample pixels.")
+    parser.add_argument("tile", help="MODIS tile, e.g. h27v06")
+    parser.add_argument("--samples", type=int, default=100,
+                        help="Number of randomly selected mask pixels (default: 100)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed of the pixel selection (default: 0)")
+    parser.add_argument("--tolerance", type=int, default=0,
+                        help="Allowed difference of a breakpoint in bands (default: 0)")
+    parser.add_argument("--min-agreement", type=float, default=0.95,
+                        help="Minimal share of agreeing pixels to accept the engine (default: 0.95)")
+    args = parser.parse_args(argv[1:])
+
+    # Get the logging configuration file
+    logging.config.fileConfig(argv[0].replace("py", "ini"))
+    # Get the root logger from the config file
+    global log
+    log = logging.getLogger(__name__)
+    # read_bfast_breaks logs to the logger of its own module
+    read_bfast_breaks.log = logging.getLogger(read_bfast_breaks.__name__)
+
+    # Check if VITS_DATA_PATH is set as environment variable
+    if "VITS_DATA_PATH" not in os.environ:
+        log.error('"VITS_DATA_PATH" is not set in the environment.')
+        sys.exit(1)
+    if read_bfast_breaks.get_engine is None:
+        log.error('The R engine requires rpy2.')
+        sys.exit(1)
+
+    # Open the mask and the stacked NDVI image
+    mask_filename = '%s/MODIS/processed/MASK/%s/MASK_%s.tif' % (os.environ['VITS_DATA_PATH'], args.tile, args.tile)
+    mask_dataset = gdal.Open(mask_filename, gdalconst.GA_ReadOnly)
+    if mask_dataset is None:
+        log.error('Raster file "%s" could not be opened.' % mask_filename)
+        sys.exit(1)
+    filename = '%s/MODIS/processed/NDVI/%s/NDVI.tif' % (os.environ['VITS_DATA_PATH'], args.tile)
+    ds = gdal.Open(filename, gdalconst.GA_ReadOnly)
+    if ds is None:
+        log.error('Raster file "%s" could not be opened.' % filename)
+        sys.exit(1)
+
+    # Select random pixels within the mask
+    mask_band = mask_dataset.GetRasterBand(1)
+    mask_NODATA = mask_band.GetNoDataValue()
+    mask_pixel = mask_band.ReadAsArray(0, 0, mask_dataset.RasterXSize, mask_dataset.RasterYSize)
+    if mask_NODATA is None:
+        valid_pixels = numpy.argwhere(numpy.ones(mask_pixel.shape, dtype=bool))
+    else:
+        valid_pixels = numpy.argwhere(mask_pixel.astype(float) != mask_NODATA)
+    random = numpy.random.RandomState(args.seed)
+    samples = valid_pixels[random.permutation(len(valid_pixels))[:args.samples]]
+
+    # Get the time series of the sample pixels
+    time_arrays = numpy.column_stack([get_time_array(ds, col, row) for row, col in samples]) / 10000.0
+
+    # Calculate the breakpoints with R pixel by pixel
+    starttime = time.time()
+    expected = [read_bfast_breaks.calc_bfast(time_arrays[:, i]) for i in range(len(samples))]
+    rTime = time.time() - starttime
+
+    # and with the NumPy engine for all samples at once
+    starttime = time.time()
+    actual = bfast_numpy.get_engine().breakpoints_block(time_arrays)
+    numpyTime = time.time() - starttime
+
+    # Compare the results
+    agreeing = 0
+    sameCount = 0
+    for (row, col), e, a in zip(samples, expected, actual):
+        if len(e) == len(a):
+            sameCount += 1
+        if compare_breakpoints(e, a, args.tolerance):
+            agreeing += 1
+        else:
+            log.debug("Pixel x: %s, y: %s differs: R %s, NumPy %s" % (col, row, e, a))
+
+    nbrOfSamples = max(len(samples), 1)
+    agreement = float(agreeing) / nbrOfSamples
+    log.info("%d pixels compared: %.1f%% agree, %.1f%% have the same number of breaks" % (
+        len(samples), agreement * 100.0, float(sameCount) / nbrOfSamples * 100.0))
+    log.info("R took %.3f s, NumPy took %.3f s" % (rTime, numpyTime))
+
+    if agreement < args.min_agreement:
+        log.error("The agreement is below %.1f%%" % (args.min_agreement * 100.0))
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())